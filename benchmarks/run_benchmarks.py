@@ -0,0 +1,260 @@
+# Benchmarks of grein_loader against the local GREIN stand-in in tests/grein_server.py
+# Every benchmark runs in a new process, so the peak RSS is the one of the benchmark alone.
+# The stand-in server runs in the main process with the configured fixture size and latency.
+#
+# usage:
+#   python benchmarks/run_benchmarks.py --output results.json
+#   python benchmarks/run_benchmarks.py --compare results.json --max-regression 0.2
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import importlib.util
+import platform
+import statistics
+import subprocess
+import multiprocessing
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(_ROOT, "tests"))
+# an installed grein_loader is benchmarked, otherwise the one of the checkout, the benchmark processes
+# import this module again and get the same path
+if importlib.util.find_spec("grein_loader") is None:
+    sys.path.append(os.path.join(_ROOT, "src"))
+from grein_server import GreinServer, GreinFixtures  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _peak_rss() -> int:
+    """ peak resident set size of the process in bytes, None if it is not available """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in kilobytes on other platforms
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def bench_load_dataset(url: str, gse_ids: list, repeat: int, download_type: str = "RAW", sparse: bool = False):
+    """ loads one dataset per repetition with a new session, like grein_loader.load_dataset """
+    import grein_loader
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        with grein_loader.GreinSession(grein_url=url) as session:
+            session.load_dataset(gse_ids[i % len(gse_ids)], download_type, sparse=sparse)
+        times.append(time.perf_counter() - start)
+    return times, repeat
+
+
+def bench_session(url: str, gse_ids: list, repeat: int):
+    """ loads all datasets over one GreinSession """
+    import grein_loader
+    times = []
+    with grein_loader.GreinSession(grein_url=url) as session:
+        for i in range(repeat):
+            start = time.perf_counter()
+            session.load_dataset(gse_ids[i % len(gse_ids)])
+            times.append(time.perf_counter() - start)
+    return times, repeat
+
+
+def bench_load_overview(url: str, gse_ids: list, repeat: int):
+    import grein_loader
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with grein_loader.GreinSession(grein_url=url) as session:
+            session.load_overview()
+        times.append(time.perf_counter() - start)
+    return times, 0
+
+
+def bench_iter_overview(url: str, gse_ids: list, repeat: int):
+    import grein_loader
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with grein_loader.GreinSession(grein_url=url) as session:
+            for _ in session.iter_overview(page_size=1000, prefetch=True):
+                pass
+        times.append(time.perf_counter() - start)
+    return times, 0
+
+
+def _package_env() -> dict:
+    """ environment of a subprocess which imports the grein_loader imported by the benchmarks """
+    import grein_loader
+    path = os.path.dirname(os.path.dirname(os.path.abspath(grein_loader.__file__)))
+    return dict(os.environ, PYTHONPATH=os.pathsep.join([path, os.environ.get("PYTHONPATH", "")]))
+
+
+def bench_import(url: str, gse_ids: list, repeat: int):
+    """ imports the package in a new interpreter, the import is timed by the interpreter """
+    env = _package_env()
+    code = "import time; start = time.perf_counter(); import grein_loader; print(time.perf_counter() - start)"
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True)
+        times.append(float(output.stdout))
+    return times, 0
+
+
+def bench_cli_fetch(url: str, gse_ids: list, repeat: int):
+    """ runs grein-loader fetch for one dataset per repetition, including the start of the interpreter """
+    env = _package_env()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "grein_loader", "--grein-url", url, "fetch", gse_ids[i % len(gse_ids)]],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times, repeat
+
+
+BENCHMARKS = {
+    "load_dataset_raw": bench_load_dataset,
+    "load_dataset_normalized": lambda url, gse_ids, repeat: bench_load_dataset(url, gse_ids, repeat, "NORMALIZED"),
+    "load_dataset_sparse": lambda url, gse_ids, repeat: bench_load_dataset(url, gse_ids, repeat, sparse=True),
+    "session_datasets": bench_session,
+    "load_overview": bench_load_overview,
+    "iter_overview": bench_iter_overview,
+    "import": bench_import,
+    "cli_fetch": bench_cli_fetch,
+}
+
+
+def _run(name: str, url: str, gse_ids: list, repeat: int, queue: multiprocessing.Queue):
+    import grein_loader  # noqa: F401, the import is not part of the measured memory
+    rss_before = _peak_rss()
+    start = time.perf_counter()
+    times, n_datasets = BENCHMARKS[name](url, gse_ids, repeat)
+    total = time.perf_counter() - start
+    rss_after = _peak_rss()
+    queue.put({
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "total_seconds": total,
+        "datasets_per_second": n_datasets / total if n_datasets else None,
+        "peak_rss_bytes": rss_after,
+        "peak_rss_increase_bytes": None if rss_after is None else rss_after - rss_before,
+    })
+
+
+def run_benchmark(name: str, url: str, gse_ids: list, repeat: int) -> dict:
+    """ runs the benchmark name in a new process and returns its results,
+        raises RuntimeError if the process fails
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run, args=(name, url, gse_ids, repeat, results))
+    process.start()
+    result = None
+    try:
+        while result is None:
+            alive = process.is_alive()
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                # the result is written before the process exits, so it is read once more after the exit
+                if not alive:
+                    raise RuntimeError(f"Benchmark {name} exited with code {process.exitcode} without a result")
+    finally:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark {name} exited with code {process.exitcode}")
+    return result
+
+
+def _version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("grein_loader")
+    except Exception:
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    """ prints the change of every benchmark against baseline
+        :return: names of the benchmarks whose median time or peak RSS grew by more than max_regression
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        for key in ("median_seconds", "peak_rss_bytes"):
+            if not result.get(key) or not previous.get(key):
+                continue
+            change = result[key] / previous[key] - 1
+            flag = ""
+            if change > max_regression:
+                flag = "  REGRESSION"
+                regressions.append(f"{name}.{key}")
+            print(f"{name:26} {key:18} {previous[key]:14.4f} -> {result[key]:14.4f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks grein_loader against a local GREIN stand-in")
+    parser.add_argument("--datasets", type=int, default=5, help="number of datasets loaded by the benchmarks")
+    parser.add_argument("--overview-size", type=int, default=20000, help="number of datasets in the overview")
+    parser.add_argument("--genes", type=int, default=20000, help="number of genes per count matrix")
+    parser.add_argument("--samples", type=int, default=24, help="number of samples per dataset")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server waits before every response")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of every benchmark")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--compare", help="json results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="relative slowdown or memory growth reported as regression, exit code 1 if any")
+    args = parser.parse_args(argv)
+
+    fixtures = GreinFixtures(n_datasets=args.overview_size, n_genes=args.genes, n_samples=args.samples)
+    gse_ids = fixtures.gse_ids[:args.datasets]
+    # the count matrices are generated before the benchmarks start
+    for gse_id in gse_ids:
+        fixtures.count_matrix_csv(gse_id)
+        fixtures.count_matrix_csv(gse_id, normalized=True)
+
+    results = {
+        "version": _version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.time(),
+        "parameters": {key: value for key, value in vars(args).items()
+                       if key in ("datasets", "overview_size", "genes", "samples", "latency", "repeat")},
+        "results": {}
+    }
+    with GreinServer(fixtures, latency=args.latency) as server:
+        for name in args.only or BENCHMARKS:
+            result = run_benchmark(name, server.url, gse_ids, args.repeat)
+            results["results"][name] = result
+            rss = result["peak_rss_bytes"]
+            rate = result["datasets_per_second"]
+            print(f"{name:26} median {result['median_seconds']:8.4f}s"
+                  f"  peak RSS {'-' if rss is None else f'{rss / 2 ** 20:8.1f} MiB'}"
+                  f"{'' if rate is None else f'  {rate:7.2f} datasets/s'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,59 @@
 # short-cut for loading function
-from .load_dataset import load_dataset
-from .load_overview import load_overview
\ No newline at end of file
+# the functions and classes are imported from their modules when they are first accessed, so importing the
+# package does not import pandas, numpy and requests, e.g. for the command line interface
+import sys
+import types
+import importlib
+
+_EXPORTS = {
+    "load_dataset": ".load_dataset",
+    "load_datasets": ".load_datasets",
+    "load_overview": ".load_overview",
+    "iter_overview": ".load_overview",
+    "DatasetCache": ".cache",
+    "DatasetCatalog": ".catalog",
+    "CountMatrixStore": ".count_store",
+    "open_count_store": ".count_store",
+    "write_count_store": ".count_store",
+    "GreinMirror": ".mirror",
+    "SyncResult": ".mirror",
+    "merge_datasets": ".merge",
+    "MetadataIndex": ".metadata_index",
+    "SampleSelection": ".metadata_index",
+    "normalize_counts": ".normalization",
+    "tmm_factors": ".normalization",
+    "GreinSession": ".session",
+    "CountMatrices": ".session",
+    "SharedDataset": ".shared",
+    "share_dataset": ".shared",
+    "attach_dataset": ".shared",
+    "RequestScheduler": ".scheduler",
+    "LoadStats": ".stats",
+    "PhaseStats": ".stats",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name: str, value):
+        # importing the modules load_dataset, load_datasets and load_overview binds them to the package,
+        # grein_loader.load_dataset must stay the function
+        if name in _EXPORTS and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
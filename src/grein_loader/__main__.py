@@ -0,0 +1,5 @@
+# python -m grein_loader runs the command line interface
+import sys
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,299 @@
+# asyncio versions of load_dataset and load_overview based on aiohttp
+# the xhr_streaming response is read by a separate task while the xhr_send requests are sent,
+# so one event loop can keep many GREIN sessions in flight
+# return values are the same as for the synchronous functions
+
+import io
+import json
+import asyncio
+import logging
+import pandas
+from typing import List, Tuple
+from .exceptions import GreinLoaderException
+from .formatting import _format_description, _format_metadata, _metadata_labels, _generate_metadata_formdata, \
+    _format_overview_item
+from .session import MAX_GREIN_DATASETS, DEFAULT_TIMEOUT
+from . import sockjs
+from . import utils
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+LOGGER = logging.getLogger(__name__)
+
+_FORM_HEADERS = {
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Origin": "https://www.ilincs.org"
+}
+
+
+class _AsyncGreinConnection:
+    def __init__(self, session: "aiohttp.ClientSession", grein_url: str, timeout: float):
+        """ SockJS connection to GREIN. The xhr_streaming response is consumed by a reader task
+            which puts every decoded message in a queue, None marks the end of a streaming response.
+            A message which is not received within timeout seconds raises a GreinLoaderException.
+        """
+        self.session = session
+        self.grein_url = grein_url
+        self.timeout = timeout
+        n = utils.GreinLoaderUtils.get_random_url_string_parameter()
+        # xhr_streaming_url will always be used for streaming requests in the code
+        self.xhr_streaming_url = f"{grein_url}__sockjs__/n={n}/xhr_streaming"
+        # xhr_send_url will always be used for streaming requests in the code
+        self.xhr_send_url = f"{grein_url}__sockjs__/n={n}/xhr_send"
+        self.messages = asyncio.Queue()
+        self.reader = None
+        self.session_id = None
+        # highest message ids sent and acknowledged by GREIN
+        self.sent = -1
+        self.acked = -1
+
+    async def connect(self):
+        LOGGER.debug("Requesting Session")
+        try:
+            async with self.session.get(self.grein_url) as r:
+                r.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            LOGGER.error(f"GREIN not available with: {self.grein_url}")
+            raise GreinLoaderException(f"Failed to contact GREIN at {self.grein_url}: ", err)
+        LOGGER.debug("Connected to GREIN")
+
+        await self.open_stream()
+        await self.wait_for(lambda message: message.kind == sockjs.HEARTBEAT)
+        LOGGER.debug("Connection initialized")
+
+        # streaming request for configs and sessionId
+        await self.send('["0#0|o|"]')
+        config = None
+        for message in await self.wait_for_ack('["0#0|o|"]'):
+            if message.kind == sockjs.CONFIG:
+                config = message.data
+        if config is None:
+            LOGGER.error("Streaming Error")
+            raise GreinLoaderException("Streaming Error no config")
+        self.session_id = config["config"]["sessionId"]
+
+    async def open_stream(self):
+        """ opens a new xhr_streaming response, the reader task of the previous response must be finished """
+        try:
+            response = await self.session.post(self.xhr_streaming_url)
+            response.raise_for_status()
+        except aiohttp.ClientError as err:
+            LOGGER.error(f"Streaming error: {err}")
+            raise GreinLoaderException("Streaming error: ", err)
+        self.reader = asyncio.ensure_future(self._read_stream(response))
+
+    async def _read_stream(self, response: "aiohttp.ClientResponse"):
+        # frames are split by the decoder, shiny outputs can exceed the line limit of aiohttp's readline
+        decoder = sockjs.FrameDecoder()
+        try:
+            async for chunk in response.content.iter_any():
+                for message in decoder.feed(chunk):
+                    self.messages.put_nowait(message)
+        except aiohttp.ClientError as err:
+            LOGGER.error(f"Streaming error: {err}")
+        finally:
+            response.release()
+            self.messages.put_nowait(None)
+
+    async def wait_for(self, predicate) -> List[sockjs.Message]:
+        """ collects the streamed messages until predicate matches a message
+            :return: all messages including the matching one
+            :rtype: list of sockjs.Message
+        """
+        content = []
+        while True:
+            message = await self._next_message()
+            if message is None:
+                LOGGER.error("Streaming Error")
+                raise GreinLoaderException("Streaming connection closed before the expected message")
+            self._track_ack(message)
+            content.append(message)
+            if predicate(message):
+                return content
+
+    async def wait_for_ack(self, payload: str) -> List[sockjs.Message]:
+        """ collects the streamed messages until the message payload is acknowledged,
+            acknowledgements are cumulative
+        """
+        message_id = utils.GreinLoaderUtils.get_message_id(payload)
+        if self.acked >= message_id:
+            return []
+        return await self.wait_for(lambda message: self.acked >= message_id)
+
+    async def wait_for_stream_end(self):
+        message = await self._next_message()
+        while message is not None:
+            self._track_ack(message)
+            message = await self._next_message()
+
+    async def _next_message(self):
+        # GREIN sends a heartbeat every 25 seconds, a stream without messages for timeout seconds is lost
+        try:
+            return await asyncio.wait_for(self.messages.get(), self.timeout)
+        except asyncio.TimeoutError:
+            LOGGER.error(f"No message received from GREIN within {self.timeout} seconds")
+            raise GreinLoaderException(f"No message received from GREIN within {self.timeout} seconds")
+
+    def _track_ack(self, message: sockjs.Message):
+        if message.kind == sockjs.ACK:
+            # an id which cannot be parsed acknowledges everything sent
+            self.acked = self.sent if message.message_id is None else max(self.acked, message.message_id)
+
+    async def send(self, data: str):
+        self.sent = max(self.sent, utils.GreinLoaderUtils.get_message_id(data))
+        try:
+            async with self.session.post(self.xhr_send_url, data=data) as r:
+                r.raise_for_status()
+        except aiohttp.ClientError as err:
+            LOGGER.error(f"Streaming error with: {err}")
+            raise GreinLoaderException("Streaming error: ", err)
+
+    async def close(self):
+        if self.reader is not None and not self.reader.done():
+            self.reader.cancel()
+            try:
+                await self.reader
+            except asyncio.CancelledError:
+                pass
+
+
+def _client_session(timeout: float) -> "aiohttp.ClientSession":
+    if aiohttp is None:
+        raise GreinLoaderException("The asyncio loader requires aiohttp, install it with 'pip install aiohttp'")
+    # streaming responses stay open for the whole session, therefore no total timeout is set,
+    # a response which sends no data for timeout seconds is considered lost
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=timeout))
+
+
+async def load_dataset(gse_id: str, download_type: str = "RAW", grein_url: str = utils.GREIN_URL,
+                       timeout: float = DEFAULT_TIMEOUT) -> Tuple[dict, dict, pandas.DataFrame]:
+    """ Loads a dataset from GREIN without blocking the event loop.
+        :param: gse_id: The dataset's GSE id, download_type: The type of data to download for expression value, either RAW or NORMALIZED,
+                grein_url: url of the GREIN app, timeout: seconds to wait for data from GREIN
+        :type: gse_id: str, download_type: str, grein_url: str, timeout: float
+        :return: description, metadata, count_matrix of the GREIN dataset
+        :rtype: description:dict, metadata:dictionary, count_matrix:pandas dataframe
+    """
+    if download_type != "RAW" and download_type != "NORMALIZED":
+        LOGGER.error("Invalid download_type passed. Value must either by 'RAW' or 'NORMALIZED'.")
+        raise ValueError("Invalid download_type passed. Value must either by 'RAW' or 'NORMALIZED'.")
+
+    payloads = utils.GreinLoaderUtils(gse_id)
+    async with _client_session(timeout) as s:
+        connection = _AsyncGreinConnection(s, grein_url, timeout)
+        try:
+            await connection.connect()
+            session_url = f"{grein_url}session/{connection.session_id}/"
+            headers = dict(_FORM_HEADERS, Referer=f"{grein_url}?gse={gse_id}")
+
+            # the initial ui parameters end the first streaming response
+            await connection.send(payloads.ui_init_parameter())
+            await connection.wait_for_stream_end()
+
+            LOGGER.debug("Opening new connection")
+            await connection.open_stream()
+            await connection.send(payloads.method_update_parameter())
+            await connection.wait_for_ack(payloads.method_update_parameter())
+            await connection.send(payloads.client_parameter())
+            await connection.send(payloads.stream_dataset_parameter())
+            await connection.wait_for_ack(payloads.stream_dataset_parameter())
+
+            # the metadata labels update hides the geo_summary output, so it is sent after the description
+            # is received, in the same order as GreinSession
+            random_str = utils.GreinLoaderUtils.get_random_nonce_parameter()
+            try:
+                async with s.post(f"{session_url}dataobj/geo_summary?w=&nonce={random_str}",
+                                  headers=headers, data=payloads.description_formdata(100)) as r:
+                    r.raise_for_status()
+                    description_content = await r.read()
+            except aiohttp.ClientError as err:
+                LOGGER.error(f"Dataset description for {gse_id} not received")
+                raise GreinLoaderException(f"Dataset description for {gse_id} not received: ", err)
+
+            await connection.send(payloads.metadata_labels_parameter())
+            ui_content = await connection.wait_for_ack(payloads.metadata_labels_parameter())
+            meta_data_labels = _metadata_labels(ui_content)
+            description_data = json.loads(description_content.decode())
+            no_of_samples = description_data["data"][1][1]
+            metadata_formdata = _generate_metadata_formdata(len(meta_data_labels), no_of_samples)
+
+            async def request_metadata():
+                random_str = utils.GreinLoaderUtils.get_random_nonce_parameter()
+                try:
+                    async with s.post(f"{session_url}dataobj/metadata_full?w=&nonce={random_str}",
+                                      headers=headers, data=metadata_formdata) as r:
+                        return r.status, await r.read()
+                except aiohttp.ClientError as err:
+                    LOGGER.error(f"Metadata for {gse_id} not received.")
+                    raise GreinLoaderException(f"Metadata for {gse_id} not received: ", err)
+
+            async def request_count_matrix():
+                await connection.send(payloads.count_matrix_parameter())
+                await connection.wait_for_ack(payloads.count_matrix_parameter())
+                # in case method parameter is set to normalized, different request is send
+                if download_type == "NORMALIZED":
+                    await connection.send(payloads.count_matrix_normalized())
+                try:
+                    async with s.post(f"{session_url}download/downloadcounts?w=") as r:
+                        return r.status, await r.read()
+                except aiohttp.ClientError as err:
+                    LOGGER.error(f"Count Matrix for {gse_id} not received")
+                    raise GreinLoaderException(f"Count Matrix for {gse_id} not received: ", err)
+
+            (metadata_status, metadata_content), (count_matrix_status, count_matrix_content) = \
+                await asyncio.gather(request_metadata(), request_count_matrix())
+            LOGGER.debug("Count matrix received")
+        finally:
+            await connection.close()
+
+    description = _format_description(description_data)
+    metadata = ""
+    count_matrix = ""
+    if metadata_status != 500:
+        metadata = _format_metadata(json.loads(metadata_content.decode()), meta_data_labels)
+    if count_matrix_status != 500:
+        count_matrix = pandas.read_csv(io.BytesIO(count_matrix_content), sep=",")
+        # rename the first column name with "gene"
+        count_matrix.rename(columns={count_matrix.columns[0]: str("gene")}, inplace=True)
+    return description, metadata, count_matrix
+
+
+async def load_overview(no_datasets=None, grein_url: str = utils.GREIN_URL, timeout: float = DEFAULT_TIMEOUT) -> list:
+    """ loads overview of the number of datasets given as parameter without blocking the event loop
+        :param: no_datasets: int, default parameter are all datasets on grein,
+                grein_url: url of the GREIN app, timeout: seconds to wait for data from GREIN
+        :type: no_datasets: int, grein_url: str, timeout: float
+        :return: list of dict, each dict is one dataset in GREIN
+                 containing GEO id, number of samples, Species, title and summary
+        :rtype: list_overview:list of dictionaries
+    """
+    if no_datasets is None:
+        LOGGER.debug("Requesting all Datasets from GREIN")
+        no_datasets = MAX_GREIN_DATASETS
+
+    payloads = utils.GreinLoaderUtils()
+    async with _client_session(timeout) as s:
+        connection = _AsyncGreinConnection(s, grein_url, timeout)
+        try:
+            await connection.connect()
+            # requesting streaming parameter for overview page on GREIN
+            await connection.send(payloads.overview_streaming())
+            await connection.send(payloads.overview_streaming_updata())
+
+            random_str = utils.GreinLoaderUtils.get_random_nonce_parameter()
+            url_overview = f"{grein_url}session/{connection.session_id}/dataobj/datatable?w=&nonce={random_str}"
+            try:
+                async with s.post(url_overview, data=payloads.overview_form_data(no_datasets)) as r:
+                    r.raise_for_status()
+                    content_ = json.loads((await r.read()).decode())
+            except aiohttp.ClientError as err:
+                LOGGER.error(f"Overview streaming error {err}")
+                raise GreinLoaderException("Overview streaming error", err)
+        finally:
+            await connection.close()
+
+    return [_format_overview_item(item) for item in content_["data"]]
@@ -0,0 +1,175 @@
+# on-disk cache for datasets loaded by load_dataset, keyed by GSE id and download type
+# every entry is a directory holding description.json, metadata.json and the count matrix,
+# stored as feather if pyarrow is installed and as pickle otherwise or if it is sparse
+# entries are written to a temporary directory and renamed in place, so several processes
+# can share one cache directory
+
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import pandas
+from typing import Optional, Tuple
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+LOGGER = logging.getLogger(__name__)
+
+_ENTRY_FILE = "entry.json"
+_DESCRIPTION_FILE = "description.json"
+_METADATA_FILE = "metadata.json"
+_FEATHER_FILE = "count_matrix.feather"
+_PICKLE_FILE = "count_matrix.pkl"
+_TMP_PREFIX = ".tmp-"
+_STALE_TMP_AGE = 3600
+
+
+class DatasetCache:
+    def __init__(self, directory: str, max_size: int = None, ttl: float = None):
+        """Initialize a cache in directory, the directory is created if it does not exist.
+
+        :param directory: The directory holding the cached datasets
+        :type directory: str
+        :param max_size: Maximum size of the cache in bytes, least recently used entries are removed first, defaults to None (unbounded)
+        :type max_size: int, optional
+        :param ttl: Time in seconds after which an entry expires, defaults to None (never)
+        :type ttl: float, optional
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, gse_id: str, download_type: str) -> str:
+        return os.path.join(self.directory, f"{gse_id}-{download_type}")
+
+    def get(self, gse_id: str, download_type: str = "RAW") -> Optional[Tuple[dict, dict, pandas.DataFrame]]:
+        """ returns the cached dataset or None if it is not cached or expired
+            :return: description, metadata, count_matrix
+            :rtype: tuple or None
+        """
+        path = self._entry_path(gse_id, download_type)
+        try:
+            with open(os.path.join(path, _ENTRY_FILE)) as f:
+                entry = json.load(f)
+            if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+                LOGGER.debug(f"Cache entry for {gse_id} expired")
+                self._remove(path)
+                return None
+            with open(os.path.join(path, _DESCRIPTION_FILE)) as f:
+                description = json.load(f)
+            with open(os.path.join(path, _METADATA_FILE)) as f:
+                metadata = json.load(f)
+            if entry["format"] == "feather":
+                count_matrix = pandas.read_feather(os.path.join(path, _FEATHER_FILE))
+            else:
+                count_matrix = pandas.read_pickle(os.path.join(path, _PICKLE_FILE))
+            # the modification time of the entry is used as access time for the LRU eviction
+            os.utime(path)
+        except (OSError, ValueError, KeyError) as err:
+            if not isinstance(err, FileNotFoundError):
+                LOGGER.warning(f"Failed to read cache entry for {gse_id}: {err}")
+            return None
+        LOGGER.debug(f"Dataset {gse_id} loaded from cache")
+        return description, metadata, count_matrix
+
+    def put(self, gse_id: str, download_type: str, dataset: Tuple[dict, dict, pandas.DataFrame]):
+        """ stores a dataset returned by load_dataset, replacing an existing entry """
+        description, metadata, count_matrix = dataset
+        tmp_path = os.path.join(self.directory, _TMP_PREFIX + uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        try:
+            with open(os.path.join(tmp_path, _DESCRIPTION_FILE), "w") as f:
+                json.dump(description, f)
+            with open(os.path.join(tmp_path, _METADATA_FILE), "w") as f:
+                json.dump(metadata, f)
+            # feather does not support sparse columns
+            if pyarrow is not None and not any(isinstance(t, pandas.SparseDtype) for t in count_matrix.dtypes):
+                count_matrix.reset_index(drop=True).to_feather(os.path.join(tmp_path, _FEATHER_FILE))
+                storage_format = "feather"
+            else:
+                count_matrix.to_pickle(os.path.join(tmp_path, _PICKLE_FILE))
+                storage_format = "pickle"
+            with open(os.path.join(tmp_path, _ENTRY_FILE), "w") as f:
+                json.dump({"gse_id": gse_id, "download_type": download_type, "format": storage_format,
+                           "created": time.time()}, f)
+
+            path = self._entry_path(gse_id, download_type)
+            if os.path.exists(path):
+                self._remove(path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # another process stored the same dataset in the meantime
+                LOGGER.debug(f"Cache entry for {gse_id} already written")
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        if self.max_size is not None:
+            self.evict()
+
+    def evict(self):
+        """ removes expired entries and the least recently used entries until the cache fits into max_size """
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(_TMP_PREFIX):
+                self._remove_stale_tmp(path, now)
+                continue
+            if not os.path.isdir(path):
+                continue
+            try:
+                with open(os.path.join(path, _ENTRY_FILE)) as f:
+                    created = json.load(f)["created"]
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                accessed = os.path.getmtime(path)
+            except (OSError, ValueError, KeyError):
+                continue
+            if self.ttl is not None and now - created > self.ttl:
+                self._remove(path)
+                continue
+            entries.append((accessed, size, path))
+
+        if self.max_size is None:
+            return
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            LOGGER.debug(f"Evicting cache entry {path}")
+            self._remove(path)
+            total_size -= size
+
+    def clear(self):
+        """ removes all entries, entries which are being written by another writer are kept """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(_TMP_PREFIX):
+                self._remove_stale_tmp(path, now)
+            elif os.path.isdir(path):
+                self._remove(path)
+
+    @staticmethod
+    def _remove_stale_tmp(path: str, now: float):
+        # left behind by a crashed writer, a recent directory may still be filled by a concurrent put
+        try:
+            if os.path.isdir(path) and now - os.path.getmtime(path) > _STALE_TMP_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+    def _remove(self, path: str):
+        # renaming first makes the removal atomic for concurrent readers
+        trash_path = os.path.join(self.directory, _TMP_PREFIX + uuid.uuid4().hex)
+        try:
+            os.rename(path, trash_path)
+        except OSError:
+            return
+        shutil.rmtree(trash_path, ignore_errors=True)
@@ -0,0 +1,200 @@
+# local catalog of the GREIN overview stored in a SQLite database
+# title and study summary are indexed for full text search if SQLite provides FTS5,
+# species and number of samples have their own indexes
+# refresh only writes accessions which are new or changed on GREIN
+
+import time
+import sqlite3
+import logging
+from typing import Iterable, List, Optional
+from .session import GreinSession, OVERVIEW_PAGE_SIZE
+
+LOGGER = logging.getLogger(__name__)
+
+_FIELDS = ("geo_accession", "no_samples", "species", "title", "study_summary")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    geo_accession TEXT PRIMARY KEY,
+    no_samples INTEGER,
+    species TEXT,
+    title TEXT,
+    study_summary TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS datasets_species ON datasets (species, no_samples);
+CREATE INDEX IF NOT EXISTS datasets_no_samples ON datasets (no_samples);
+CREATE TABLE IF NOT EXISTS catalog_info (key TEXT PRIMARY KEY, value);
+"""
+
+# the full text index only references the rows of datasets, the triggers keep it in sync
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS datasets_fts USING fts5(
+    title, study_summary, content='datasets', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS datasets_fts_insert AFTER INSERT ON datasets BEGIN
+    INSERT INTO datasets_fts (rowid, title, study_summary) VALUES (new.rowid, new.title, new.study_summary);
+END;
+CREATE TRIGGER IF NOT EXISTS datasets_fts_delete AFTER DELETE ON datasets BEGIN
+    INSERT INTO datasets_fts (datasets_fts, rowid, title, study_summary)
+        VALUES ('delete', old.rowid, old.title, old.study_summary);
+END;
+CREATE TRIGGER IF NOT EXISTS datasets_fts_update AFTER UPDATE ON datasets BEGIN
+    INSERT INTO datasets_fts (datasets_fts, rowid, title, study_summary)
+        VALUES ('delete', old.rowid, old.title, old.study_summary);
+    INSERT INTO datasets_fts (rowid, title, study_summary) VALUES (new.rowid, new.title, new.study_summary);
+END;
+"""
+
+# rows are only rewritten if a field changed, unchanged rows keep their full text index entries
+_UPSERT = """
+INSERT INTO datasets (geo_accession, no_samples, species, title, study_summary, updated)
+VALUES (:geo_accession, :no_samples, :species, :title, :study_summary, :updated)
+ON CONFLICT (geo_accession) DO UPDATE SET
+    no_samples = excluded.no_samples, species = excluded.species, title = excluded.title,
+    study_summary = excluded.study_summary, updated = excluded.updated
+WHERE no_samples IS NOT excluded.no_samples OR species IS NOT excluded.species
+    OR title IS NOT excluded.title OR study_summary IS NOT excluded.study_summary
+"""
+
+
+class DatasetCatalog:
+    def __init__(self, path: str):
+        """Open the catalog stored in the SQLite database path, the database is created if it does not exist.
+
+        :param path: Path of the database file, ":memory:" keeps the catalog in memory
+        :type path: str
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+        try:
+            self._connection.executescript(_FTS_SCHEMA)
+            self.full_text_search = True
+        except sqlite3.OperationalError as err:
+            LOGGER.warning(f"SQLite without FTS5, text search falls back to LIKE: {err}")
+            self.full_text_search = False
+        self._connection.commit()
+
+    def __enter__(self) -> "DatasetCatalog":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM datasets").fetchone()[0]
+
+    def update(self, records: Iterable[dict]) -> int:
+        """ adds the overview records which are not stored yet and updates the changed ones
+            :param: records: dicts as returned by load_overview
+            :return: number of added or updated datasets
+            :rtype: int
+        """
+        now = time.time()
+        changed = 0
+        with self._connection:
+            for record in records:
+                row = {field: record.get(field) for field in _FIELDS}
+                row["updated"] = now
+                changed += self._connection.execute(_UPSERT, row).rowcount
+        LOGGER.debug(f"{changed} datasets added or updated in the catalog")
+        return changed
+
+    def refresh(self, session: GreinSession = None, page_size: int = OVERVIEW_PAGE_SIZE) -> int:
+        """ reads the overview from GREIN page by page and updates the catalog
+            :param: session: GreinSession used for the requests, a new session is opened by default,
+                    page_size: number of datasets requested at a time
+            :type: session: GreinSession, page_size: int
+            :return: number of added or updated datasets
+            :rtype: int
+        """
+        if session is None:
+            with GreinSession() as session:
+                return self.refresh(session, page_size)
+        changed = self.update(session.iter_overview(page_size, prefetch=True))
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO catalog_info (key, value) VALUES ('refreshed', ?)",
+                                     (time.time(),))
+        return changed
+
+    @property
+    def refreshed(self) -> Optional[float]:
+        """ time of the last refresh in seconds since the epoch, None if the catalog was never refreshed """
+        row = self._connection.execute("SELECT value FROM catalog_info WHERE key = 'refreshed'").fetchone()
+        return None if row is None else row[0]
+
+    def get(self, gse_id: str) -> Optional[dict]:
+        """ returns the overview record of gse_id or None if it is not in the catalog """
+        cursor = self._connection.execute(f"SELECT {', '.join(_FIELDS)} FROM datasets WHERE geo_accession = ?",
+                                          (gse_id,))
+        row = cursor.fetchone()
+        return None if row is None else dict(zip(_FIELDS, row))
+
+    def search(self, text: str = None, species: str = None, min_samples: int = None, max_samples: int = None,
+               limit: int = None) -> List[dict]:
+        """ searches the catalog, all given conditions must match
+            :param: text: words searched in title and study summary, all words must match, e.g. "breast cancer",
+                    OR between two words matches either of them, e.g. "lung OR liver", other characters of the
+                    FTS5 query syntax are searched as text, the results are ordered by relevance,
+                    species: exact species name, e.g. "Homo sapiens",
+                    min_samples, max_samples: inclusive bounds on the number of samples,
+                    limit: maximum number of results
+            :type: text: str, species: str, min_samples: int, max_samples: int, limit: int
+            :return: overview records in the format of load_overview
+            :rtype: list of dict
+        """
+        columns = ", ".join(f"datasets.{field}" for field in _FIELDS)
+        conditions = []
+        parameters = []
+        order = "datasets.geo_accession"
+        if text is not None and self.full_text_search:
+            query = f"SELECT {columns} FROM datasets_fts JOIN datasets ON datasets.rowid = datasets_fts.rowid"
+            match = _fts_query(text)
+            if match:
+                conditions.append("datasets_fts MATCH ?")
+                parameters.append(match)
+            order = "datasets_fts.rank"
+        else:
+            query = f"SELECT {columns} FROM datasets"
+            if text is not None:
+                for word in text.split():
+                    conditions.append("(datasets.title LIKE ? OR datasets.study_summary LIKE ?)")
+                    parameters += [f"%{word}%"] * 2
+        if species is not None:
+            conditions.append("datasets.species = ?")
+            parameters.append(species)
+        if min_samples is not None:
+            conditions.append("datasets.no_samples >= ?")
+            parameters.append(min_samples)
+        if max_samples is not None:
+            conditions.append("datasets.no_samples <= ?")
+            parameters.append(max_samples)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {order}"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return [dict(zip(_FIELDS, row)) for row in self._connection.execute(query, parameters)]
+
+    def species(self) -> dict:
+        """ returns the number of datasets for every species in the catalog """
+        return dict(self._connection.execute("SELECT species, COUNT(*) FROM datasets GROUP BY species"))
+
+
+def _fts_query(text: str) -> str:
+    """ quotes every word of text as FTS5 string, so words like T-cell or GSE1: are not read as query syntax,
+        OR between two words is kept as operator
+    """
+    words = text.split()
+    terms = []
+    for i, word in enumerate(words):
+        if word == "OR" and 0 < i < len(words) - 1 and terms[-1] != "OR" and words[i + 1] != "OR":
+            terms.append(word)
+        else:
+            terms.append('"' + word.replace('"', '""') + '"')
+    return " ".join(terms)
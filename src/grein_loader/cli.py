@@ -0,0 +1,231 @@
+# command line interface of grein_loader, installed as grein-loader
+# pandas and requests are only imported by the commands which need them, so the interface starts quickly.
+# Results are written as soon as a dataset is loaded: one JSON line per dataset on stdout and, with
+# --format csv or parquet, the count matrix as a file in the output directory.
+#
+# usage:
+#   grein-loader overview --species "Homo sapiens" --ids-only > gse_ids.txt
+#   grein-loader fetch GSE112749 GSE100075 > datasets.jsonl
+#   grein-loader batch --format csv --output-dir counts --workers 4 < gse_ids.txt
+
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+import concurrent.futures
+from typing import Iterable, Iterator
+
+LOGGER = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ("jsonl", "csv", "parquet")
+
+
+def main(argv=None) -> int:
+    parser = _parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if args.command in ("fetch", "batch"):
+        if args.format != "jsonl" and args.output_dir is None:
+            parser.error(f"--format {args.format} requires --output-dir")
+        if args.format == "parquet" and not _parquet_available():
+            parser.error("--format parquet requires pyarrow or fastparquet")
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+    try:
+        if args.command == "overview":
+            return _overview(args)
+        gse_ids = args.gse_ids if args.command == "fetch" else _read_gse_ids(sys.stdin)
+        return _fetch(gse_ids, args)
+    except BrokenPipeError:
+        # the reader of stdout stopped, e.g. head, the remaining output is discarded
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except KeyboardInterrupt:
+        return 130
+
+
+def _parser() -> argparse.ArgumentParser:
+    from . import utils
+    parser = argparse.ArgumentParser(prog="grein-loader", description="Loads datasets from GREIN")
+    parser.add_argument("--grein-url", default=utils.GREIN_URL, help="url of the GREIN app")
+    parser.add_argument("--verbose", action="store_true", help="log the progress to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    overview = commands.add_parser("overview", help="writes the datasets on GREIN as JSON lines")
+    overview.add_argument("--species", help="only datasets of this species, e.g. 'Homo sapiens'")
+    overview.add_argument("--limit", type=int, help="maximum number of datasets")
+    overview.add_argument("--page-size", type=int, default=1000, help="datasets requested at a time")
+    overview.add_argument("--ids-only", action="store_true", help="write only the GSE ids, one per line")
+
+    fetch = commands.add_parser("fetch", help="loads the datasets given as arguments")
+    fetch.add_argument("gse_ids", nargs="+", metavar="GSE_ID")
+    batch = commands.add_parser("batch", help="loads the datasets whose GSE ids are read from stdin")
+    for command in (fetch, batch):
+        command.add_argument("--download-type", default="RAW", choices=["RAW", "NORMALIZED", "BOTH"])
+        command.add_argument("--parts", nargs="+", default=["description", "metadata", "counts"],
+                             choices=["description", "metadata", "counts"], help="parts of the datasets to load")
+        command.add_argument("--format", default="jsonl", choices=OUTPUT_FORMATS,
+                             help="jsonl writes the count matrix into the JSON line, csv and parquet write it to "
+                                  "a file in --output-dir")
+        command.add_argument("--output-dir", help="directory of the count matrix files")
+        command.add_argument("--gzip", action="store_true", help="gzip compress csv files")
+        command.add_argument("--dtype", help="dtype of the expression values, e.g. float32")
+        command.add_argument("--workers", type=int, default=4, help="number of datasets loaded at the same time")
+        command.add_argument("--rate", type=float, default=10.0, help="initial number of requests per second")
+        command.add_argument("--retries", type=int, default=3, help="retries of a failed request")
+    return parser
+
+
+def _overview(args) -> int:
+    from .session import GreinSession
+    n_datasets = 0
+    with GreinSession(args.grein_url) as session:
+        for record in session.iter_overview(args.page_size, prefetch=True):
+            if args.species is not None and record["species"] != args.species:
+                continue
+            _write_line(record["geo_accession"] if args.ids_only else json.dumps(record))
+            n_datasets += 1
+            if args.limit is not None and n_datasets >= args.limit:
+                break
+    LOGGER.info(f"{n_datasets} datasets written")
+    return 0
+
+
+def _read_gse_ids(lines: Iterable[str]) -> Iterator[str]:
+    """ yields the GSE ids of lines, separated by whitespace or commas, lines starting with # are skipped """
+    for line in lines:
+        if line.lstrip().startswith("#"):
+            continue
+        yield from (gse_id for gse_id in line.replace(",", " ").split())
+
+
+def _fetch(gse_ids: Iterable[str], args) -> int:
+    """ loads the datasets in parallel and writes every dataset as soon as it is loaded """
+    from .session import GreinSession
+    from .scheduler import RequestScheduler
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    scheduler = RequestScheduler(max_sessions=args.workers, rate=args.rate, max_rate=max(100.0, args.rate),
+                                 retries=args.retries)
+    sessions = []
+    local = threading.local()
+
+    def fetch(gse_id: str) -> str:
+        # sessions are kept by the worker threads, so the connection is reused for their next dataset
+        if getattr(local, "session", None) is None:
+            local.session = GreinSession(args.grein_url, scheduler=scheduler)
+            sessions.append(local.session)
+        return _load(local.session, gse_id, args)
+
+    failed = 0
+    gse_ids = iter(gse_ids)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+            # only a few datasets are submitted ahead, so stdin is read while the datasets are loaded
+            pending = {}
+            for gse_id in gse_ids:
+                pending[executor.submit(fetch, gse_id)] = gse_id
+                if len(pending) >= 2 * args.workers:
+                    break
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    gse_id = pending.pop(future)
+                    next_gse_id = next(gse_ids, None)
+                    if next_gse_id is not None:
+                        pending[executor.submit(fetch, next_gse_id)] = next_gse_id
+                    try:
+                        line = future.result()
+                    except Exception as err:
+                        LOGGER.error(f"Failed to load dataset {gse_id}: {err}")
+                        line = json.dumps({"gse_id": gse_id, "error": str(err)})
+                        failed += 1
+                    try:
+                        _write_line(line)
+                    except BrokenPipeError:
+                        for future_pending in pending:
+                            future_pending.cancel()
+                        raise
+    finally:
+        for session in sessions:
+            session.close()
+    return 1 if failed else 0
+
+
+def _load(session, gse_id: str, args) -> str:
+    """ loads a dataset, writes its count matrix files and returns its JSON line """
+    record = {"gse_id": gse_id}
+    download_counts_to = None
+    if args.format == "csv" and args.download_type != "BOTH" and "counts" in args.parts and args.dtype is None:
+        # the csv is written while it is downloaded without parsing it
+        download_counts_to = _count_matrix_path(gse_id, args)
+    description, metadata, count_matrix = session.load_dataset(gse_id, args.download_type, dtype=args.dtype,
+                                                               parts=args.parts,
+                                                               download_counts_to=download_counts_to)
+    if "description" in args.parts:
+        record["description"] = description
+    if "metadata" in args.parts:
+        record["metadata"] = metadata
+    if "counts" not in args.parts:
+        return json.dumps(record)
+
+    matrices = dict(zip(("raw", "normalized"), count_matrix)) if args.download_type == "BOTH" \
+        else {None: count_matrix}
+    if args.format == "jsonl":
+        # pandas writes the values, which is considerably faster than json.dumps
+        counts = {name: _count_matrix_json(matrix) for name, matrix in matrices.items()}
+        line = json.dumps(record)
+        values = counts[None] if None in counts else \
+            "{" + ", ".join(f"{json.dumps(name)}: {value}" for name, value in counts.items()) + "}"
+        return f"{line[:-1]}, \"count_matrix\": {values}}}"
+
+    files = []
+    for name, matrix in matrices.items():
+        if isinstance(matrix, str) and matrix == download_counts_to:
+            files.append(matrix)
+        elif not isinstance(matrix, str):
+            files.append(_write_count_matrix(matrix, _count_matrix_path(gse_id, args, name), args.format))
+    record["files"] = files
+    return json.dumps(record)
+
+
+def _count_matrix_path(gse_id: str, args, name: str = None) -> str:
+    suffix = ".parquet" if args.format == "parquet" else ".csv.gz" if args.gzip else ".csv"
+    return os.path.join(args.output_dir, f"{gse_id}{'' if name is None else '_' + name}{suffix}")
+
+
+def _count_matrix_json(count_matrix) -> str:
+    """ count matrix as JSON object with the samples as "columns", the genes as "index" and the rows as "data" """
+    if isinstance(count_matrix, str):
+        return "null"
+    return count_matrix.set_index("gene").to_json(orient="split")
+
+
+def _write_count_matrix(count_matrix, path: str, output_format: str) -> str:
+    # the file is renamed when it is complete, so a reader never sees a partial file
+    part_path = path + ".part"
+    if output_format == "parquet":
+        count_matrix.to_parquet(part_path, index=False)
+    else:
+        # like the csv of GREIN, the column of the genes has no name
+        count_matrix.rename(columns={"gene": ""}).to_csv(part_path, index=False,
+                                                          compression="gzip" if path.endswith(".gz") else None)
+    os.replace(part_path, path)
+    return path
+
+
+def _write_line(line: str):
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def _parquet_available() -> bool:
+    import importlib.util
+    return any(importlib.util.find_spec(module) is not None for module in ("pyarrow", "fastparquet"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
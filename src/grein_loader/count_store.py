@@ -0,0 +1,192 @@
+# on-disk store of a genes x samples count matrix which is opened as numpy memmap
+# a store is a directory holding counts.dat with the values in row-major order, so the rows of a gene
+# are contiguous, genes.txt and samples.txt with one id per line and store.json with dtype and shape
+# the count matrix is written in chunks of rows while it is downloaded and never held in memory as a whole
+
+import os
+import json
+import uuid
+import shutil
+import logging
+import numpy
+import pandas
+from typing import Iterable, List, Optional
+from .formatting import _read_column_dtypes, _select_count_chunks
+
+LOGGER = logging.getLogger(__name__)
+
+# rows of the count matrix parsed and written at a time
+STORE_CHUNK_SIZE = 10000
+DEFAULT_STORE_DTYPE = "float64"
+
+_STORE_FILE = "store.json"
+_VALUES_FILE = "counts.dat"
+_GENES_FILE = "genes.txt"
+_SAMPLES_FILE = "samples.txt"
+# written by merge_datasets
+_PROVENANCE_FILE = "provenance.csv"
+
+
+class CountMatrixStore:
+    def __init__(self, directory: str, mode: str = "r"):
+        """Open a count matrix store, the values are mapped lazily and only the accessed pages are read.
+        Several processes opening the same store share the mapped pages.
+
+        :param directory: The directory of the store written by write_count_store or load_dataset
+        :type directory: str
+        :param mode: numpy.memmap mode, "r" for read only or "r+" to modify the values, defaults to "r"
+        :type mode: str, optional
+        """
+        self.directory = directory
+        with open(os.path.join(directory, _STORE_FILE)) as f:
+            self.info = json.load(f)
+        self.genes = pandas.Index(_read_ids(os.path.join(directory, _GENES_FILE)), name="gene")
+        self.samples = pandas.Index(_read_ids(os.path.join(directory, _SAMPLES_FILE)))
+        shape = (len(self.genes), len(self.samples))
+        if self.info["shape"] != list(shape):
+            raise ValueError(f"Count matrix store {directory} is incomplete")
+        # numpy cannot map an empty file
+        self.values = numpy.zeros(shape, dtype=self.info["dtype"]) if 0 in shape else \
+            numpy.memmap(os.path.join(directory, _VALUES_FILE), dtype=self.info["dtype"], mode=mode, shape=shape)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        return self.values.dtype
+
+    def __len__(self) -> int:
+        return len(self.genes)
+
+    @property
+    def provenance(self) -> Optional[pandas.DataFrame]:
+        """ the series and the metadata of every sample of a store written by merge_datasets,
+            None for the store of a single series
+        """
+        path = os.path.join(self.directory, _PROVENANCE_FILE)
+        if not os.path.exists(path):
+            return None
+        return pandas.read_csv(path, index_col="sample", dtype=str)
+
+    def select(self, genes: Iterable[str] = None, samples: Iterable[str] = None) -> pandas.DataFrame:
+        """ reads the values of some genes and samples, only the rows of the selected genes are read
+            :param: genes: gene ids, all genes by default, samples: sample ids, all samples by default
+            :type: genes: iterable of str, samples: iterable of str
+            :return: the values with the genes as index and the samples as columns
+            :rtype: pandas dataframe
+        """
+        gene_index = self.genes if genes is None else pandas.Index(list(genes), name="gene")
+        sample_index = self.samples if samples is None else pandas.Index(list(samples))
+        rows = slice(None) if genes is None else self._positions(self.genes, gene_index)
+        columns = slice(None) if samples is None else self._positions(self.samples, sample_index)
+        if isinstance(rows, slice):
+            values = self.values[:, columns]
+        else:
+            # rows are read in the order they are stored in
+            order = numpy.argsort(rows, kind="stable")
+            values = numpy.empty((len(rows), self.shape[1] if isinstance(columns, slice) else len(columns)),
+                                 dtype=self.dtype)
+            values[order] = self.values[rows[order]][:, columns]
+        return pandas.DataFrame(numpy.asarray(values), index=gene_index, columns=sample_index)
+
+    @staticmethod
+    def _positions(index: pandas.Index, labels: pandas.Index) -> numpy.ndarray:
+        positions = index.get_indexer(labels)
+        if (positions < 0).any():
+            raise KeyError(f"Not in the count matrix store: {', '.join(map(str, labels[positions < 0][:10]))}")
+        return positions
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """ reads the whole count matrix in the format returned by load_dataset """
+        return self.select().reset_index()
+
+
+def open_count_store(directory: str, mode: str = "r") -> CountMatrixStore:
+    """ opens the count matrix store in directory, see CountMatrixStore """
+    return CountMatrixStore(directory, mode)
+
+
+def write_count_store(count_matrix: pandas.DataFrame, directory: str, dtype: str = None) -> CountMatrixStore:
+    """ writes a count matrix returned by load_dataset to a store
+        :param: count_matrix: dense count matrix with a "gene" column or with the genes as index,
+                directory: directory of the store, replaced if it exists,
+                dtype: dtype of the stored values, defaults to float64
+        :type: count_matrix: pandas dataframe, directory: str, dtype: str
+        :return: the opened store
+        :rtype: CountMatrixStore
+    """
+    if "gene" in count_matrix.columns:
+        count_matrix = count_matrix.set_index("gene")
+    chunks = (count_matrix.iloc[start:start + STORE_CHUNK_SIZE]
+              for start in range(0, len(count_matrix), STORE_CHUNK_SIZE))
+    return _write_store(directory, list(count_matrix.columns), chunks, dtype)
+
+
+def _store_count_matrix(count_matrix_r, directory: str, dtype: str = None, stats=None, genes: List[str] = None,
+                        samples: List[str] = None) -> CountMatrixStore:
+    """
+    Writes the count matrix to a store while it is downloaded, the response must be requested with stream=True.
+    :param: count_matrix_r: response of the downloadcounts request, directory: directory of the store,
+            dtype: dtype of the stored values, stats: LoadStats reading the body is counted in as counts_download,
+            genes: only store the rows of these genes, samples: only store the columns of these samples
+    :type: count_matrix_r: requests.Response, directory: str, dtype: str, stats: LoadStats, genes: list,
+           samples: list
+    :return: the opened store
+    :rtype: CountMatrixStore
+    """
+    count_matrix_r.raw.decode_content = True  # undo a gzip or deflate transfer encoding
+    body = count_matrix_r.raw if stats is None else stats.reader(count_matrix_r.raw, "counts_download")
+    dtype = dtype or DEFAULT_STORE_DTYPE
+    if genes is not None or samples is not None:
+        selected_samples, chunks = _select_count_chunks(body, dtype, genes, samples, STORE_CHUNK_SIZE)
+        return _write_store(directory, selected_samples, chunks, dtype)
+    # the first column holds the gene ids, all other columns are parsed as dtype
+    columns, column_dtypes, body = _read_column_dtypes(body, dtype)
+    reader = pandas.read_csv(body, sep=",", header=None, names=columns, index_col=0, chunksize=STORE_CHUNK_SIZE,
+                             dtype=column_dtypes)
+    with reader:
+        first = next(reader, None)
+        if first is None:
+            raise ValueError("The count matrix is empty")
+
+        def chunks():
+            yield first
+            yield from reader
+        return _write_store(directory, list(first.columns), chunks(), dtype)
+
+
+def _write_store(directory: str, samples: List[str], chunks: Iterable[pandas.DataFrame],
+                 dtype: str = None) -> CountMatrixStore:
+    dtype = numpy.dtype(dtype or DEFAULT_STORE_DTYPE)
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    # the store is written to a temporary directory and renamed when it is complete
+    tmp_directory = os.path.join(parent, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_directory)
+    try:
+        n_genes = 0
+        with open(os.path.join(tmp_directory, _VALUES_FILE), "wb") as values_file, \
+                open(os.path.join(tmp_directory, _GENES_FILE), "w") as genes_file:
+            for chunk in chunks:
+                numpy.ascontiguousarray(chunk.to_numpy(dtype=dtype)).tofile(values_file)
+                genes_file.writelines(f"{gene}\n" for gene in chunk.index)
+                n_genes += len(chunk)
+        with open(os.path.join(tmp_directory, _SAMPLES_FILE), "w") as f:
+            f.writelines(f"{sample}\n" for sample in samples)
+        with open(os.path.join(tmp_directory, _STORE_FILE), "w") as f:
+            json.dump({"dtype": dtype.str, "shape": [n_genes, len(samples)], "order": "C"}, f)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(tmp_directory, directory)
+    finally:
+        if os.path.exists(tmp_directory):
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+    LOGGER.debug(f"Count matrix with {n_genes} genes and {len(samples)} samples written to {directory}")
+    return CountMatrixStore(directory)
+
+
+def _read_ids(path: str) -> List[str]:
+    with open(path) as f:
+        return f.read().splitlines()
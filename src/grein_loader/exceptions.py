@@ -1,2 +1,7 @@
 class GreinLoaderException(Exception):
+    pass
+
+
+class GreinSessionExpiredException(GreinLoaderException):
+    """The shiny session on GREIN expired or the connection to it was lost."""
     pass
\ No newline at end of file
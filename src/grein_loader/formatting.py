@@ -0,0 +1,429 @@
+# helper functions parsing and formatting the responses of GREIN, shared by the synchronous
+# and the asyncio loaders
+
+import io
+import os
+import re
+import csv
+import gzip
+import shutil
+import logging
+import pandas
+from typing import Iterable, Iterator, List, Tuple
+from . import sockjs
+from . import utils
+
+LOGGER = logging.getLogger(__name__)
+
+# rows of the count matrix converted to the sparse format at a time
+SPARSE_CHUNK_SIZE = 10000
+# rows of the count matrix parsed at a time if genes or samples are selected
+SELECT_CHUNK_SIZE = 10000
+# bytes of the count matrix written to disk at a time
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _read_count_matrix(count_matrix_r, dtype=None, sparse=False, stats=None, genes=None, samples=None):
+    """
+    Parses the count matrix while it is downloaded, the response must be requested with stream=True.
+    The csv parser reads the body in chunks, so the response is never held in memory as a whole.
+    :param: count_matrix_r: response of the downloadcounts request, dtype: dtype of the expression values,
+            sparse: convert the count matrix to a sparse dataframe chunk by chunk,
+            stats: LoadStats the time spent reading the body is counted in as counts_download,
+            genes: only keep the rows of these genes, samples: only parse the columns of these samples
+    :type: count_matrix_r: requests.Response, dtype: str, sparse: bool, stats: LoadStats, genes: list,
+           samples: list
+    :return: count_matrix with the first column named "gene", or the genes as index if sparse is set
+    :rtype: count_matrix: pandas dataframe
+    """
+    count_matrix_r.raw.decode_content = True  # undo a gzip or deflate transfer encoding
+    body = count_matrix_r.raw if stats is None else stats.reader(count_matrix_r.raw, "counts_download")
+    if genes is not None or samples is not None:
+        selected_samples, chunks = _select_count_chunks(body, dtype, genes, samples)
+        chunks = [_compact_count_matrix(chunk, None, True) if sparse else chunk for chunk in chunks]
+        count_matrix = pandas.concat(chunks) if chunks else \
+            pandas.DataFrame(columns=selected_samples, index=pandas.Index([], name="gene"), dtype=dtype)
+        count_matrix.index.name = "gene"
+        return count_matrix if sparse else count_matrix.reset_index()
+    columns, column_dtypes, body = _read_column_dtypes(body, dtype)
+    if not sparse:
+        count_matrix = pandas.read_csv(body, sep=",", header=None, names=columns, dtype=column_dtypes)
+        # rename the first column name with "gene"
+        count_matrix.rename(columns={count_matrix.columns[0]: str("gene")}, inplace=True)
+        return count_matrix
+
+    # only one chunk of the count matrix is held as dense dataframe at a time
+    chunks = [
+        _compact_count_matrix(chunk, None, True)
+        for chunk in pandas.read_csv(body, sep=",", header=None, names=columns, dtype=column_dtypes, index_col=0,
+                                     chunksize=SPARSE_CHUNK_SIZE)
+    ]
+    count_matrix = pandas.concat(chunks)
+    count_matrix.index.name = "gene"
+    return count_matrix
+
+
+def _select_count_chunks(body, dtype=None, genes: Iterable[str] = None, samples: Iterable[str] = None,
+                         chunksize: int = SELECT_CHUNK_SIZE) -> Tuple[List[str], Iterator[pandas.DataFrame]]:
+    """
+    Parses the count matrix csv in chunks with the genes as index. Only the columns of the selected samples
+    are parsed and the rows of the other genes are dropped chunk by chunk, so memory and parse time depend
+    on the selection. Genes and samples keep the order of the count matrix.
+    :param: body: file-like object of the csv, dtype: dtype of the expression values,
+            genes: only keep the rows of these genes, all genes if None,
+            samples: only parse the columns of these samples, all samples if None, chunksize: rows parsed at a time
+    :type: body: file-like object, dtype: str, genes: iterable of str, samples: iterable of str, chunksize: int
+    :return: the selected sample ids and an iterator over the chunks
+    :rtype: list of str, iterator of pandas dataframes
+    """
+    header, body = _read_header(body)
+    columns = next(csv.reader([header.decode()]), [""])
+    columns[0] = "gene"
+    positions = list(range(1, len(columns)))
+    if samples is not None:
+        wanted = set(samples)
+        positions = [position for position in positions if columns[position] in wanted]
+        missing = wanted.difference(columns[1:])
+        if missing:
+            LOGGER.warning(f"{len(missing)} samples are not in the count matrix: {', '.join(sorted(missing)[:10])}")
+    selected_samples = [columns[position] for position in positions]
+    column_dtypes = {"gene": object}
+    if dtype is not None:
+        column_dtypes.update((sample, dtype) for sample in selected_samples)
+    gene_index = None if genes is None else pandas.Index(list(genes))
+
+    def chunks():
+        if not header:
+            return
+        reader = pandas.read_csv(body, sep=",", header=None, names=columns, usecols=[0] + positions, index_col=0,
+                                 dtype=column_dtypes, chunksize=chunksize)
+        found = 0
+        with reader:
+            for chunk in reader:
+                if gene_index is not None:
+                    chunk = chunk[chunk.index.isin(gene_index)]
+                    found += len(chunk)
+                yield chunk
+        if gene_index is not None and found < len(gene_index):
+            LOGGER.debug(f"{len(gene_index) - found} of {len(gene_index)} genes are not in the count matrix")
+    return selected_samples, chunks()
+
+
+def _read_column_dtypes(body, dtype=None) -> Tuple[List[str], dict, "_PrefixedReader"]:
+    """
+    Reads the header of the count matrix csv, the first column holds the gene ids and is named "gene",
+    all other columns use dtype.
+    :param: body: file-like object of the csv, dtype: dtype of the expression values
+    :type: body: file-like object, dtype: str
+    :return: the column names, the dtype of each column (None if dtype is None) and a reader of the rows
+    :rtype: list of str, dict, file-like object
+    """
+    header, body = _read_header(body)
+    if not header:
+        LOGGER.error("The count matrix is empty")
+        raise ValueError("The count matrix is empty")
+    columns = next(csv.reader([header.decode()]))
+    columns[0] = "gene"
+    column_dtypes = None
+    if dtype is not None:
+        column_dtypes = {column: dtype for column in columns[1:]}
+        column_dtypes["gene"] = str
+    return columns, column_dtypes, body
+
+
+def _select_count_matrix(count_matrix, genes=None, samples=None):
+    """
+    Selects genes and samples of a parsed count matrix, e.g. a cached one, in the order of the count matrix.
+    :param: count_matrix: dense count matrix with a "gene" column or sparse count matrix with the genes as index,
+            genes: gene ids of the rows to keep, samples: sample ids of the columns to keep
+    :type: count_matrix: pandas dataframe, genes: list, samples: list
+    :return: count_matrix
+    :rtype: count_matrix: pandas dataframe
+    """
+    has_gene_column = "gene" in count_matrix.columns
+    if samples is not None:
+        wanted = set(samples)
+        columns = [column for column in count_matrix.columns if column in wanted or column == "gene"]
+        count_matrix = count_matrix[columns]
+    if genes is not None:
+        gene_ids = count_matrix["gene"] if has_gene_column else count_matrix.index
+        count_matrix = count_matrix[gene_ids.isin(list(genes))]
+        if has_gene_column:
+            count_matrix = count_matrix.reset_index(drop=True)
+    return count_matrix
+
+
+def _align_count_matrices(raw, normalized):
+    """
+    Brings the genes of the RAW and the NORMALIZED count matrix into the same order. GREIN returns both in the
+    same order, otherwise the genes of the normalized count matrix are reordered like the raw one and genes
+    which are only part of one count matrix are appended to both with missing values.
+    :param: raw, normalized: dense count matrices with a "gene" column or sparse ones with the genes as index
+    :type: raw: pandas dataframe, normalized: pandas dataframe
+    :return: raw, normalized
+    :rtype: raw: pandas dataframe, normalized: pandas dataframe
+    """
+    if not isinstance(raw, pandas.DataFrame) or not isinstance(normalized, pandas.DataFrame):
+        return raw, normalized
+    has_gene_column = "gene" in raw.columns
+    raw_genes = pandas.Index(raw["gene"] if has_gene_column else raw.index)
+    normalized_genes = pandas.Index(normalized["gene"] if has_gene_column else normalized.index)
+    if raw_genes.equals(normalized_genes):
+        return raw, normalized
+    LOGGER.warning("The genes of the RAW and the NORMALIZED count matrix differ, the count matrices are aligned")
+    genes = raw_genes.append(normalized_genes.difference(raw_genes, sort=False))
+
+    def reindex(count_matrix):
+        if not has_gene_column:
+            return count_matrix.reindex(genes)
+        return count_matrix.set_index("gene").reindex(genes).rename_axis("gene").reset_index()
+    return reindex(raw), reindex(normalized)
+
+
+def _read_header(body) -> Tuple[bytes, "_PrefixedReader"]:
+    """ reads the first line of body, returns it and a reader of the remaining bytes """
+    data = b""
+    while b"\n" not in data:
+        block = body.read(io.DEFAULT_BUFFER_SIZE)
+        if not block:
+            break
+        data += block
+    header, _, rest = data.partition(b"\n")
+    return header.rstrip(b"\r"), _PrefixedReader(rest, body)
+
+
+class _PrefixedReader:
+    """ file-like object returning prefix before the bytes of raw """
+    def __init__(self, prefix: bytes, raw):
+        self.prefix = prefix
+        self.raw = raw
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.prefix:
+            return self.raw.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.raw.read(), b""
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+
+def _write_count_matrix(count_matrix_r, path, stats=None):
+    """
+    Writes the count matrix to path while it is downloaded, the response must be requested with stream=True.
+    The file is gzip compressed if path ends with .gz, a gzip encoded response is written without decompressing it.
+    The file is written to path.part first and renamed when the download is complete.
+    :param: count_matrix_r: response of the downloadcounts request, path: file the csv is written to,
+            stats: LoadStats the time spent reading the body is counted in as counts_download
+    :type: count_matrix_r: requests.Response, path: str, stats: LoadStats
+    :return: path
+    :rtype: path: str
+    """
+    compress = path.endswith(".gz")
+    copy_encoded = compress and count_matrix_r.headers.get("Content-Encoding", "").lower() == "gzip"
+    count_matrix_r.raw.decode_content = not copy_encoded
+    body = count_matrix_r.raw if stats is None else stats.reader(count_matrix_r.raw, "counts_download")
+    part_path = path + ".part"
+    try:
+        with (gzip.open(part_path, "wb") if compress and not copy_encoded else open(part_path, "wb")) as f:
+            shutil.copyfileobj(body, f, DOWNLOAD_CHUNK_SIZE)
+        os.replace(part_path, path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return path
+
+
+def _compact_count_matrix(count_matrix, dtype=None, sparse=False):
+    """
+    Converts a count matrix to dtype and between the dense and sparse format, used for cached and chunked count matrices.
+    :param: count_matrix: dense count matrix with a "gene" column or sparse count matrix with the genes as index,
+            dtype: dtype of the expression values, sparse: convert to a sparse dataframe with the genes as index
+    :type: count_matrix: pandas dataframe, dtype: str, sparse: bool
+    :return: count_matrix
+    :rtype: count_matrix: pandas dataframe
+    """
+    if sparse and "gene" in count_matrix.columns:
+        count_matrix = count_matrix.set_index("gene")
+    if not sparse and "gene" not in count_matrix.columns:
+        count_matrix = count_matrix.sparse.to_dense().reset_index()
+    values = count_matrix.columns if sparse or "gene" not in count_matrix.columns else count_matrix.columns[1:]
+    if sparse:
+        conversions = {}
+        for column in values:
+            column_dtype = count_matrix[column].dtype
+            value_dtype = column_dtype.subtype if isinstance(column_dtype, pandas.SparseDtype) else column_dtype
+            conversions[column] = pandas.SparseDtype(dtype or value_dtype, 0)
+    else:
+        conversions = {} if dtype is None else {column: dtype for column in values}
+    return count_matrix.astype(conversions) if conversions else count_matrix
+
+
+def _format_description(description):
+    """
+    Formats raw description input from streaming request to a dictionary.
+    :param: description:
+    :type: description: str
+    :return: description, keys: Study link, Species, Title, Summary
+    :rtype: description:dict
+    """
+    d = {}
+    data = description["data"]
+    for i in data:
+        if i[0] == 'Study link':
+            d["Study link"] = re.search(
+                "https?://(www\.)?[-a-zA-Z0-9@:%._+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}([-a-zA-Z0-9()@:%_+.~#?&/=]*)",
+                i[1]).group()
+        if i[0] == 'Species':
+            d["Species"] = "" if i[1] == 'character(0)' else i[1]
+        if i[0] == 'Title':
+            d["Title"] = "" if i[1] == 'character(0)' else i[1]
+        if i[0] == 'Summary':
+            d["Summary"] = "" if i[1] == 'character(0)' else i[1]
+    return d
+
+
+def _format_metadata(metadata, metadata_labels):
+    """
+    Formats raw metadata and metadata labels provided by streaming to create metadata dictionary
+    :param: metadata, metadata_labels
+    :type: metadata: str, metadata_labels: list
+    :return: metadata
+    :rtype: metadata:dict
+    """
+    mdict = {}
+    data = metadata["data"]
+    for item in data:
+        item_dict = dict(zip(metadata_labels, item))
+        mdict[item[1]] = item_dict
+    return mdict
+
+
+def _format_metadata_frame(metadata, metadata_labels):
+    """
+    Formats raw metadata to a dataframe in one step, the columns are the metadata labels and the index are the
+    sample ids. Columns with few distinct values, e.g. tissue or condition, are converted to categoricals.
+    :param: metadata, metadata_labels
+    :type: metadata: dict, metadata_labels: list
+    :return: metadata
+    :rtype: metadata:pandas dataframe
+    """
+    frame = pandas.DataFrame(metadata["data"])
+    if frame.shape[1] == 0:
+        return pandas.DataFrame(columns=metadata_labels)
+    frame = frame.iloc[:, :len(metadata_labels)]
+    frame.columns = metadata_labels[:frame.shape[1]]
+    # like the keys of the metadata dictionary, the second column holds the sample ids
+    frame.index = pandas.Index(frame.iloc[:, 1])
+    frame.index.name = None
+    for position, column in enumerate(frame.columns):
+        values = frame.iloc[:, position]
+        if position > 1 and pandas.api.types.is_string_dtype(values) and values.nunique() <= len(frame) // 2:
+            frame[column] = values.astype("category")
+    return frame
+
+
+def _metadata_frame_to_dict(metadata):
+    """ converts a metadata dataframe to the metadata dictionary, e.g. for the cache """
+    labels = list(metadata.columns)
+    rows = metadata.astype(object).values.tolist()
+    return {sample: dict(zip(labels, row)) for sample, row in zip(metadata.index, rows)}
+
+
+def _metadata_dict_to_frame(metadata):
+    """ converts a metadata dictionary to the metadata dataframe """
+    if not metadata:
+        return pandas.DataFrame()
+    labels = list(next(iter(metadata.values())))
+    return _format_metadata_frame({"data": [list(sample.values()) for sample in metadata.values()]}, labels)
+
+
+def _parse_metadata(stream_list):
+    """
+    parses raw metadata provided by streaming,
+    :param: stream_list
+    :type: stream_list: list
+    :return: item_list
+    :rtype: item_list: list
+    """
+    item_string = ""
+    for i in stream_list:
+        if i.find("<table class") != -1:
+            item_string = i
+            break
+    n = item_string.replace("\\", "")
+    item_list = re.findall("<th>(.*?)</th>", n)
+    return item_list
+
+
+def _metadata_labels(messages):
+    """
+    parses the metadata labels from the header of the metadata table, which GREIN sends as value update
+    when the metadata tab becomes visible
+    :param: messages
+    :type: messages: list of sockjs.Message
+    :return: labels
+    :rtype: labels: list
+    """
+    for message in messages:
+        if message.kind == sockjs.VALUES:
+            table = _find_table(message.data["values"])
+            if table is not None:
+                return re.findall("<th>(.*?)</th>", table)
+    return []
+
+
+def _find_table(value):
+    """ returns the first html string with a table in the decoded value of an output """
+    if isinstance(value, str):
+        return value if "<table" in value else None
+    children = value.values() if isinstance(value, dict) else value if isinstance(value, list) else ()
+    for child in children:
+        table = _find_table(child)
+        if table is not None:
+            return table
+    return None
+
+
+def _generate_metadata_formdata(n_columns, no_samples=100):
+    """
+    generates formdata for metadata
+    :param: number of columns used for metadata
+    :type: n_columns: int
+    :return: raw form data parameter for request
+    :rtype: raw_form: string
+    """
+    raw_utils = utils.GreinLoaderUtils("")
+    raw_form = raw_utils.raw_form_start()
+    n = 1
+    while n < n_columns-5:
+        raw_form += raw_utils.raw_form_column(n)
+        n = n+1
+    raw_form += raw_utils.raw_form_end(no_samples)
+    return raw_form
+
+
+def _format_geo_accession(geo_accession_id):
+    """ helper function for formating the Geo accession id
+        :param: geo_accession_id: geo accession of GRIEN Dataset
+        :return: formatted geo accession for a GREIN Dataset
+    """
+    s = re.search("GSE[0-9]{3,}", geo_accession_id)  # searches for geo accession with at least 3 digits
+    if s is not None:
+        return s.group()
+    else:
+        return ""
+
+
+def _format_overview_item(item):
+    """ formats one row of the overview table
+        :param: item: row of the datatable response
+        :return: dict with geo accession, number of samples, species, title and summary
+    """
+    return {
+        "geo_accession": _format_geo_accession(item[0]),
+        "no_samples": item[1],
+        "species": item[2],
+        "title": item[3],
+        "study_summary": item[4]
+    }
@@ -0,0 +1,81 @@
+# the load_datasets(gse_ids) loads several GREIN datasets in parallel, every worker runs
+# load_dataset with its own session
+# return values:
+# iterator of BatchResult in order of completion
+
+import logging
+import functools
+import concurrent.futures
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+from .load_dataset import load_dataset, DATASET_PARTS, DOWNLOAD_TYPES
+from .cache import DatasetCache
+from .scheduler import RequestScheduler
+from . import utils
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BatchResult(NamedTuple):
+    """ Result of one dataset loaded by load_datasets. Either dataset or error is set.
+        :param: gse_id: The dataset's GSE id
+        :param: dataset: description, metadata, count_matrix as returned by load_dataset
+        :param: error: The exception raised while loading the dataset
+    """
+    gse_id: str
+    dataset: Optional[Tuple]
+    error: Optional[BaseException]
+
+
+def load_datasets(gse_ids: Iterable[str], download_type: str = "RAW", max_workers: int = 4,
+                  use_processes: bool = False, cache: DatasetCache = None, dtype: str = None,
+                  sparse: bool = False, parts: Iterable[str] = DATASET_PARTS,
+                  scheduler: RequestScheduler = None, metadata_format: str = "dict",
+                  grein_url: str = utils.GREIN_URL) -> Iterator[BatchResult]:
+    """ Loads several datasets from GREIN in parallel.
+        :param: gse_ids: The datasets' GSE ids, download_type: RAW, NORMALIZED or BOTH, passed to load_dataset,
+                max_workers: number of datasets loaded at the same time,
+                use_processes: use a process pool instead of a thread pool,
+                cache: DatasetCache shared by all workers, dtype, sparse, parts: passed to load_dataset,
+                scheduler: RequestScheduler shared by all workers, limits the sessions and the request rate
+                and retries failed requests, only supported with threads, metadata_format: passed to load_dataset,
+                grein_url: url of the GREIN app
+        :type: gse_ids: iterable of str, max_workers: int, use_processes: bool, cache: DatasetCache, dtype: str, sparse: bool,
+               parts: iterable of str, scheduler: RequestScheduler, metadata_format: str, grein_url: str
+        :return: BatchResult for every GSE id in order of completion, failed datasets are returned with the error
+        :rtype: iterator of BatchResult
+    """
+    if download_type not in DOWNLOAD_TYPES:
+        LOGGER.error("Invalid download_type passed. Value must either by 'RAW', 'NORMALIZED' or 'BOTH'.")
+        raise ValueError("Invalid download_type passed. Value must either by 'RAW', 'NORMALIZED' or 'BOTH'.")
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    if scheduler is not None and use_processes:
+        raise ValueError("A scheduler can only be shared by threads, use_processes must be False")
+
+    executor_class = concurrent.futures.ProcessPoolExecutor if use_processes \
+        else concurrent.futures.ThreadPoolExecutor
+    gse_ids = iter(gse_ids)
+    load = functools.partial(load_dataset, download_type=download_type, cache=cache, dtype=dtype, sparse=sparse,
+                             parts=parts, scheduler=scheduler, metadata_format=metadata_format,
+                             grein_url=grein_url)
+
+    with executor_class(max_workers=max_workers) as executor:
+        # only max_workers datasets are submitted at a time, so finished datasets never pile up in memory
+        pending = {}
+        for gse_id in gse_ids:
+            pending[executor.submit(load, gse_id)] = gse_id
+            if len(pending) >= max_workers:
+                break
+
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                gse_id = pending.pop(future)
+                next_gse_id = next(gse_ids, None)
+                if next_gse_id is not None:
+                    pending[executor.submit(load, next_gse_id)] = next_gse_id
+                try:
+                    yield BatchResult(gse_id, future.result(), None)
+                except Exception as err:
+                    LOGGER.error(f"Failed to load dataset {gse_id}: {err}")
+                    yield BatchResult(gse_id, None, err)
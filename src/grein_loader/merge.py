@@ -0,0 +1,166 @@
+# merges the count matrices of several GREIN series into one genes x samples count matrix store
+# every series is first written to a temporary CountMatrixStore, read from the DatasetCache if it is cached
+# and downloaded with store_counts_to otherwise. The union of the genes is built once from the stores,
+# then the output is preallocated on disk and the samples of every series are copied into their columns
+# in blocks of genes, so no more than memory_budget bytes of count values are held in memory at a time.
+# The series and the metadata of every sample are kept as provenance of the merged store.
+
+import os
+import json
+import uuid
+import shutil
+import logging
+import numpy
+import pandas
+from typing import Iterable, List
+from .cache import DatasetCache
+from .session import GreinSession
+from .count_store import CountMatrixStore, write_count_store, DEFAULT_STORE_DTYPE, _STORE_FILE, _VALUES_FILE, \
+    _GENES_FILE, _SAMPLES_FILE, _PROVENANCE_FILE
+
+LOGGER = logging.getLogger(__name__)
+
+# bytes of count values held in memory while series are copied into the merged store
+DEFAULT_MEMORY_BUDGET = 256 * 1024 ** 2
+
+
+def merge_datasets(gse_ids: Iterable[str], directory: str, download_type: str = "RAW", dtype: str = None,
+                   fill_value: float = numpy.nan, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                   cache: DatasetCache = None, session: GreinSession = None) -> CountMatrixStore:
+    """ merges the count matrices of several series into one count matrix store with the union of the genes
+        as rows and the samples of all series as columns
+        :param: gse_ids: The series' GSE ids, directory: directory of the merged store, replaced if it exists,
+                download_type: RAW or NORMALIZED, dtype: dtype of the stored values, defaults to float64,
+                fill_value: value of genes which are not in the count matrix of a series, NaN by default,
+                memory_budget: bytes of count values held in memory at a time,
+                cache: DatasetCache cached series are read from, session: GreinSession used for the downloads,
+                a new session is opened by default
+        :type: gse_ids: iterable of str, directory: str, download_type: str, dtype: str, fill_value: float,
+               memory_budget: int, cache: DatasetCache, session: GreinSession
+        :return: the merged store, its provenance holds the series and the metadata of every sample.
+                 A sample which is part of several series, e.g. of a SuperSeries, is only stored once.
+        :rtype: CountMatrixStore
+    """
+    if download_type != "RAW" and download_type != "NORMALIZED":
+        LOGGER.error("Invalid download_type passed. Value must either by 'RAW' or 'NORMALIZED'.")
+        raise ValueError("Invalid download_type passed. Value must either by 'RAW' or 'NORMALIZED'.")
+    if numpy.dtype(dtype or DEFAULT_STORE_DTYPE).kind in "iub" and numpy.isnan(fill_value):
+        LOGGER.error("fill_value must be a number for integer dtypes")
+        raise ValueError("fill_value must be a number for integer dtypes")
+    if session is None:
+        with GreinSession() as session:
+            return merge_datasets(gse_ids, directory, download_type, dtype, fill_value, memory_budget, cache, session)
+
+    dtype = numpy.dtype(dtype or DEFAULT_STORE_DTYPE)
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_directory = os.path.join(parent, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_directory)
+    try:
+        # the series are written to stores first, only one series is loaded at a time
+        series = []
+        for gse_id in dict.fromkeys(gse_ids):
+            metadata, store = _series_store(gse_id, os.path.join(tmp_directory, gse_id), download_type, cache,
+                                            session)
+            series.append((gse_id, metadata, store))
+
+        # the genes are ordered as they first appear in the series
+        genes = pandas.Index(list(dict.fromkeys(gene for _, _, store in series for gene in store.genes)),
+                             name="gene")
+        provenance = []
+        columns = []
+        merged_samples = set()
+        for gse_id, metadata, store in series:
+            new_samples = []
+            for position, sample in enumerate(store.samples):
+                if sample in merged_samples:
+                    LOGGER.warning(f"Sample {sample} of {gse_id} is already part of another series, it is skipped")
+                    continue
+                merged_samples.add(sample)
+                new_samples.append(position)
+                row = {"sample": sample, "gse_id": gse_id}
+                row.update({label: value for label, value in (metadata or {}).get(sample, {}).items()
+                            if label not in ("", "geo_accession")})
+                provenance.append(row)
+            columns.append(new_samples)
+
+        output_directory = os.path.join(tmp_directory, "merged")
+        os.makedirs(output_directory)
+        shape = (len(genes), len(provenance))
+        values = _preallocate(os.path.join(output_directory, _VALUES_FILE), shape, dtype, fill_value, memory_budget)
+        start = 0
+        for (gse_id, _, store), new_samples in zip(series, columns):
+            _copy_series(store, new_samples, genes, values, start, memory_budget)
+            start += len(new_samples)
+            LOGGER.debug(f"Samples of {gse_id} merged")
+        if values is not None:
+            values.flush()
+            del values
+
+        with open(os.path.join(output_directory, _GENES_FILE), "w") as f:
+            f.writelines(f"{gene}\n" for gene in genes)
+        with open(os.path.join(output_directory, _SAMPLES_FILE), "w") as f:
+            f.writelines(f"{row['sample']}\n" for row in provenance)
+        pandas.DataFrame(provenance, columns=_provenance_columns(provenance)).to_csv(
+            os.path.join(output_directory, _PROVENANCE_FILE), index=False)
+        with open(os.path.join(output_directory, _STORE_FILE), "w") as f:
+            json.dump({"dtype": dtype.str, "shape": list(shape), "order": "C",
+                       "series": [gse_id for gse_id, _, _ in series]}, f)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.rename(output_directory, directory)
+    finally:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    LOGGER.debug(f"{len(series)} series with {shape[1]} samples and {shape[0]} genes merged into {directory}")
+    return CountMatrixStore(directory)
+
+
+def _series_store(gse_id: str, directory: str, download_type: str, cache: DatasetCache, session: GreinSession):
+    """ writes the count matrix of a series to a store, returns the metadata and the store """
+    dataset = cache.get(gse_id, download_type) if cache is not None else None
+    if dataset is not None:
+        _, metadata, count_matrix = dataset
+        return metadata, write_count_store(count_matrix, directory)
+    _, metadata, store = session.load_dataset(gse_id, download_type, parts=["metadata", "counts"],
+                                              store_counts_to=directory)
+    if not isinstance(store, CountMatrixStore):
+        raise ValueError(f"No count matrix available for {gse_id}")
+    return metadata if isinstance(metadata, dict) else None, store
+
+
+def _preallocate(path: str, shape, dtype: numpy.dtype, fill_value: float, memory_budget: int):
+    """ creates the values file of the merged store, filled with fill_value """
+    if 0 in shape:
+        open(path, "wb").close()
+        return None
+    values = numpy.memmap(path, dtype=dtype, mode="w+", shape=shape)
+    # a new file reads as zeros
+    if fill_value != 0:
+        rows = _block_rows(shape[1], dtype, memory_budget)
+        for start in range(0, shape[0], rows):
+            values[start:start + rows] = fill_value
+    return values
+
+
+def _copy_series(store: CountMatrixStore, samples: List[int], genes: pandas.Index, values: numpy.memmap,
+                 start: int, memory_budget: int):
+    """ copies the columns samples of store into the columns of values starting at start """
+    if not samples or not len(store.genes):
+        return
+    rows = genes.get_indexer(store.genes)
+    end = start + len(samples)
+    # consecutive samples are read as one slice
+    columns = slice(samples[0], samples[-1] + 1) if samples[-1] - samples[0] == len(samples) - 1 else samples
+    block = _block_rows(len(store.samples), store.dtype, memory_budget)
+    for block_start in range(0, len(rows), block):
+        block_values = numpy.asarray(store.values[block_start:block_start + block, columns])
+        values[rows[block_start:block_start + block], start:end] = block_values
+
+
+def _block_rows(n_columns: int, dtype: numpy.dtype, memory_budget: int) -> int:
+    # the block is read and converted to the output dtype, so two copies are held at a time
+    return max(1, memory_budget // (2 * max(1, n_columns) * max(numpy.dtype(dtype).itemsize, 8)))
+
+
+def _provenance_columns(provenance: List[dict]) -> List[str]:
+    return list(dict.fromkeys(key for row in provenance for key in row))
@@ -0,0 +1,235 @@
+# local index of the sample metadata of GREIN series stored in a SQLite database
+# harvest only requests the metadata_full table of every series, several series at a time, the count
+# matrices are not downloaded. Every metadata value is stored once per label in a table clustered by
+# label and value, so the samples with a value of a label are read from one contiguous range of the index.
+# query returns the series and samples matching conditions on the labels, the count matrices are then
+# only loaded for the selection.
+
+import time
+import sqlite3
+import logging
+import threading
+import concurrent.futures
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from .session import GreinSession, DEFAULT_TIMEOUT
+from .scheduler import RequestScheduler
+from .mirror import SyncResult
+from . import utils
+
+LOGGER = logging.getLogger(__name__)
+
+# labels which only repeat the row number and the sample id
+_SKIPPED_LABELS = ("", "geo_accession")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    gse_id TEXT PRIMARY KEY,
+    no_samples INTEGER,
+    harvested REAL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    gse_id TEXT,
+    sample TEXT,
+    position INTEGER,
+    PRIMARY KEY (gse_id, sample)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sample_values (
+    label TEXT,
+    value TEXT COLLATE NOCASE,
+    gse_id TEXT,
+    sample TEXT,
+    PRIMARY KEY (label, value, gse_id, sample)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sample_values_gse_id ON sample_values (gse_id);
+"""
+
+
+class SampleSelection(NamedTuple):
+    """ Samples of one series returned by MetadataIndex.query
+        :param: gse_id: GSE id of the series
+        :param: samples: the matching sample ids in the order of the series' metadata
+    """
+    gse_id: str
+    samples: List[str]
+
+
+class MetadataIndex:
+    def __init__(self, path: str):
+        """Open the index stored in the SQLite database path, the database is created if it does not exist.
+
+        :param path: Path of the database file, ":memory:" keeps the index in memory
+        :type path: str
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(_SCHEMA)
+        self._connection.commit()
+
+    def __enter__(self) -> "MetadataIndex":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM series").fetchone()[0]
+
+    def __contains__(self, gse_id: str) -> bool:
+        return self._connection.execute("SELECT 1 FROM series WHERE gse_id = ?", (gse_id,)).fetchone() is not None
+
+    def series(self) -> List[str]:
+        """ returns the GSE ids of all indexed series """
+        return [row[0] for row in self._connection.execute("SELECT gse_id FROM series ORDER BY gse_id")]
+
+    def add(self, gse_id: str, metadata: dict):
+        """ indexes the metadata of a series, replaces the metadata indexed before
+            :param: gse_id: GSE id of the series, metadata: metadata dictionary as returned by load_dataset
+            :type: gse_id: str, metadata: dict
+        """
+        metadata = metadata if isinstance(metadata, dict) else {}
+        samples = [(gse_id, sample, position) for position, sample in enumerate(metadata)]
+        values = [(label, str(value), gse_id, sample)
+                  for sample, labels in metadata.items() for label, value in labels.items()
+                  if label not in _SKIPPED_LABELS and value is not None and str(value) != ""]
+        with self._connection:
+            self._connection.execute("DELETE FROM samples WHERE gse_id = ?", (gse_id,))
+            self._connection.execute("DELETE FROM sample_values WHERE gse_id = ?", (gse_id,))
+            self._connection.executemany("INSERT INTO samples (gse_id, sample, position) VALUES (?, ?, ?)", samples)
+            # a value which is repeated for one sample is stored once
+            self._connection.executemany("INSERT OR IGNORE INTO sample_values (label, value, gse_id, sample) "
+                                         "VALUES (?, ?, ?, ?)", values)
+            self._connection.execute("INSERT OR REPLACE INTO series (gse_id, no_samples, harvested) VALUES (?, ?, ?)",
+                                     (gse_id, len(samples), time.time()))
+
+    def harvest(self, gse_ids: Iterable[str], max_workers: int = 4, refresh: bool = False,
+                grein_url: str = utils.GREIN_URL, timeout: float = DEFAULT_TIMEOUT,
+                scheduler: RequestScheduler = None) -> SyncResult:
+        """ requests the metadata of the series from GREIN in parallel and indexes it, the count matrices
+            are not downloaded. Every worker loads its series over one GreinSession.
+            :param: gse_ids: GSE ids of the series, max_workers: number of series loaded at the same time,
+                    refresh: request the series which are indexed already again,
+                    grein_url: url of the GREIN app, timeout: seconds to wait for data from GREIN,
+                    scheduler: RequestScheduler shared by the sessions
+            :type: gse_ids: iterable of str, max_workers: int, refresh: bool, grein_url: str, timeout: float,
+                   scheduler: RequestScheduler
+            :return: the harvested series, the number of series which were indexed already and the failed series
+            :rtype: SyncResult
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        gse_ids = list(dict.fromkeys(gse_ids))
+        pending = gse_ids if refresh else [gse_id for gse_id in gse_ids if gse_id not in self]
+        LOGGER.info(f"{len(pending)} of {len(gse_ids)} series are harvested")
+
+        harvested = []
+        failed = {}
+        sessions = []
+        local = threading.local()
+
+        def fetch(gse_id):
+            # sessions are kept by the worker threads, so the connection is reused for their next series
+            if getattr(local, "session", None) is None:
+                local.session = GreinSession(grein_url, timeout, scheduler)
+                sessions.append(local.session)
+            return local.session.load_dataset(gse_id, parts=["metadata"])[1]
+
+        # every worker keeps a session slot of the scheduler until the harvest ends, more workers than slots
+        # would wait forever for a slot
+        if scheduler is not None:
+            max_workers = min(max_workers, scheduler.max_sessions)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(fetch, gse_id): gse_id for gse_id in pending}
+                # the database is only written by this thread
+                for future in concurrent.futures.as_completed(futures):
+                    gse_id = futures[future]
+                    try:
+                        metadata = future.result()
+                    except Exception as err:
+                        LOGGER.error(f"Failed to harvest the metadata of {gse_id}: {err}")
+                        failed[gse_id] = str(err)
+                        continue
+                    self.add(gse_id, metadata)
+                    harvested.append(gse_id)
+                    LOGGER.debug(f"Harvested {gse_id} ({len(harvested) + len(failed)}/{len(pending)})")
+        finally:
+            for worker_session in sessions:
+                worker_session.close()
+        return SyncResult(harvested, len(gse_ids) - len(pending), failed)
+
+    def get(self, gse_id: str) -> Optional[dict]:
+        """ returns the indexed metadata of gse_id without the row numbers and sample ids,
+            None if the series is not in the index
+        """
+        if gse_id not in self:
+            return None
+        metadata = {sample: {} for sample, in self._connection.execute(
+            "SELECT sample FROM samples WHERE gse_id = ? ORDER BY position", (gse_id,))}
+        for sample, label, value in self._connection.execute(
+                "SELECT sample, label, value FROM sample_values WHERE gse_id = ?", (gse_id,)):
+            metadata[sample][label] = value
+        return metadata
+
+    def labels(self) -> Dict[str, int]:
+        """ returns the number of samples with a value for every label in the index """
+        return dict(self._connection.execute(
+            "SELECT label, COUNT(*) FROM sample_values GROUP BY label"))
+
+    def values(self, label: str) -> Dict[str, int]:
+        """ returns the number of samples for every value of label """
+        return dict(self._connection.execute(
+            "SELECT value, COUNT(*) FROM sample_values WHERE label = ? GROUP BY value ORDER BY COUNT(*) DESC",
+            (label,)))
+
+    def query(self, conditions: dict = None, **kwargs) -> List[SampleSelection]:
+        """ returns the samples whose metadata matches all conditions, grouped by series
+            :param: conditions: label -> condition, for labels which are no valid keyword names,
+                    kwargs: label=condition. A condition is a value, which is compared case insensitive,
+                    a list of values of which one must match, True if the label must have a value or
+                    False if the label must not have a value,
+                    e.g. query(tissue="liver", treatment=True, condition=["control", "healthy"])
+            :type: conditions: dict, kwargs: str, list or bool
+            :return: the matching samples of every series, ordered by GSE id
+            :rtype: list of SampleSelection
+        """
+        conditions = dict(conditions or {}, **kwargs)
+        selects = []
+        excludes = []
+        parameters = []
+        exclude_parameters = []
+        for label, condition in conditions.items():
+            if isinstance(condition, bool):
+                select = "SELECT gse_id, sample FROM sample_values WHERE label = ?"
+                if condition:
+                    selects.append(select)
+                    parameters.append(label)
+                else:
+                    excludes.append(select)
+                    exclude_parameters.append(label)
+            elif isinstance(condition, (list, tuple, set, frozenset)):
+                values = [str(value) for value in condition]
+                selects.append("SELECT gse_id, sample FROM sample_values WHERE label = ? AND value IN "
+                               f"({', '.join('?' * len(values))})")
+                parameters += [label] + values
+            else:
+                selects.append("SELECT gse_id, sample FROM sample_values WHERE label = ? AND value = ?")
+                parameters += [label, str(condition)]
+
+        query = "SELECT gse_id, sample FROM samples"
+        filters = []
+        # the samples of every condition are read from the index and intersected
+        if selects:
+            filters.append(f"(gse_id, sample) IN ({' INTERSECT '.join(selects)})")
+        if excludes:
+            filters.append(f"(gse_id, sample) NOT IN ({' UNION '.join(excludes)})")
+        if filters:
+            query += " WHERE " + " AND ".join(filters)
+        query += " ORDER BY gse_id, position"
+
+        selection = {}
+        for gse_id, sample in self._connection.execute(query, parameters + exclude_parameters):
+            selection.setdefault(gse_id, []).append(sample)
+        return [SampleSelection(gse_id, samples) for gse_id, samples in selection.items()]
@@ -0,0 +1,306 @@
+# local mirror of all GREIN datasets which is synced incrementally with the overview
+# every dataset is a directory holding the overview record, description.json, metadata.json and the gzip
+# compressed count matrix. It is written to a temporary directory and renamed in place when it is complete.
+# The journal records every finished dataset with a fingerprint of its overview record. Lines are only appended
+# and flushed to disk after every dataset, so an interrupted sync resumes with the datasets which were not
+# finished and a sync of an unchanged corpus only requests the overview.
+#
+# usage:
+#   python -m grein_loader.mirror grein_mirror --workers 4
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import argparse
+import threading
+import concurrent.futures
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+from .session import GreinSession, OVERVIEW_PAGE_SIZE, DEFAULT_TIMEOUT
+from .scheduler import RequestScheduler
+from .exceptions import GreinLoaderException
+from . import utils
+
+LOGGER = logging.getLogger(__name__)
+
+_MIRROR_FILE = "mirror.json"
+_JOURNAL_FILE = "journal.jsonl"
+_RECORD_FILE = "overview.json"
+_DESCRIPTION_FILE = "description.json"
+_METADATA_FILE = "metadata.json"
+_COUNTS_FILE = "counts.csv.gz"
+_TMP_PREFIX = ".tmp-"
+_STALE_TMP_AGE = 3600
+_OVERVIEW_FIELDS = ("geo_accession", "no_samples", "species", "title", "study_summary")
+
+
+class SyncResult(NamedTuple):
+    """ Result of GreinMirror.sync
+        :param: fetched: GSE ids of the datasets which were downloaded
+        :param: unchanged: number of datasets which were up to date
+        :param: failed: error message for every GSE id which could not be downloaded
+    """
+    fetched: List[str]
+    unchanged: int
+    failed: Dict[str, str]
+
+
+def _fingerprint(record: dict) -> str:
+    """ hash of the overview fields of a dataset, a dataset is downloaded again if it changes """
+    fields = json.dumps([record.get(field) for field in _OVERVIEW_FIELDS], default=str)
+    return hashlib.sha1(fields.encode()).hexdigest()
+
+
+class GreinMirror:
+    def __init__(self, directory: str, download_type: str = "RAW", grein_url: str = utils.GREIN_URL,
+                 timeout: float = DEFAULT_TIMEOUT, scheduler: RequestScheduler = None):
+        """Open the mirror in directory, the directory is created if it does not exist.
+
+        :param directory: The directory holding the mirrored datasets and the journal
+        :type directory: str
+        :param download_type: RAW or NORMALIZED count matrices, fixed when the mirror is created, defaults to RAW
+        :type download_type: str, optional
+        :param grein_url: The url of the GREIN app, defaults to utils.GREIN_URL
+        :type grein_url: str, optional
+        :param timeout: Seconds to wait for data from GREIN, defaults to 120
+        :type timeout: float, optional
+        :param scheduler: RequestScheduler shared by the sessions of a sync, defaults to None
+        :type scheduler: RequestScheduler, optional
+        """
+        if download_type != "RAW" and download_type != "NORMALIZED":
+            LOGGER.error("Invalid download_type passed. Value must either by 'RAW' or 'NORMALIZED'.")
+            raise ValueError("Invalid download_type passed. Value must either by 'RAW' or 'NORMALIZED'.")
+        self.directory = directory
+        self.download_type = download_type
+        self.grein_url = grein_url
+        self.timeout = timeout
+        self.scheduler = scheduler
+        os.makedirs(directory, exist_ok=True)
+
+        mirror_path = os.path.join(directory, _MIRROR_FILE)
+        if os.path.exists(mirror_path):
+            with open(mirror_path) as f:
+                created_type = json.load(f)["download_type"]
+            if created_type != download_type:
+                raise ValueError(f"The mirror in {directory} holds {created_type} count matrices")
+        else:
+            _write_atomic(mirror_path, json.dumps({"download_type": download_type, "created": time.time()}))
+
+        # journal entry of every finished dataset
+        self._entries: Dict[str, dict] = {}
+        self._journal = None
+        self._read_journal()
+        self._journal = open(os.path.join(directory, _JOURNAL_FILE), "a")
+
+    def __enter__(self) -> "GreinMirror":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, gse_id: str) -> bool:
+        return gse_id in self._entries
+
+    def datasets(self) -> List[str]:
+        """ returns the GSE ids of all mirrored datasets """
+        return sorted(self._entries)
+
+    def path(self, gse_id: str) -> str:
+        """ returns the directory of the dataset gse_id """
+        return os.path.join(self.directory, gse_id)
+
+    def load(self, gse_id: str) -> Tuple[dict, dict, str]:
+        """ reads a mirrored dataset
+            :return: description, metadata and the path of the gzip compressed count matrix csv
+            :rtype: description:dict, metadata:dict, count_matrix:str
+        """
+        if gse_id not in self._entries:
+            raise KeyError(f"{gse_id} is not in the mirror")
+        path = self.path(gse_id)
+        with open(os.path.join(path, _DESCRIPTION_FILE)) as f:
+            description = json.load(f)
+        with open(os.path.join(path, _METADATA_FILE)) as f:
+            metadata = json.load(f)
+        return description, metadata, os.path.join(path, _COUNTS_FILE)
+
+    def pending(self, records: Iterable[dict]) -> List[dict]:
+        """ returns the overview records of the datasets which are new or changed since they were mirrored """
+        pending = []
+        for record in records:
+            entry = self._entries.get(record["geo_accession"])
+            if entry is None or entry["fingerprint"] != _fingerprint(record) \
+                    or not os.path.isdir(self.path(record["geo_accession"])):
+                pending.append(record)
+        return pending
+
+    def sync(self, max_workers: int = 4, page_size: int = OVERVIEW_PAGE_SIZE,
+             gse_ids: Iterable[str] = None) -> SyncResult:
+        """ reads the overview from GREIN and downloads the new and changed datasets in parallel,
+            every worker loads its datasets over one GreinSession
+            :param: max_workers: number of datasets loaded at the same time,
+                    page_size: number of datasets requested at a time from the overview,
+                    gse_ids: only mirror these datasets, all datasets on GREIN by default
+            :type: max_workers: int, page_size: int, gse_ids: iterable of str
+            :return: the downloaded, unchanged and failed datasets
+            :rtype: SyncResult
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self._remove_stale_tmp()
+        with GreinSession(self.grein_url, self.timeout, self.scheduler) as session:
+            records = session.iter_overview(page_size, prefetch=True)
+            if gse_ids is not None:
+                gse_ids = set(gse_ids)
+                records = (record for record in records if record["geo_accession"] in gse_ids)
+            records = list(records)
+        pending = self.pending(records)
+        LOGGER.info(f"{len(pending)} of {len(records)} datasets are new or changed")
+
+        fetched = []
+        failed = {}
+        sessions = []
+        local = threading.local()
+
+        def fetch(record):
+            # sessions are kept by the worker threads, so the connection is reused for their next dataset
+            if getattr(local, "session", None) is None:
+                local.session = GreinSession(self.grein_url, self.timeout, self.scheduler)
+                sessions.append(local.session)
+            self._fetch(local.session, record)
+
+        # every worker keeps a session slot of the scheduler until the sync ends, more workers than slots would wait
+        # forever for a slot
+        if self.scheduler is not None:
+            max_workers = min(max_workers, self.scheduler.max_sessions)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(fetch, record): record for record in pending}
+                for future in concurrent.futures.as_completed(futures):
+                    record = futures[future]
+                    gse_id = record["geo_accession"]
+                    try:
+                        future.result()
+                    except Exception as err:
+                        LOGGER.error(f"Failed to mirror dataset {gse_id}: {err}")
+                        failed[gse_id] = str(err)
+                        self._append({"gse_id": gse_id, "status": "failed", "error": str(err), "time": time.time()})
+                        continue
+                    entry = {"gse_id": gse_id, "status": "done", "fingerprint": _fingerprint(record),
+                             "time": time.time()}
+                    self._append(entry)
+                    self._entries[gse_id] = entry
+                    fetched.append(gse_id)
+                    LOGGER.info(f"Mirrored {gse_id} ({len(fetched) + len(failed)}/{len(pending)})")
+        finally:
+            for worker_session in sessions:
+                worker_session.close()
+        return SyncResult(fetched, len(records) - len(pending), failed)
+
+    def _fetch(self, session: GreinSession, record: dict):
+        gse_id = record["geo_accession"]
+        tmp_path = os.path.join(self.directory, _TMP_PREFIX + uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        try:
+            counts_path = os.path.join(tmp_path, _COUNTS_FILE)
+            description, metadata, counts = session.load_dataset(gse_id, self.download_type,
+                                                                 download_counts_to=counts_path)
+            # a dataset without counts is not marked as done, so the next sync requests it again
+            if counts != counts_path or not os.path.exists(counts_path):
+                LOGGER.error(f"No count matrix received for {gse_id}")
+                raise GreinLoaderException(f"No count matrix received for {gse_id}")
+            for name, data in ((_RECORD_FILE, record), (_DESCRIPTION_FILE, description), (_METADATA_FILE, metadata)):
+                with open(os.path.join(tmp_path, name), "w") as f:
+                    json.dump(data, f)
+            path = self.path(gse_id)
+            if os.path.exists(path):
+                # a changed dataset replaces the old version
+                trash_path = os.path.join(self.directory, _TMP_PREFIX + uuid.uuid4().hex)
+                os.rename(path, trash_path)
+                shutil.rmtree(trash_path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _append(self, entry: dict):
+        """ appends an entry to the journal, it is on disk when the method returns """
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _read_journal(self):
+        path = os.path.join(self.directory, _JOURNAL_FILE)
+        if not os.path.exists(path):
+            return
+        n_lines = 0
+        torn = False
+        with open(path) as f:
+            for line in f:
+                n_lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line is incomplete if the process was killed while writing it
+                    torn = True
+                    continue
+                if entry.get("status") == "done":
+                    self._entries[entry["gse_id"]] = entry
+        if torn:
+            LOGGER.warning(f"Ignored an incomplete line in the journal of {self.directory}")
+        # the journal is rewritten with the last entry per dataset once it holds many outdated lines
+        if torn or n_lines > 2 * len(self._entries) + 100:
+            _write_atomic(path, "".join(json.dumps(entry) + "\n" for entry in self._entries.values()))
+
+    def _remove_stale_tmp(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            # left behind by an interrupted sync
+            if name.startswith(_TMP_PREFIX) and os.path.isdir(path) and now - os.path.getmtime(path) > _STALE_TMP_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def _write_atomic(path: str, data: str):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mirrors all GREIN datasets into a local directory, "
+                                                 "an interrupted run resumes where it stopped")
+    parser.add_argument("directory", help="directory of the mirror")
+    parser.add_argument("--download-type", default="RAW", choices=["RAW", "NORMALIZED"])
+    parser.add_argument("--workers", type=int, default=4, help="number of datasets loaded at the same time")
+    parser.add_argument("--rate", type=float, default=10.0, help="initial number of requests per second")
+    parser.add_argument("--retries", type=int, default=3, help="retries of a failed request")
+    parser.add_argument("--gse-ids", nargs="+", help="only mirror these datasets")
+    parser.add_argument("--grein-url", default=utils.GREIN_URL, help="url of the GREIN app")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    scheduler = RequestScheduler(max_sessions=args.workers, rate=args.rate, max_rate=max(100.0, args.rate),
+                                 retries=args.retries)
+    with GreinMirror(args.directory, args.download_type, args.grein_url, scheduler=scheduler) as mirror:
+        result = mirror.sync(args.workers, gse_ids=args.gse_ids)
+    print(f"{len(result.fetched)} datasets downloaded, {result.unchanged} unchanged, {len(result.failed)} failed")
+    return 1 if result.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
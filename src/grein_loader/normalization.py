@@ -0,0 +1,140 @@
+# local normalization of RAW count matrices returned by load_dataset
+# normalize_counts calculates counts per million (CPM) of the library sizes, optionally scaled by TMM
+# normalization factors as calculated by edgeR's calcNormFactors, and log-CPM with edgeR's prior count.
+# The result is not verified against GREIN's NORMALIZED count matrix, it can be computed differently.
+# All calculations run with numpy on the whole matrix at once.
+
+import logging
+import numpy
+import pandas
+
+LOGGER = logging.getLogger(__name__)
+
+NORMALIZATION_METHODS = ("cpm", "tmm")
+
+
+def normalize_counts(count_matrix: pandas.DataFrame, method: str = "cpm", log: bool = False,
+                     prior_count: float = 2.0) -> pandas.DataFrame:
+    """ normalizes a RAW count matrix returned by load_dataset, with the default parameters the result
+        holds counts per million of the library sizes, which is not verified to equal the NORMALIZED
+        count matrix of GREIN
+        :param: count_matrix: dense or sparse count matrix with a "gene" column or with the genes as index,
+                method: "cpm" for counts per million of the library sizes or "tmm" for counts per million of
+                the library sizes scaled by the TMM normalization factors,
+                log: return log2 counts per million like edgeR's cpm(log=TRUE),
+                prior_count: average count added to every value before the log is taken
+        :type: count_matrix: pandas dataframe, method: str, log: bool, prior_count: float
+        :return: normalized count matrix in the layout of count_matrix, a sparse count matrix stays sparse
+                 unless log is set
+        :rtype: pandas dataframe
+    """
+    if method not in NORMALIZATION_METHODS:
+        LOGGER.error(f"Invalid method passed. Value must be one of {', '.join(NORMALIZATION_METHODS)}.")
+        raise ValueError(f"Invalid method passed. Value must be one of {', '.join(NORMALIZATION_METHODS)}.")
+    has_gene_column = "gene" in count_matrix.columns
+    counts = count_matrix.set_index("gene") if has_gene_column else count_matrix
+    sparse = any(isinstance(dtype, pandas.SparseDtype) for dtype in counts.dtypes)
+
+    lib_sizes = counts.sum(axis=0).to_numpy(dtype="float64")
+    if method == "tmm":
+        lib_sizes = lib_sizes * tmm_factors(counts)
+
+    if log:
+        # the prior count is scaled by the library sizes, as in edgeR
+        values = _dense_values(counts)
+        prior_counts = prior_count * lib_sizes / lib_sizes.mean() if lib_sizes.any() else \
+            numpy.full(len(lib_sizes), prior_count)
+        normalized = numpy.log2((values + prior_counts) / (lib_sizes + 2 * prior_counts) * 1e6)
+        result = pandas.DataFrame(normalized, index=counts.index, columns=counts.columns)
+    else:
+        # samples without counts stay 0
+        scale = 1e6 / numpy.where(lib_sizes > 0, lib_sizes, 1.0)
+        if sparse:
+            result = counts * scale
+        else:
+            result = pandas.DataFrame(_dense_values(counts) * scale, index=counts.index, columns=counts.columns)
+    return result.reset_index() if has_gene_column else result
+
+
+def tmm_factors(count_matrix: pandas.DataFrame, logratio_trim: float = 0.3, sum_trim: float = 0.05,
+                weighting: bool = True, a_cutoff: float = -1e10) -> numpy.ndarray:
+    """ calculates the TMM normalization factors of the samples like edgeR's calcNormFactors(method="TMM"),
+        the sample whose upper quartile is closest to the mean upper quartile is the reference
+        :param: count_matrix: count matrix with the genes as index or a "gene" column,
+                logratio_trim: fraction of the log ratios trimmed at both ends,
+                sum_trim: fraction of the mean log expressions trimmed at both ends,
+                weighting: weight the log ratios by their inverse asymptotic variance,
+                a_cutoff: genes with a mean log expression below a_cutoff are ignored
+        :type: count_matrix: pandas dataframe, logratio_trim: float, sum_trim: float, weighting: bool,
+               a_cutoff: float
+        :return: one factor per sample, the factors multiply to one
+        :rtype: numpy array
+    """
+    counts = count_matrix.set_index("gene") if "gene" in count_matrix.columns else count_matrix
+    values = _dense_values(counts)
+    lib_sizes = values.sum(axis=0)
+    n_samples = values.shape[1]
+    if n_samples == 0 or not lib_sizes.all():
+        return numpy.ones(n_samples)
+
+    upper_quartiles = numpy.quantile(values / lib_sizes, 0.75, axis=0)
+    ref = int(numpy.argmin(numpy.abs(upper_quartiles - upper_quartiles.mean())))
+    ref_values = values[:, [ref]]
+    ref_lib_size = lib_sizes[ref]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        log_ratio = numpy.log2((values / lib_sizes) / (ref_values / ref_lib_size))
+        abs_expression = (numpy.log2(values / lib_sizes) + numpy.log2(ref_values / ref_lib_size)) / 2
+        variance = (lib_sizes - values) / lib_sizes / values + (ref_lib_size - ref_values) / ref_lib_size / ref_values
+    # genes with a zero count in the sample or the reference are not used
+    keep = numpy.isfinite(log_ratio) & numpy.isfinite(abs_expression) & (abs_expression > a_cutoff)
+    log_ratio[~keep] = numpy.nan
+    abs_expression[~keep] = numpy.nan
+
+    # ranks of tied values are averaged like R's rank, the genes which are not used have no rank
+    n = keep.sum(axis=0)
+    low_ratio = numpy.floor(n * logratio_trim) + 1
+    low_sum = numpy.floor(n * sum_trim) + 1
+    ratio_ranks = _average_ranks(log_ratio)
+    sum_ranks = _average_ranks(abs_expression)
+    trimmed = keep & (ratio_ranks >= low_ratio) & (ratio_ranks <= n + 1 - low_ratio) \
+        & (sum_ranks >= low_sum) & (sum_ranks <= n + 1 - low_sum)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        if weighting:
+            factors = numpy.where(trimmed, log_ratio / variance, 0).sum(axis=0) \
+                / numpy.where(trimmed, 1 / variance, 0).sum(axis=0)
+        else:
+            factors = numpy.where(trimmed, log_ratio, 0).sum(axis=0) / trimmed.sum(axis=0)
+    # samples which do not differ from the reference get a factor of one
+    unchanged = numpy.abs(numpy.where(keep, log_ratio, 0)).max(axis=0, initial=0) < 1e-6
+    factors = numpy.where(unchanged | ~numpy.isfinite(factors), 1.0, 2 ** factors)
+    # the factors are scaled to a geometric mean of one
+    return factors / numpy.exp(numpy.mean(numpy.log(factors)))
+
+
+def _average_ranks(values: numpy.ndarray) -> numpy.ndarray:
+    """ ranks the values of every column starting at 1, tied values get the mean of their ranks,
+        NaN values are ranked last and must be masked by the caller
+    """
+    # the columns are sorted as contiguous rows, which is several times faster
+    rows = numpy.ascontiguousarray(values.T)
+    n = rows.shape[1]
+    order = numpy.argsort(rows, axis=1)
+    sorted_rows = numpy.take_along_axis(rows, order, axis=1)
+    positions = numpy.broadcast_to(numpy.arange(1, n + 1), rows.shape)
+    # a group of tied values starts where the value differs from the previous one
+    group_start = numpy.ones(rows.shape, dtype=bool)
+    group_start[:, 1:] = sorted_rows[:, 1:] != sorted_rows[:, :-1]
+    group_end = numpy.ones(rows.shape, dtype=bool)
+    group_end[:, :-1] = group_start[:, 1:]
+    first = numpy.maximum.accumulate(numpy.where(group_start, positions, 0), axis=1)
+    last = numpy.minimum.accumulate(numpy.where(group_end, positions, n + 1)[:, ::-1], axis=1)[:, ::-1]
+    ranks = numpy.empty(rows.shape)
+    numpy.put_along_axis(ranks, order, (first + last) / 2, axis=1)
+    return ranks.T
+
+
+def _dense_values(counts: pandas.DataFrame) -> numpy.ndarray:
+    if any(isinstance(dtype, pandas.SparseDtype) for dtype in counts.dtypes):
+        counts = counts.sparse.to_dense()
+    return counts.to_numpy(dtype="float64")
@@ -0,0 +1,140 @@
+# rate limiting and retries for the requests sent to GREIN
+# a RequestScheduler is shared by all sessions of a bulk download. It limits the number of open sessions,
+# spaces the requests with a token bucket and retries requests failing with 5xx responses or timeouts.
+# The rate of the token bucket adapts to the errors: it grows slowly while requests succeed and is
+# halved on every failure, like the congestion control of TCP.
+
+import time
+import random
+import logging
+import threading
+import requests
+from typing import Callable
+
+LOGGER = logging.getLogger(__name__)
+
+# status codes which are worth a retry, GREIN answers with 500 or 503 when it is overloaded
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# status codes of requests which were rejected before they were processed, these are retried for every request
+REJECTED_STATUS_CODES = (429,)
+
+
+class RequestScheduler:
+    def __init__(self, max_sessions: int = 4, rate: float = 10.0, min_rate: float = 0.5, max_rate: float = 100.0,
+                 burst: int = 10, retries: int = 3, backoff: float = 1.0, max_backoff: float = 60.0):
+        """Initialize a scheduler, pass it as scheduler to GreinSession, load_dataset or load_datasets.
+
+        :param max_sessions: Maximum number of sessions connected to GREIN at the same time, defaults to 4
+        :type max_sessions: int, optional
+        :param rate: Initial number of requests per second, defaults to 10
+        :type rate: float, optional
+        :param min_rate: The rate is not reduced below min_rate requests per second, defaults to 0.5
+        :type min_rate: float, optional
+        :param max_rate: The rate is not increased above max_rate requests per second, defaults to 100
+        :type max_rate: float, optional
+        :param burst: Number of requests which can be sent at once after an idle period, defaults to 10
+        :type burst: int, optional
+        :param retries: Number of retries of a failed request, defaults to 3
+        :type retries: int, optional
+        :param backoff: Seconds to wait after the first failure, doubled for every further retry, defaults to 1
+        :type backoff: float, optional
+        :param max_backoff: Maximum seconds to wait before a retry, defaults to 60
+        :type max_backoff: float, optional
+        """
+        if max_sessions < 1:
+            raise ValueError("max_sessions must be at least 1")
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError("rate must be between min_rate and max_rate and min_rate greater than 0")
+        self.max_sessions = max_sessions
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.requests = 0
+        self.failures = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._sessions = threading.BoundedSemaphore(max_sessions)
+
+    def acquire_session(self):
+        """ blocks until less than max_sessions sessions are connected """
+        self._sessions.acquire()
+
+    def release_session(self):
+        self._sessions.release()
+
+    def acquire(self):
+        """ blocks until the next request may be sent """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.requests += 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self):
+        """ reports a successful request, the rate grows by about one request per second every second """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+    def failure(self, attempt: int = 0):
+        """ reports a failed request, all requests pause for the backoff time and the rate is halved
+            :param: attempt: number of retries of the failed request so far
+            :type: attempt: int
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        with self._lock:
+            self.failures += 1
+            now = time.monotonic()
+            # failures of requests sent before the last backoff belong to the same overload and
+            # reduce the rate only once
+            if now >= self._paused_until:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            self._paused_until = max(self._paused_until, now + delay)
+        LOGGER.debug(f"Request rate reduced to {self.rate:.2f}/s, pausing {delay:.2f}s")
+
+    def call(self, send: Callable[[], requests.Response], phase: str = "request",
+             idempotent: bool = True) -> requests.Response:
+        """ sends a request with send, retrying it on responses with RETRY_STATUS_CODES and on timeouts
+            :param: send: function sending the request, phase: name of the request for the log,
+                    idempotent: False for requests which must not be sent twice, these are only retried on
+                    REJECTED_STATUS_CODES and not on 5xx responses, timeouts and connection errors, which the
+                    request might have reached GREIN before
+            :type: send: callable, phase: str, idempotent: bool
+            :return: the response of the last attempt, which can still have an error status code
+            :rtype: requests.Response
+        """
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            try:
+                response = send()
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as err:
+                if not idempotent or attempt == self.retries:
+                    raise
+                LOGGER.warning(f"Retrying {phase} after {err}")
+                self.failure(attempt)
+                continue
+            retry = response.status_code in (RETRY_STATUS_CODES if idempotent else REJECTED_STATUS_CODES)
+            if retry and attempt < self.retries:
+                LOGGER.warning(f"Retrying {phase} after status code {response.status_code}")
+                response.close()
+                self.failure(attempt)
+                continue
+            if response.status_code in RETRY_STATUS_CODES:
+                self.failure(attempt)
+            else:
+                self.success()
+            return response
@@ -0,0 +1,666 @@
+# the GreinSession connects to GREIN once and loads any number of datasets and the overview over
+# the same SockJS connection. Datasets are switched by updating the geo_acc input of the shiny app.
+# If the shiny session expires, the session reconnects and the load is repeated.
+
+import json
+import random
+import string
+import logging
+import contextlib
+import numpy
+import requests
+import urllib3
+import concurrent.futures
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, Tuple, Union
+from .exceptions import GreinLoaderException, GreinSessionExpiredException
+from .cache import DatasetCache
+from .stats import LoadStats
+from .scheduler import RequestScheduler, RETRY_STATUS_CODES
+from .count_store import _store_count_matrix
+from .formatting import _read_count_matrix, _write_count_matrix, _compact_count_matrix, _format_description, \
+    _format_metadata, _format_metadata_frame, _metadata_frame_to_dict, _metadata_dict_to_frame, _metadata_labels, \
+    _generate_metadata_formdata, _format_overview_item, _select_count_matrix, _align_count_matrices
+from . import sockjs
+from . import utils
+
+if TYPE_CHECKING:
+    # only needed for the annotations, pandas is imported by the formatting functions
+    import pandas
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_GREIN_DATASETS = 1000000
+OVERVIEW_PAGE_SIZE = 1000
+DATASET_PARTS = ("description", "metadata", "counts")
+# BOTH loads the RAW and the NORMALIZED count matrix in one session
+DOWNLOAD_TYPES = ("RAW", "NORMALIZED", "BOTH")
+METADATA_FORMATS = ("dict", "dataframe")
+# seconds to wait for data from GREIN, SockJS sends heartbeat frames on idle streaming connections
+DEFAULT_TIMEOUT = 120
+# bytes read from the streaming response at a time, a chunked response yields every chunk as soon as it arrives
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class CountMatrices(NamedTuple):
+    """ Count matrices returned by load_dataset with download_type="BOTH", the genes are in the same order
+        :param: raw: the RAW count matrix
+        :param: normalized: the NORMALIZED count matrix
+    """
+    raw: "pandas.DataFrame"
+    normalized: "pandas.DataFrame"
+
+
+class GreinSession:
+    def __init__(self, grein_url: str = utils.GREIN_URL, timeout: float = DEFAULT_TIMEOUT,
+                 scheduler: RequestScheduler = None):
+        """Initialize a new session. The connection to GREIN is opened when it is first needed
+           and kept until the session is closed.
+
+        :param grein_url: The url of the GREIN app, defaults to utils.GREIN_URL
+        :type grein_url: str, optional
+        :param timeout: Seconds to wait for data from GREIN before the connection is considered lost, defaults to 120
+        :type timeout: float, optional
+        :param scheduler: RequestScheduler limiting the sessions and requests, failed requests are retried
+                          instead of failing the load, defaults to None
+        :type scheduler: RequestScheduler, optional
+        """
+        self.grein_url = grein_url
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.session_id = None
+        self._session_slot = False
+        self._session = None
+        self._streaming_r = None
+        self._messages = None
+        # LoadStats of the running load
+        self._stats = None
+        self._reset_state()
+
+    def _reset_state(self):
+        self._message_id = -1
+        # highest message id acknowledged by GREIN
+        self._acked = -1
+        self._opened = False
+        # None, "overview" or "dataset", the init message differs for the overview and datasets
+        self._state = None
+        self._gse_id = None
+        self._metadata_visible = False
+        self._metadata_labels = None
+        self._counts_choice = "Raw"
+
+    def __enter__(self) -> "GreinSession":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ closes the connection to GREIN, the session reconnects if it is used again """
+        if self._streaming_r is not None:
+            self._streaming_r.close()
+        if self._session is not None:
+            self._session.close()
+        if self._session_slot:
+            self.scheduler.release_session()
+            self._session_slot = False
+        self.session_id = None
+        self._session = None
+        self._streaming_r = None
+        self._messages = None
+        self._reset_state()
+
+    def load_dataset(self, gse_id: str, download_type: str = "RAW", cache: DatasetCache = None, dtype: str = None,
+                     sparse: bool = False, parts: Iterable[str] = DATASET_PARTS,
+                     stats: LoadStats = None, download_counts_to: str = None,
+                     store_counts_to: str = None, metadata_format: str = "dict", genes: Iterable[str] = None,
+                     samples: Iterable[str] = None) -> Tuple[dict, dict, Union["pandas.DataFrame", CountMatrices]]:
+        """ Loads a dataset from GREIN, see grein_loader.load_dataset for the parameters.
+            :return: description, metadata, count_matrix of the GREIN dataset, the path of the count matrix
+                     if download_counts_to is set, the CountMatrixStore if store_counts_to is set or
+                     CountMatrices if download_type is BOTH
+            :rtype: description:dict, metadata:dictionary, count_matrix:pandas dataframe, str, CountMatrixStore
+                    or CountMatrices
+        """
+        if download_type not in DOWNLOAD_TYPES:
+            LOGGER.error("Invalid download_type passed. Value must either by 'RAW', 'NORMALIZED' or 'BOTH'.")
+            raise ValueError("Invalid download_type passed. Value must either by 'RAW', 'NORMALIZED' or 'BOTH'.")
+        if dtype is not None and download_type != "RAW" and not numpy.issubdtype(numpy.dtype(dtype), numpy.floating):
+            LOGGER.error("NORMALIZED expression values require a floating point dtype.")
+            raise ValueError("NORMALIZED expression values require a floating point dtype.")
+        parts = {parts} if isinstance(parts, str) else set(parts)
+        if not parts or not parts.issubset(DATASET_PARTS):
+            LOGGER.error(f"Invalid parts passed. Values must be any of {', '.join(DATASET_PARTS)}.")
+            raise ValueError(f"Invalid parts passed. Values must be any of {', '.join(DATASET_PARTS)}.")
+        if metadata_format not in METADATA_FORMATS:
+            LOGGER.error(f"Invalid metadata_format passed. Value must be one of {', '.join(METADATA_FORMATS)}.")
+            raise ValueError(f"Invalid metadata_format passed. Value must be one of {', '.join(METADATA_FORMATS)}.")
+        if download_counts_to is not None and (dtype is not None or sparse or store_counts_to is not None):
+            LOGGER.error("dtype, sparse and store_counts_to cannot be used with download_counts_to.")
+            raise ValueError("dtype, sparse and store_counts_to cannot be used with download_counts_to.")
+        if store_counts_to is not None and sparse:
+            LOGGER.error("sparse cannot be used with store_counts_to.")
+            raise ValueError("sparse cannot be used with store_counts_to.")
+        if download_counts_to is not None and (genes is not None or samples is not None):
+            LOGGER.error("genes and samples cannot be used with download_counts_to.")
+            raise ValueError("genes and samples cannot be used with download_counts_to.")
+        if download_type == "BOTH" and (download_counts_to is not None or store_counts_to is not None):
+            LOGGER.error("download_counts_to and store_counts_to cannot be used with BOTH.")
+            raise ValueError("download_counts_to and store_counts_to cannot be used with BOTH.")
+        genes = [genes] if isinstance(genes, str) else None if genes is None else list(genes)
+        samples = [samples] if isinstance(samples, str) else None if samples is None else list(samples)
+        if download_counts_to is not None or store_counts_to is not None:
+            # the count matrix is not held in memory, so the dataset is neither read from nor stored in the cache
+            cache = None
+
+        self._stats = stats
+        try:
+            if cache is not None:
+                with self._phase("cache"):
+                    dataset = _get_cached(cache, gse_id, download_type)
+                if dataset is not None:
+                    description, metadata, count_matrix = dataset
+                    if metadata_format == "dataframe" and isinstance(metadata, dict):
+                        metadata = _metadata_dict_to_frame(metadata)
+
+                    def compact(matrix):
+                        if genes is not None or samples is not None:
+                            matrix = _select_count_matrix(matrix, genes, samples)
+                        return _compact_count_matrix(matrix, dtype, sparse)
+                    if "counts" in parts:
+                        count_matrix = CountMatrices(*map(compact, count_matrix)) \
+                            if isinstance(count_matrix, CountMatrices) else compact(count_matrix)
+                    return description if "description" in parts else None, \
+                        metadata if "metadata" in parts else None, \
+                        count_matrix if "counts" in parts else None
+
+            # incomplete datasets and selections of genes or samples are not cached. A cached count matrix
+            # is stored as parsed, dtype and sparse are applied to the returned copy as on a cache hit
+            caching = cache is not None and genes is None and samples is None and parts == set(DATASET_PARTS)
+            # the parts loaded before the session expired are kept for the next attempt
+            loaded = {}
+            description, metadata, count_matrix = self._reconnecting(self._load_dataset, gse_id, download_type,
+                                                                     None if caching else dtype,
+                                                                     False if caching else sparse,
+                                                                     download_counts_to, store_counts_to,
+                                                                     metadata_format, genes, samples, parts,
+                                                                     loaded)
+
+            matrices = count_matrix if isinstance(count_matrix, CountMatrices) else (count_matrix,)
+            if caching and not any(part is None or isinstance(part, str) for part in (description, metadata) + matrices):
+                with self._phase("cache"):
+                    metadata_dict = metadata if isinstance(metadata, dict) else _metadata_frame_to_dict(metadata)
+                    for matrix_type, matrix in zip(_count_matrix_types(download_type), matrices):
+                        cache.put(gse_id, matrix_type, (description, metadata_dict, matrix))
+            if caching and (dtype is not None or sparse):
+                matrices = [matrix if isinstance(matrix, str) else _compact_count_matrix(matrix, dtype, sparse)
+                            for matrix in matrices]
+                count_matrix = CountMatrices(*matrices) if isinstance(count_matrix, CountMatrices) else matrices[0]
+            return description, metadata, count_matrix
+        finally:
+            self._stats = None
+
+    def load_overview(self, no_datasets: int = None, stats: LoadStats = None) -> list:
+        """ loads overview of the number of datasets given as parameter, see grein_loader.load_overview
+            :return: list of dict, each dict is one dataset in GREIN
+            :rtype: list_overview:list of dictionaries
+        """
+        if no_datasets is None:
+            LOGGER.debug("Requesting all Datasets from GREIN")
+            no_datasets = MAX_GREIN_DATASETS
+        self._stats = stats
+        try:
+            return self._overview_page(0, no_datasets, 1)[0]
+        finally:
+            self._stats = None
+
+    def iter_overview(self, page_size: int = OVERVIEW_PAGE_SIZE, prefetch: bool = False) -> Iterator[dict]:
+        """ iterates over all datasets on GREIN, the overview is requested page by page
+            :param: page_size: number of datasets requested at a time,
+                    prefetch: request the next page while the current one is consumed
+            :type: page_size: int, prefetch: bool
+            :return: one dict per dataset, see load_overview
+            :rtype: iterator of dict
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1")
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if prefetch else None
+        start = 0
+        draw = 1
+        page = executor.submit(self._overview_page, start, page_size, draw) if executor is not None else None
+        try:
+            while True:
+                if executor is not None:
+                    records, total = page.result()
+                else:
+                    records, total = self._overview_page(start, page_size, draw)
+                start += len(records)
+                draw += 1
+                has_next = len(records) == page_size and start < total
+                # the next page is requested before the current one is handed out
+                if has_next and executor is not None:
+                    page = executor.submit(self._overview_page, start, page_size, draw)
+                yield from records
+                if not has_next:
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def _reconnecting(self, load, *args):
+        """ calls load, reconnecting to GREIN if the session expired. The load is repeated once,
+            with a scheduler up to scheduler.retries times after its backoff.
+        """
+        reconnects = 1 if self.scheduler is None else max(self.scheduler.retries, 1)
+        for attempt in range(reconnects + 1):
+            try:
+                return load(*args)
+            except GreinSessionExpiredException as err:
+                if attempt == reconnects:
+                    raise
+                LOGGER.warning(f"GREIN session expired, reconnecting: {err}")
+                self.close()
+                if self.scheduler is not None:
+                    self.scheduler.failure(attempt)
+
+    def _request(self, send, phase: str, idempotent: bool = True) -> requests.Response:
+        """ sends a request with send, with a scheduler the request is rate limited and retried """
+        if self.scheduler is None:
+            return send()
+        return self.scheduler.call(send, phase, idempotent)
+
+    def _phase(self, name: str):
+        return self._stats.phase(name) if self._stats is not None else contextlib.nullcontext()
+
+    def _count(self, requests: int = 0, bytes_received: int = 0, bytes_sent: int = 0):
+        if self._stats is not None:
+            self._stats.add(requests, bytes_received, bytes_sent)
+
+    def _connect(self):
+        if self.scheduler is not None and not self._session_slot:
+            self.scheduler.acquire_session()
+            self._session_slot = True
+        with self._phase("handshake"):
+            self._handshake()
+
+    def _handshake(self):
+        # create the unique random string used later for nonce parameter in url
+        n = utils.GreinLoaderUtils.get_random_url_string_parameter()
+        # xhr_streaming_url will always be used for streaming requests in the code
+        self._xhr_streaming_url = f"{self.grein_url}__sockjs__/n={n}/xhr_streaming"
+        # xhr_send_url will always be used for streaming requests in the code
+        self._xhr_send_url = f"{self.grein_url}__sockjs__/n={n}/xhr_send"
+
+        LOGGER.debug("Requesting Session")
+        self._session = requests.session()  # requests a session on GREIN, cookies are provided within the session
+        try:
+            r = self._request(lambda: self._session.get(self.grein_url, timeout=self.timeout), "handshake")
+            self._count(requests=1, bytes_received=len(r.content))
+            r.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            LOGGER.error(f"GREIN not available with: {self.grein_url}")
+            raise GreinLoaderException(f"Failed to contact GREIN at {self.grein_url}: ", err)
+        LOGGER.debug("Connected to GREIN")
+
+        # streaming request is necessary for connection parameters
+        self._open_stream()
+        self._read_until(lambda message: message.kind == sockjs.HEARTBEAT)  # the connection is initialized
+        LOGGER.debug("Connection initialized")
+
+        # streaming request for configs and sessionId
+        self._send('["0#0|o|"]')
+        config = None
+        for message in self._wait_for_ack():
+            if message.kind == sockjs.CONFIG:
+                config = message.data
+        if config is None:
+            LOGGER.error("Streaming Error")
+            raise GreinLoaderException("Streaming Error no config")
+        self.session_id = config["config"]["sessionId"]
+        self._opened = True
+
+    def _open_stream(self):
+        if self._streaming_r is not None:
+            self._streaming_r.close()
+        try:
+            self._streaming_r = self._request(
+                lambda: self._session.post(self._xhr_streaming_url, stream=True, timeout=self.timeout), "xhr_streaming")
+            self._count(requests=1)
+            self._streaming_r.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            LOGGER.error(f"Streaming error: {err}")
+            raise GreinLoaderException("Streaming error: ", err)
+        self._messages = self._decode_stream(self._streaming_r)
+
+    def _decode_stream(self, response: requests.Response) -> Iterator[sockjs.Message]:
+        """ decodes the messages of a streaming response as they arrive """
+        decoder = sockjs.FrameDecoder()
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            self._count(bytes_received=len(chunk))
+            for message in decoder.feed(chunk):
+                # SockJS opens a new session if the previous one is gone
+                if self._opened and message.kind == sockjs.OPEN or message.kind == sockjs.CLOSE:
+                    raise GreinSessionExpiredException(f"SockJS session closed: {message.data}")
+                if message.kind == sockjs.ACK:
+                    # acknowledgements are cumulative, an id which cannot be parsed acknowledges everything sent
+                    self._acked = self._message_id if message.message_id is None \
+                        else max(self._acked, message.message_id)
+                yield message
+
+    def _read_until(self, predicate) -> list:
+        """ reads the streamed messages until predicate matches a message. SockJS ends a streaming response after
+            a fixed number of bytes, a new streaming request is sent in that case.
+            :return: all messages including the matching one
+            :rtype: list of sockjs.Message
+        """
+        content = []
+        stalls = 0
+        while True:
+            try:
+                for message in self._messages:
+                    content.append(message)
+                    if predicate(message):
+                        return content
+            except requests.exceptions.RequestException as err:
+                # with a scheduler a stalled streaming response is replaced, the SockJS session keeps the messages
+                if self.scheduler is None or stalls >= self.scheduler.retries:
+                    raise GreinSessionExpiredException("Streaming connection lost: ", err)
+                LOGGER.warning(f"Streaming connection stalled, reopening it: {err}")
+                self.scheduler.failure(stalls)
+                stalls += 1
+            LOGGER.debug("Opening new connection")
+            self._open_stream()
+
+    def _wait_for_ack(self) -> list:
+        """ reads the streamed messages until the last sent message is acknowledged, acknowledgements are cumulative,
+            so an acknowledgement read before, e.g. while draining the stream, is not waited for again
+            :return: all messages including the acknowledgement
+            :rtype: list of sockjs.Message
+        """
+        if self._acked >= self._message_id:
+            return []
+        with self._phase("ack_wait"):
+            return self._read_until(lambda message: self._acked >= self._message_id)
+
+    def _drain_stream(self):
+        """ reads the streaming response until GREIN ends it """
+        try:
+            for _ in self._messages:
+                pass
+        except requests.exceptions.RequestException as err:
+            raise GreinSessionExpiredException("Streaming connection lost: ", err)
+
+    def _send(self, payload: str):
+        """ sends a message to the shiny app, message ids must increase within a session """
+        message_id = utils.GreinLoaderUtils.get_message_id(payload)
+        if message_id <= self._message_id:
+            message_id = self._message_id + 1
+            payload = utils.GreinLoaderUtils.with_message_id(payload, message_id)
+        self._message_id = message_id
+        try:
+            # a message is not sent twice if the first attempt might have reached GREIN
+            xhr_send_r = self._request(lambda: self._session.post(self._xhr_send_url, data=payload, timeout=self.timeout),
+                                       "xhr_send", idempotent=False)
+            self._count(requests=1, bytes_received=len(xhr_send_r.content), bytes_sent=len(payload))
+        except requests.exceptions.RequestException as err:
+            raise GreinSessionExpiredException("Streaming error: ", err)
+        if xhr_send_r.status_code == 404:
+            raise GreinSessionExpiredException("SockJS session not found")
+        # GREIN might have processed the message, it is only sent again in a new session
+        if xhr_send_r.status_code in RETRY_STATUS_CODES:
+            raise GreinSessionExpiredException(f"SockJS message failed with status code {xhr_send_r.status_code}")
+        try:
+            xhr_send_r.raise_for_status()
+        except requests.exceptions.HTTPError as err:
+            LOGGER.error(f"Streaming error with: {err}")
+            raise GreinLoaderException("Streaming error: ", err)
+
+    def _post(self, path: str, gse_id: str = None, **kwargs) -> requests.Response:
+        """ sends a request to the session's url, e.g. dataobj/geo_summary """
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "Accept": "application/json, text/javascript, */*; q=0.01",
+            "Origin": self.grein_url.split("/apps/")[0],
+            "Referer": f"{self.grein_url}?gse={gse_id or ''}"
+        }
+        url = f"{self.grein_url}session/{self.session_id}/{path}"
+        r = self._request(lambda: self._session.post(url, headers=headers, timeout=self.timeout, **kwargs),
+                          path.split("?")[0])
+        # the body of a streamed response is counted while it is read
+        self._count(requests=1, bytes_received=0 if kwargs.get("stream") else len(r.content),
+                    bytes_sent=len(kwargs.get("data") or ""))
+        if r.status_code == 404:
+            r.close()
+            raise GreinSessionExpiredException(f"Shiny session {self.session_id} not found")
+        return r
+
+    def _init_dataset(self, payloads: utils.GreinLoaderUtils):
+        # streaming parameters of GREIN ui init for data set with gse_id
+        self._send(payloads.ui_init_parameter())  # data needs the gse_id in the payload str
+        self._drain_stream()
+
+        LOGGER.debug("Opening new connection")
+        self._open_stream()
+        LOGGER.debug("Streaming parameter")
+        self._send(payloads.method_update_parameter())  # sets initial parameters for the dataset
+        self._wait_for_ack()
+
+        LOGGER.debug("Streaming client parameter")
+        self._send(payloads.client_parameter())  # sets client parameter for dataset
+        self._state = "dataset"
+
+    def _load_dataset(self, gse_id, download_type, dtype, sparse, counts_path, counts_store, metadata_format,
+                      genes, samples, parts, loaded):
+        """ loads the parts of the dataset which are not in loaded yet, every part is added to loaded when it is done """
+        payloads = utils.GreinLoaderUtils(gse_id)
+        if self.session_id is None:
+            self._connect()
+        if self._state is None:
+            with self._phase("dataset_init"):
+                self._init_dataset(payloads)
+        elif self._state == "overview":
+            with self._phase("dataset_init"):
+                LOGGER.debug("Streaming client parameter")
+                self._send(payloads.client_parameter())
+                self._wait_for_ack()
+            self._state = "dataset"
+
+        if self._gse_id != gse_id:
+            with self._phase("dataset_select"):
+                # the metadata table is only sent when it becomes visible
+                if self._metadata_visible:
+                    self._send(payloads.metadata_hidden_parameter())
+                    self._wait_for_ack()
+                    self._metadata_visible = False
+                self._metadata_labels = None
+                LOGGER.debug("Streaming dataset")
+                self._send(payloads.stream_dataset_parameter())  # sets parameter for streaming
+                self._wait_for_ack()
+                LOGGER.debug("Data received from GREIN ")
+                self._gse_id = gse_id
+
+        # the number of samples in the description is needed to request the metadata
+        if ("description" in parts or "metadata" in parts) and "geo_summary" not in loaded:
+            with self._phase("description"):
+                # random string must be created for the nonce parameter in the following requests
+                random_str = utils.GreinLoaderUtils.get_random_nonce_parameter()
+                # the description is requested for the dataset
+                try:
+                    LOGGER.debug("Request Dataset")
+                    description_r = self._post(f"dataobj/geo_summary?w=&nonce={random_str}", gse_id,
+                                               data=payloads.description_formdata(100))
+                    description_r.raise_for_status()
+                except requests.exceptions.RequestException as err:
+                    LOGGER.error(f"Dataset description for {gse_id} not received")
+                    LOGGER.exception(err)
+                    raise GreinLoaderException(f"Dataset description for {gse_id} not received: ", err)
+                loaded["geo_summary"] = json.loads(description_r.content.decode())
+
+                # formats the description with hidden method in the package,
+                # the description is formatted in a dictionary containing the Study Link, Species, Title and Summary
+                if "description" in parts:
+                    loaded["description"] = _format_description(loaded["geo_summary"])
+
+        if "metadata" in parts and "metadata" not in loaded:
+            with self._phase("metadata"):
+                if self._metadata_labels is None:
+                    # request necessary for the metadata labels, provided in the ui via streaming
+                    self._send(payloads.metadata_labels_parameter())
+                    ui_content = self._wait_for_ack()
+                    self._metadata_visible = True
+                    # parsing the provided data from streaming for keys in the metadata, later used for the metadata dictionary
+                    self._metadata_labels = _metadata_labels(ui_content)
+
+                no_of_samples = loaded["geo_summary"]["data"][1][1]
+                metadata_formdata = _generate_metadata_formdata(len(self._metadata_labels), no_of_samples)
+
+                # random string created for requesting the metadata
+                random_str = ''.join(random.choice(string.ascii_letters) for _ in range(10))
+                # metadata request, without the keys for later
+                try:
+                    metadata_r = self._post(f"dataobj/metadata_full?w=&nonce={random_str}]", gse_id,
+                                            data=metadata_formdata)
+                except requests.exceptions.RequestException as err:
+                    LOGGER.error(f"Metadata for {gse_id} not received.")
+                    LOGGER.exception(err)
+                    raise GreinLoaderException(f"Metadata for {gse_id} not received: ", err)
+
+                # formats metadata to a dictionary with labels provided by the stream and values provided by metadata_r
+                metadata = ""
+                if metadata_r.status_code != 500:
+                    format_metadata = _format_metadata_frame if metadata_format == "dataframe" else _format_metadata
+                    metadata = format_metadata(json.loads(metadata_r.content.decode()), self._metadata_labels)
+                loaded["metadata"] = metadata
+
+        if "counts" in parts and "counts" not in loaded:
+            # with BOTH the count matrix of the current choice is downloaded first, so the choice changes once
+            matrix_types = _count_matrix_types(download_type)
+            if self._counts_choice == "Normalized":
+                matrix_types = sorted(matrix_types, key=lambda matrix_type: matrix_type != "NORMALIZED")
+            with self._phase("counts_download"):
+                # method update for count_matrix
+                self._send(payloads.count_matrix_parameter())
+                self._wait_for_ack()
+
+                for matrix_type in matrix_types:
+                    if f"counts_{matrix_type}" in loaded:
+                        continue
+                    # the choice between raw and normalized counts is kept by the shiny app
+                    counts_choice = "Normalized" if matrix_type == "NORMALIZED" else "Raw"
+                    if self._counts_choice != counts_choice:
+                        self._send(payloads.count_matrix_normalized() if counts_choice == "Normalized"
+                                   else payloads.count_matrix_raw())
+                        self._counts_choice = counts_choice
+                    loaded[f"counts_{matrix_type}"] = self._download_count_matrix(gse_id, dtype, sparse, counts_path,
+                                                                                 counts_store, genes, samples)
+
+            if download_type == "BOTH":
+                loaded["counts"] = CountMatrices(*_align_count_matrices(loaded["counts_RAW"],
+                                                                        loaded["counts_NORMALIZED"]))
+            else:
+                loaded["counts"] = loaded[f"counts_{download_type}"]
+
+        return loaded.get("description"), loaded.get("metadata"), loaded.get("counts")
+
+    def _download_count_matrix(self, gse_id, dtype, sparse, counts_path, counts_store, genes, samples):
+        """ downloads the count matrix of the current counts choice, an interrupted transfer is requested again
+            if the session has a scheduler
+        """
+        attempt = 0
+        while True:
+            # requesting count matrix
+            try:
+                # the body is only read while it is parsed
+                count_matrix_r = self._post("download/downloadcounts?w=", gse_id, stream=True)
+            except requests.exceptions.RequestException as err:
+                LOGGER.error(f"Count Matrix for {gse_id} not received")
+                LOGGER.exception(err)
+                raise GreinLoaderException(f"Count Matrix for {gse_id} not received: ", err)
+            LOGGER.debug("Count matrix received")
+
+            # formats the count matrix provided by count_matrix_r request to a pandas dataframe
+            count_matrix = ""
+            try:
+                # 500 is the answer for datasets without a count matrix, other errors must not be read as counts
+                if count_matrix_r.status_code != 500 and count_matrix_r.status_code >= 400:
+                    LOGGER.error(f"Count Matrix for {gse_id} not received, status code {count_matrix_r.status_code}")
+                    raise GreinLoaderException(f"Count Matrix for {gse_id} not received, status code "
+                                               f"{count_matrix_r.status_code}")
+                if count_matrix_r.status_code != 500 and counts_path is not None:
+                    with self._phase("counts_write"):
+                        count_matrix = _write_count_matrix(count_matrix_r, counts_path, self._stats)
+                elif count_matrix_r.status_code != 500 and counts_store is not None:
+                    with self._phase("counts_store"):
+                        count_matrix = _store_count_matrix(count_matrix_r, counts_store, dtype,
+                                                           self._stats, genes, samples)
+                elif count_matrix_r.status_code != 500:
+                    # reading the body is counted as counts_download, the rest of the time as counts_parse
+                    with self._phase("counts_parse"):
+                        count_matrix = _read_count_matrix(count_matrix_r, dtype, sparse, self._stats, genes,
+                                                          samples)
+            except (urllib3.exceptions.HTTPError, requests.exceptions.RequestException) as err:
+                # with a scheduler an interrupted transfer is requested again
+                if self.scheduler is None or attempt >= self.scheduler.retries:
+                    raise
+                LOGGER.warning(f"Count matrix transfer for {gse_id} interrupted, retrying: {err}")
+                self.scheduler.failure(attempt)
+                attempt += 1
+                continue
+            finally:
+                count_matrix_r.close()
+            return count_matrix
+
+    def _init_overview(self):
+        payloads = utils.GreinLoaderUtils()
+        if self.session_id is None:
+            self._connect()
+        if self._state is None:
+            with self._phase("overview_init"):
+                # requesting streaming parameter for overview page on GREIN
+                self._send(payloads.overview_streaming())
+                self._send(payloads.overview_streaming_updata())
+            self._state = "overview"
+
+    def _request_overview_page(self, start: int, length: int, draw: int = 1) -> Tuple[list, int]:
+        """ requests datasets start to start + length of the overview table
+            :return: list of dict for the datasets and the total number of datasets on GREIN
+            :rtype: list, int
+        """
+        self._init_overview()
+        payloads = utils.GreinLoaderUtils()
+        # create the unique random string used later for nonce parameter in url
+        random_str = utils.GreinLoaderUtils.get_random_nonce_parameter()
+        with self._phase("overview"):
+            # requesting overview of dataset with number of datasets defined in the data parameter
+            try:
+                overview_stream = self._post(f"dataobj/datatable?w=&nonce={random_str}",
+                                             data=payloads.overview_form_data(length, start, draw))
+                overview_stream.raise_for_status()
+            except requests.exceptions.RequestException as err:
+                LOGGER.error(f"Overview streaming error {err}")
+                raise GreinLoaderException("Overview streaming error", err)
+
+            # process dataset
+            content_ = json.loads(overview_stream.content.decode())
+            content_data = content_['data']  # containing relevant data in streaming response
+
+            # creating datastructure for return, list of dictionaries, each dict is a dataset on GREIN
+            list_overview = [_format_overview_item(item) for item in content_data]
+        return list_overview, content_.get("recordsTotal", len(list_overview))
+
+    def _overview_page(self, start: int, length: int, draw: int) -> Tuple[list, int]:
+        return self._reconnecting(self._request_overview_page, start, length, draw)
+
+
+def _count_matrix_types(download_type: str) -> Tuple[str, ...]:
+    return ("RAW", "NORMALIZED") if download_type == "BOTH" else (download_type,)
+
+
+def _get_cached(cache: DatasetCache, gse_id: str, download_type: str):
+    """ reads a dataset from the cache, with BOTH both count matrices must be cached """
+    if download_type != "BOTH":
+        return cache.get(gse_id, download_type)
+    raw = cache.get(gse_id, "RAW")
+    normalized = cache.get(gse_id, "NORMALIZED") if raw is not None else None
+    if normalized is None:
+        return None
+    return raw[0], raw[1], CountMatrices(*_align_count_matrices(raw[2], normalized[2]))
@@ -0,0 +1,236 @@
+# hand-off of loaded datasets to other processes through shared memory
+# share_dataset copies the count matrix once into a shared memory block, other processes attach to the block
+# by its name and get read-only numpy and pandas views of the values without copying or unpickling them.
+# The block starts with the length of a JSON header holding the genes, samples, description and metadata,
+# the values follow in row-major order, so the rows of a gene are contiguous as in a CountMatrixStore.
+# A SharedDataset is pickled as its name, so it can be passed to the workers of a multiprocessing pool.
+
+import os
+import sys
+import mmap
+import json
+import uuid
+import struct
+import logging
+import numpy
+import pandas
+from typing import Optional, Tuple, Union
+from .count_store import CountMatrixStore, STORE_CHUNK_SIZE
+from .formatting import _metadata_frame_to_dict, _metadata_dict_to_frame
+from .exceptions import GreinLoaderException
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+try:
+    import _posixshmem
+except ImportError:
+    _posixshmem = None
+
+LOGGER = logging.getLogger(__name__)
+
+_HEADER_LENGTH = struct.Struct("<Q")
+# the values start at a multiple of the cache line size
+_ALIGNMENT = 64
+_NAME_PREFIX = "grein_"
+
+
+class SharedDataset:
+    def __init__(self, name: str, _shm=None):
+        """Attach to a dataset published with share_dataset, the values are not copied.
+
+        :param name: The name of the shared memory block, SharedDataset.name of the published dataset
+        :type name: str
+        """
+        if shared_memory is None:
+            raise GreinLoaderException("Shared memory requires Python 3.8 or newer")
+        self.name = name
+        self._owner = _shm is not None
+        self._shm = _shm if _shm is not None else _attach(name)
+        header_length, = _HEADER_LENGTH.unpack_from(self._shm.buf)
+        header = json.loads(bytes(self._shm.buf[_HEADER_LENGTH.size:_HEADER_LENGTH.size + header_length]))
+        offset = _values_offset(header_length)
+        self.description: Optional[dict] = header["description"]
+        metadata = header["metadata"]
+        self.metadata = _metadata_dict_to_frame(metadata) if header["metadata_format"] == "dataframe" else metadata
+        self.genes = pandas.Index(header["genes"], name="gene")
+        self.samples = pandas.Index(header["samples"])
+        self.values = numpy.ndarray(tuple(header["shape"]), dtype=header["dtype"], buffer=self._shm.buf,
+                                    offset=offset)
+        self.values.flags.writeable = False
+
+    def __reduce__(self):
+        # the workers attach to the block instead of receiving a copy of the values
+        return attach_dataset, (self.name,)
+
+    def __enter__(self) -> "SharedDataset":
+        return self
+
+    def __exit__(self, *exc):
+        if self._owner:
+            self.unlink()
+        self.close()
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def dtype(self) -> numpy.dtype:
+        return self.values.dtype
+
+    @property
+    def count_matrix(self) -> pandas.DataFrame:
+        """ read-only view of the count matrix with the genes as index and the samples as columns """
+        return pandas.DataFrame(self.values, index=self.genes, columns=self.samples, copy=False)
+
+    def to_dataframe(self) -> pandas.DataFrame:
+        """ copies the count matrix to the format returned by load_dataset """
+        return pandas.DataFrame(numpy.array(self.values), index=self.genes, columns=self.samples).reset_index()
+
+    def close(self):
+        """ detaches from the block, views of the values must not be used afterwards """
+        if self._shm is None:
+            return
+        self.values = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # a view of the values is still referenced, the block is unmapped when it is released
+            LOGGER.warning(f"Views of the shared dataset {self.name} are still in use")
+        self._shm = None
+
+    def unlink(self):
+        """ frees the block once all processes are detached, called by the process which published the dataset """
+        shm = self._shm if self._shm is not None else _attach(self.name)
+        shm.unlink()
+        if shm is not self._shm:
+            shm.close()
+
+
+def share_dataset(dataset: Union[tuple, pandas.DataFrame, CountMatrixStore], name: str = None) -> SharedDataset:
+    """ publishes a dataset in shared memory, the count matrix is copied once
+        :param: dataset: description, metadata and count matrix as returned by load_dataset, or only the count
+                matrix as dataframe or CountMatrixStore,
+                name: name of the shared memory block, a unique name is generated by default
+        :type: dataset: tuple, pandas dataframe or CountMatrixStore, name: str
+        :return: the published dataset, its name is passed to the other processes. It must be unlinked when it
+                 is not needed anymore, which the with statement does on exit.
+        :rtype: SharedDataset
+    """
+    if shared_memory is None:
+        raise GreinLoaderException("Shared memory requires Python 3.8 or newer")
+    description, metadata, count_matrix = dataset if isinstance(dataset, tuple) else (None, None, dataset)
+    metadata_format = "dataframe" if isinstance(metadata, pandas.DataFrame) else "dict"
+    if metadata_format == "dataframe":
+        metadata = _metadata_frame_to_dict(metadata)
+
+    genes, samples, values = _count_matrix_values(count_matrix)
+    dtype = numpy.dtype(values.dtype)
+    shape = values.shape
+    header = {"description": description, "metadata": metadata, "metadata_format": metadata_format,
+              "genes": [str(gene) for gene in genes], "samples": [str(sample) for sample in samples],
+              "dtype": dtype.str, "shape": list(shape)}
+    header_bytes = json.dumps(header).encode()
+    offset = _values_offset(len(header_bytes))
+
+    shm = shared_memory.SharedMemory(name or _NAME_PREFIX + uuid.uuid4().hex, create=True,
+                                     size=max(1, offset + values.nbytes))
+    try:
+        _HEADER_LENGTH.pack_into(shm.buf, 0, len(header_bytes))
+        shm.buf[_HEADER_LENGTH.size:_HEADER_LENGTH.size + len(header_bytes)] = header_bytes
+        target = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        # a memory-mapped store is copied in blocks of rows
+        for start in range(0, shape[0], STORE_CHUNK_SIZE):
+            target[start:start + STORE_CHUNK_SIZE] = values[start:start + STORE_CHUNK_SIZE]
+        del target
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    LOGGER.debug(f"Dataset with {shape[0]} genes and {shape[1]} samples shared as {shm.name}")
+    return SharedDataset(shm.name, _shm=shm)
+
+
+def attach_dataset(name: str) -> SharedDataset:
+    """ attaches to the dataset published with share_dataset under name, see SharedDataset """
+    return SharedDataset(name)
+
+
+def _count_matrix_values(count_matrix) -> Tuple[pandas.Index, pandas.Index, numpy.ndarray]:
+    if count_matrix is None:
+        return pandas.Index([]), pandas.Index([]), numpy.zeros((0, 0))
+    if isinstance(count_matrix, CountMatrixStore):
+        return count_matrix.genes, count_matrix.samples, count_matrix.values
+    if "gene" in count_matrix.columns:
+        count_matrix = count_matrix.set_index("gene")
+    if any(isinstance(dtype, pandas.SparseDtype) for dtype in count_matrix.dtypes):
+        count_matrix = count_matrix.sparse.to_dense()
+    dtype = _numpy_dtype(count_matrix)
+    if dtype is None:
+        values = count_matrix.to_numpy()
+    elif dtype.kind == "f":
+        values = count_matrix.to_numpy(dtype=dtype, na_value=numpy.nan)
+    else:
+        values = count_matrix.to_numpy(dtype=dtype)
+    if values.dtype == object:
+        raise ValueError("The count matrix must only hold numbers")
+    return count_matrix.index, count_matrix.columns, values
+
+
+def _numpy_dtype(count_matrix: pandas.DataFrame) -> Optional[numpy.dtype]:
+    """ numpy dtype of nullable columns like Int64, None if all columns have a numpy dtype """
+    dtypes = [getattr(dtype, "numpy_dtype", dtype) for dtype in count_matrix.dtypes]
+    if all(isinstance(dtype, numpy.dtype) for dtype in count_matrix.dtypes) or \
+            not all(isinstance(dtype, numpy.dtype) for dtype in dtypes):
+        return None
+    dtype = numpy.result_type(*dtypes)
+    # missing values are stored as NaN
+    if dtype.kind != "f" and count_matrix.isna().to_numpy().any():
+        return numpy.dtype("float64")
+    return dtype
+
+
+def _values_offset(header_length: int) -> int:
+    return -(-(_HEADER_LENGTH.size + header_length) // _ALIGNMENT) * _ALIGNMENT
+
+
+def _attach(name: str):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    if _posixshmem is None:
+        # the resource tracker is only used on POSIX
+        return shared_memory.SharedMemory(name)
+    return _UntrackedBlock(name)
+
+
+class _UntrackedBlock:
+    def __init__(self, name: str):
+        """Shared memory block attached without registering it with the resource tracker, like
+        SharedMemory(name, track=False) of Python 3.13. Before Python 3.13 SharedMemory registers every
+        attached block, and the tracker unlinks it when the process exits. Processes started by
+        multiprocessing share the tracker of their parent, so unregistering would drop the registration
+        of the creating process as well.
+
+        :param name: The name of the block
+        :type name: str
+        """
+        self.name = name
+        fd = _posixshmem.shm_open("/" + name, os.O_RDWR, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        if self.buf is not None:
+            # raises BufferError while views of the values are in use, like SharedMemory.close
+            self.buf.release()
+            self.buf = None
+        self._mmap.close()
+
+    def unlink(self):
+        _posixshmem.shm_unlink("/" + self.name)
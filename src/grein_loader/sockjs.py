@@ -0,0 +1,111 @@
+# incremental decoder for the xhr_streaming responses of the GREIN shiny app
+# SockJS sends one frame per line: a prelude of "h" characters, "o" when the session is opened, "h" heartbeats,
+# "a[...]" with a JSON array of messages and "c[code, reason]" when the session is closed.
+# The messages of shiny's reconnecting protocol are "ACK <id>" acknowledgements and "<id>#<channel>|m|<json>"
+# messages, the json holds the session config or updated values and outputs of the app.
+# The decoder is fed the bytes as they arrive and yields typed messages, frames can be split over several chunks.
+
+import json
+import logging
+from typing import Any, List, NamedTuple, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+# kinds of decoded messages
+OPEN = "open"
+HEARTBEAT = "heartbeat"
+CLOSE = "close"
+ACK = "ack"
+CONFIG = "config"
+VALUES = "values"
+MESSAGE = "message"
+
+
+class Message(NamedTuple):
+    """ A message decoded from the stream
+        :param: kind: OPEN, HEARTBEAT, CLOSE, ACK, CONFIG, VALUES or MESSAGE for other shiny messages
+        :param: data: the decoded shiny message for CONFIG, VALUES and MESSAGE, [code, reason] for CLOSE
+        :param: message_id: the acknowledged message id for ACK, the id of the shiny message otherwise
+    """
+    kind: str
+    data: Any = None
+    message_id: Optional[int] = None
+
+
+class FrameDecoder:
+    def __init__(self):
+        """Decoder for one xhr_streaming response, create a new decoder for every response."""
+        # parts of a frame whose end was not received yet
+        self._parts = []
+
+    def feed(self, data: bytes) -> List[Message]:
+        """ decodes the frames completed by data
+            :param: data: the next bytes of the response
+            :type: data: bytes
+            :return: the messages of all completed frames
+            :rtype: list of Message
+        """
+        messages = []
+        start = 0
+        end = data.find(b"\n")
+        while end >= 0:
+            if self._parts:
+                self._parts.append(data[start:end])
+                frame = b"".join(self._parts)
+                self._parts = []
+            else:
+                frame = data[start:end]
+            messages += decode_frame(frame)
+            start = end + 1
+            end = data.find(b"\n", start)
+        if start < len(data):
+            self._parts.append(data[start:])
+        return messages
+
+
+def decode_frame(frame: bytes) -> List[Message]:
+    """ decodes one SockJS frame without the trailing newline
+        :return: the messages in the frame, an empty list for unknown frames
+        :rtype: list of Message
+    """
+    if not frame:
+        return []
+    kind = frame[:1]
+    if kind == b"a":
+        return [decode_message(message) for message in json.loads(frame[1:])]
+    if kind == b"h":
+        # heartbeat or the prelude of a streaming response
+        return [Message(HEARTBEAT)]
+    if kind == b"o":
+        return [Message(OPEN)]
+    if kind == b"c":
+        return [Message(CLOSE, json.loads(frame[1:]))]
+    LOGGER.debug(f"Unknown SockJS frame {frame[:20]!r}")
+    return []
+
+
+def decode_message(message: str) -> Message:
+    """ decodes one message of an "a" frame """
+    if message.startswith("ACK"):
+        return Message(ACK, message_id=_parse_id(message[3:].strip()))
+    header, separator, body = message.partition("|m|")
+    if not separator:
+        # without the reconnecting protocol shiny sends the json alone
+        header, body = "", message
+    message_id = _parse_id(header.partition("#")[0])
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return Message(MESSAGE, message, message_id)
+    if isinstance(data, dict) and "config" in data:
+        return Message(CONFIG, data, message_id)
+    if isinstance(data, dict) and "values" in data:
+        return Message(VALUES, data, message_id)
+    return Message(MESSAGE, data, message_id)
+
+
+def _parse_id(value: str) -> Optional[int]:
+    try:
+        return int(value, 16)
+    except ValueError:
+        return None
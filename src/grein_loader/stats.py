@@ -0,0 +1,123 @@
+# timing and transfer statistics for the phases of a load, e.g. the handshake, waiting for ACK frames,
+# the description, metadata and count matrix requests and parsing the count matrix
+# phases can be nested, the time of a nested phase is not counted for the enclosing phase,
+# so the seconds of all phases add up to the wall time of the load
+
+import time
+import contextlib
+from typing import Dict
+
+
+class PhaseStats:
+    def __init__(self):
+        """Statistics of one named phase, summed over all times the phase was entered."""
+        self.seconds = 0.0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.requests = 0
+        self.calls = 0
+
+    def as_dict(self) -> dict:
+        return {"seconds": self.seconds, "bytes_received": self.bytes_received, "bytes_sent": self.bytes_sent,
+                "requests": self.requests, "calls": self.calls}
+
+    def __repr__(self):
+        return f"PhaseStats({', '.join(f'{key}={value!r}' for key, value in self.as_dict().items())})"
+
+
+class LoadStats:
+    def __init__(self):
+        """Collects PhaseStats for every phase of load_dataset and load_overview.
+        The same object can be passed to several loads, the statistics are summed up.
+
+        Phases of load_dataset: cache, handshake, dataset_init, dataset_select, ack_wait, description,
+        metadata, counts_download, counts_parse, counts_write (with download_counts_to)
+        and counts_store (with store_counts_to).
+        Phases of load_overview: handshake, overview_init and overview.
+        """
+        self.phases: Dict[str, PhaseStats] = {}
+        # [name, start, seconds of nested phases] for every entered phase
+        self._active = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """ context manager measuring the wall time of the phase name """
+        frame = [name, time.perf_counter(), 0.0]
+        self._active.append(frame)
+        try:
+            yield
+        finally:
+            self._active.pop()
+            elapsed = time.perf_counter() - frame[1]
+            phase = self._phase_stats(name)
+            phase.seconds += elapsed - frame[2]
+            phase.calls += 1
+            if self._active:
+                self._active[-1][2] += elapsed
+
+    def add(self, requests: int = 0, bytes_received: int = 0, bytes_sent: int = 0):
+        """ counts requests and bytes for the innermost active phase """
+        phase = self._phase_stats(self._active[-1][0] if self._active else "other")
+        phase.requests += requests
+        phase.bytes_received += bytes_received
+        phase.bytes_sent += bytes_sent
+
+    def reader(self, raw, name: str) -> "_TimedReader":
+        """ wraps the file-like object raw, reading from it is counted as phase name """
+        return _TimedReader(raw, self, name)
+
+    def _phase_stats(self, name: str) -> PhaseStats:
+        if name not in self.phases:
+            self.phases[name] = PhaseStats()
+        return self.phases[name]
+
+    @property
+    def seconds(self) -> float:
+        return sum(phase.seconds for phase in self.phases.values())
+
+    @property
+    def bytes_received(self) -> int:
+        return sum(phase.bytes_received for phase in self.phases.values())
+
+    @property
+    def bytes_sent(self) -> int:
+        return sum(phase.bytes_sent for phase in self.phases.values())
+
+    @property
+    def requests(self) -> int:
+        return sum(phase.requests for phase in self.phases.values())
+
+    def as_dict(self) -> dict:
+        """ returns the statistics as dict of phase name to dict of seconds, bytes_received, bytes_sent,
+            requests and calls, e.g. to pass them on to a metrics system
+        """
+        return {name: phase.as_dict() for name, phase in self.phases.items()}
+
+    def __repr__(self):
+        return f"LoadStats({self.phases!r})"
+
+
+class _TimedReader:
+    """ file-like object counting the time spent in read and the bytes read on the wire """
+    def __init__(self, raw, stats: LoadStats, name: str):
+        self.raw = raw
+        self.stats = stats
+        self.name = name
+
+    def read(self, *args) -> bytes:
+        with self.stats.phase(self.name):
+            position = self.raw.tell()
+            data = self.raw.read(*args)
+            # tell() of a urllib3 response counts the bytes before decoding the content
+            self.stats.add(bytes_received=self.raw.tell() - position)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.readline(), b"")
+
+    def readline(self, *args) -> bytes:
+        with self.stats.phase(self.name):
+            position = self.raw.tell()
+            data = self.raw.readline(*args)
+            self.stats.add(bytes_received=self.raw.tell() - position)
+        return data
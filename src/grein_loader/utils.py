@@ -1,6 +1,10 @@
+import re
 import string
 import random
 
+# base url
+GREIN_URL = "https://www.ilincs.org/apps/grein/"
+
 
 class GreinLoaderUtils:
     def __init__(self, gse_id: str = None):
@@ -35,6 +39,12 @@ class GreinLoaderUtils:
 
     def count_matrix_normalized(self):
         return '["19#0|m|{\\"method\\":\\"update\\",\\"data\\":{\\"counts_choice\\":\\"Normalized\\"}}"]'
+
+    def count_matrix_raw(self):
+        return '["19#0|m|{\\"method\\":\\"update\\",\\"data\\":{\\"counts_choice\\":\\"Raw\\"}}"]'
+
+    def metadata_hidden_parameter(self):
+        return '["C#0|m|{\\"method\\":\\"update\\",\\"data\\":{\\"tab2\\":\\"summary\\",\\".clientdata_output_geo_summary_hidden\\":false,\\".clientdata_output_metadata_hidden\\":true,\\".clientdata_output_metadata_full_hidden\\":true,\\".clientdata_output_ontology_hidden\\":true}}"]'
     
     def raw_form_start(self):
         return "draw=1&columns%5B0%5D%5Bdata%5D=0&columns%5B0%5D%5Bname%5D=&columns%5B0%5D%5Bsearchable%5D=true&columns%5B0%5D%5Borderable%5D=false&columns%5B0%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B0%5D%5Bsearch%5D%5Bregex%5D=false"
@@ -51,9 +61,29 @@ class GreinLoaderUtils:
     def overview_streaming_updata(self):
         return '["2#0|m|{\\"method\\":\\"update\\",\\"data\\":{\\".clientdata_output_warn_hidden\\":true,\\".clientdata_output_warn3_hidden\\":true,\\".clientdata_output_warn4_hidden\\":true,\\".clientdata_output_warn5_hidden\\":true}}"]'
 
-    def overview_form_data(self, no_datasets):
-        return f"draw=1&columns%5B0%5D%5Bdata%5D=0&columns%5B0%5D%5Bname%5D=&columns%5B0%5D%5Bsearchable%5D=true&columns%5B0%5D%5Borderable%5D=true&columns%5B0%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B0%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B1%5D%5Bdata%5D=1&columns%5B1%5D%5Bname%5D=&columns%5B1%5D%5Bsearchable%5D=true&columns%5B1%5D%5Borderable%5D=true&columns%5B1%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B1%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B2%5D%5Bdata%5D=2&columns%5B2%5D%5Bname%5D=&columns%5B2%5D%5Bsearchable%5D=true&columns%5B2%5D%5Borderable%5D=true&columns%5B2%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B2%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B3%5D%5Bdata%5D=3&columns%5B3%5D%5Bname%5D=&columns%5B3%5D%5Bsearchable%5D=true&columns%5B3%5D%5Borderable%5D=true&columns%5B3%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B3%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B4%5D%5Bdata%5D=4&columns%5B4%5D%5Bname%5D=&columns%5B4%5D%5Bsearchable%5D=true&columns%5B4%5D%5Borderable%5D=true&columns%5B4%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B4%5D%5Bsearch%5D%5Bregex%5D=false&start=0&length={no_datasets}&search%5Bvalue%5D=&search%5Bregex%5D=false&search%5BcaseInsensitive%5D=true&search%5Bsmart%5D=true&escape=false"
+    def overview_form_data(self, no_datasets, start = 0, draw = 1):
+        return f"draw={draw}&columns%5B0%5D%5Bdata%5D=0&columns%5B0%5D%5Bname%5D=&columns%5B0%5D%5Bsearchable%5D=true&columns%5B0%5D%5Borderable%5D=true&columns%5B0%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B0%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B1%5D%5Bdata%5D=1&columns%5B1%5D%5Bname%5D=&columns%5B1%5D%5Bsearchable%5D=true&columns%5B1%5D%5Borderable%5D=true&columns%5B1%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B1%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B2%5D%5Bdata%5D=2&columns%5B2%5D%5Bname%5D=&columns%5B2%5D%5Bsearchable%5D=true&columns%5B2%5D%5Borderable%5D=true&columns%5B2%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B2%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B3%5D%5Bdata%5D=3&columns%5B3%5D%5Bname%5D=&columns%5B3%5D%5Bsearchable%5D=true&columns%5B3%5D%5Borderable%5D=true&columns%5B3%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B3%5D%5Bsearch%5D%5Bregex%5D=false&columns%5B4%5D%5Bdata%5D=4&columns%5B4%5D%5Bname%5D=&columns%5B4%5D%5Bsearchable%5D=true&columns%5B4%5D%5Borderable%5D=true&columns%5B4%5D%5Bsearch%5D%5Bvalue%5D=&columns%5B4%5D%5Bsearch%5D%5Bregex%5D=false&start={start}&length={no_datasets}&search%5Bvalue%5D=&search%5Bregex%5D=false&search%5BcaseInsensitive%5D=true&search%5Bsmart%5D=true&escape=false"
+
+
+    @staticmethod
+    def get_message_id(payload: str) -> int:
+        """Returns the id of a message sent via xhr_send, the ids are hexadecimal numbers.
 
+        :param payload: The message, e.g. '["7#0|m|..."]'
+        :type payload: str
+        """
+        return int(re.match(r'\["([0-9A-Fa-f]+)#', payload).group(1), 16)
+
+    @staticmethod
+    def with_message_id(payload: str, message_id: int) -> str:
+        """Returns the message with its id replaced by message_id.
+
+        :param payload: The message, e.g. '["7#0|m|..."]'
+        :type payload: str
+        :param message_id: The new id of the message
+        :type message_id: int
+        """
+        return re.sub(r'^\["[0-9A-Fa-f]+#', f'["{message_id:X}#', payload, count=1)
 
     @staticmethod
     def get_random_url_string_parameter():
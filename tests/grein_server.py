@@ -0,0 +1,503 @@
+# Local stand-in for the GREIN shiny app on www.ilincs.org.
+# The server speaks the xhr_streaming / xhr_send SockJS framing used by the loaders and serves
+# the dataobj/geo_summary, dataobj/metadata_full, dataobj/datatable and download/downloadcounts
+# endpoints from generated or recorded fixtures. It is used by the offline tests and the benchmark suite.
+
+import os
+import csv
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+METADATA_LABELS = ["", "geo_accession", "title", "source_name", "organism", "tissue", "condition", "treatment"]
+TISSUES = ["liver", "lung", "brain", "kidney", "blood"]
+CONDITIONS = ["control", "disease"]
+TREATMENTS = ["none", "dmso", "drug"]
+SPECIES = ["Homo sapiens", "Mus musculus", "Rattus norvegicus"]
+
+# SockJS closes an xhr_streaming response after this many bytes and the client reconnects
+STREAM_RESPONSE_LIMIT = 128 * 1024
+
+
+class GreinFixtures:
+    def __init__(self, n_datasets: int = 20, n_genes: int = 200, n_samples: int = 6, seed: int = 42):
+        """Deterministically generated GREIN datasets.
+
+        :param n_datasets: Number of GSE series in the overview, defaults to 20
+        :param n_genes: Number of genes per count matrix, defaults to 200
+        :param n_samples: Number of samples per series, defaults to 6
+        :param seed: Seed of the random generator, defaults to 42
+        """
+        self.n_genes = n_genes
+        self.n_samples = n_samples
+        self.seed = seed
+        self.gse_ids = [f"GSE{100000 + i}" for i in range(n_datasets)]
+        self._raw_counts = {}
+        self._csv = {}
+        self._lock = threading.Lock()
+
+    def has_dataset(self, gse_id: str) -> bool:
+        return gse_id in self.gse_ids
+
+    def _rng(self, gse_id: str) -> random.Random:
+        return random.Random(f"{self.seed}-{gse_id}")
+
+    def overview_row(self, gse_id: str) -> list:
+        rng = self._rng(gse_id)
+        return [
+            f"<a href=\"https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc={gse_id}\" target=\"_blank\">{gse_id}</a>",
+            self.n_samples,
+            rng.choice(SPECIES),
+            f"Expression profiling of {rng.choice(TISSUES)} tissue in series {gse_id}",
+            f"Summary of {gse_id}: samples were treated with {rng.choice(TREATMENTS)}."
+        ]
+
+    def description(self, gse_id: str) -> dict:
+        row = self.overview_row(gse_id)
+        return {
+            "draw": 1,
+            "recordsTotal": 5,
+            "recordsFiltered": 5,
+            "data": [
+                ["Study link", f"<a href=\"https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc={gse_id}\" "
+                               f"target=\"_blank\">{gse_id}</a>"],
+                ["Samples", self.n_samples],
+                ["Species", row[2]],
+                ["Title", row[3]],
+                ["Summary", row[4]]
+            ]
+        }
+
+    def sample_ids(self, gse_id: str) -> list:
+        offset = (int(gse_id[3:]) - 100000) * self.n_samples
+        return [f"GSM{2000000 + offset + i}" for i in range(self.n_samples)]
+
+    def metadata_rows(self, gse_id: str) -> list:
+        rng = self._rng(gse_id)
+        species = self.overview_row(gse_id)[2]
+        rows = []
+        for i, sample in enumerate(self.sample_ids(gse_id)):
+            tissue = rng.choice(TISSUES)
+            rows.append([str(i + 1), sample, f"{gse_id} sample {i + 1}", f"{tissue} biopsy", species,
+                         tissue, CONDITIONS[i % 2], rng.choice(TREATMENTS)])
+        return rows
+
+    def metadata_labels(self, gse_id: str) -> list:
+        return METADATA_LABELS
+
+    def genes(self) -> list:
+        return [f"ENSG{i:011d}" for i in range(self.n_genes)]
+
+    def raw_counts(self, gse_id: str) -> list:
+        with self._lock:
+            if gse_id not in self._raw_counts:
+                rng = self._rng(gse_id)
+                self._raw_counts[gse_id] = [
+                    [0 if rng.random() < 0.4 else int(rng.expovariate(1 / 200)) for _ in range(self.n_samples)]
+                    for _ in range(self.n_genes)
+                ]
+            return self._raw_counts[gse_id]
+
+    def count_matrix_csv(self, gse_id: str, normalized: bool = False) -> bytes:
+        # formatting large count matrices is slow, the csv is kept to not distort benchmarks
+        with self._lock:
+            if (gse_id, normalized) in self._csv:
+                return self._csv[(gse_id, normalized)]
+        body = self._format_count_matrix(gse_id, normalized)
+        with self._lock:
+            self._csv[(gse_id, normalized)] = body
+        return body
+
+    def _format_count_matrix(self, gse_id: str, normalized: bool) -> bytes:
+        counts = self.raw_counts(gse_id)
+        lines = ['"",' + ",".join(f'"{s}"' for s in self.sample_ids(gse_id))]
+        if normalized:
+            # counts per million, the values of GREIN are only checked against recorded datasets
+            totals = [sum(row[j] for row in counts) or 1 for j in range(self.n_samples)]
+            for gene, row in zip(self.genes(), counts):
+                lines.append(f'"{gene}",' + ",".join(f"{v / totals[j] * 1e6:.6g}" for j, v in enumerate(row)))
+        else:
+            for gene, row in zip(self.genes(), counts):
+                lines.append(f'"{gene}",' + ",".join(str(v) for v in row))
+        return ("\n".join(lines) + "\n").encode()
+
+    def save(self, directory: str):
+        """ writes the fixtures in the format read by RecordedFixtures """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "overview.json"), "w") as f:
+            json.dump([self.overview_row(gse_id) for gse_id in self.gse_ids], f)
+        for gse_id in self.gse_ids:
+            _save_dataset(os.path.join(directory, gse_id), self.description(gse_id), self.metadata_labels(gse_id),
+                          self.metadata_rows(gse_id), self.count_matrix_csv(gse_id),
+                          self.count_matrix_csv(gse_id, normalized=True))
+
+
+class RecordedFixtures(GreinFixtures):
+    def __init__(self, directory: str):
+        """GREIN datasets replayed from a directory written by GreinFixtures.save or record_fixtures.
+
+        The directory holds overview.json with the rows of the overview table and one directory per
+        GSE id with description.json, metadata.json, counts_raw.csv and counts_normalized.csv.
+
+        :param directory: The directory holding the recorded datasets
+        """
+        self.directory = directory
+        with open(os.path.join(directory, "overview.json")) as f:
+            self._overview = {re.search("GSE[0-9]+", row[0]).group(): row for row in json.load(f)}
+        self.gse_ids = [gse_id for gse_id in self._overview if os.path.isdir(os.path.join(directory, gse_id))]
+
+    def _read(self, gse_id: str, name: str) -> bytes:
+        with open(os.path.join(self.directory, gse_id, name), "rb") as f:
+            return f.read()
+
+    def overview_row(self, gse_id: str) -> list:
+        return self._overview[gse_id]
+
+    def description(self, gse_id: str) -> dict:
+        return json.loads(self._read(gse_id, "description.json"))
+
+    def metadata_labels(self, gse_id: str) -> list:
+        return json.loads(self._read(gse_id, "metadata.json"))["labels"]
+
+    def metadata_rows(self, gse_id: str) -> list:
+        return json.loads(self._read(gse_id, "metadata.json"))["data"]
+
+    def count_matrix_csv(self, gse_id: str, normalized: bool = False) -> bytes:
+        return self._read(gse_id, "counts_normalized.csv" if normalized else "counts_raw.csv")
+
+
+def _save_dataset(directory: str, description: dict, labels: list, rows: list, raw_csv: bytes, normalized_csv: bytes):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "description.json"), "w") as f:
+        json.dump(description, f)
+    with open(os.path.join(directory, "metadata.json"), "w") as f:
+        json.dump({"labels": labels, "data": rows}, f)
+    with open(os.path.join(directory, "counts_raw.csv"), "wb") as f:
+        f.write(raw_csv)
+    with open(os.path.join(directory, "counts_normalized.csv"), "wb") as f:
+        f.write(normalized_csv)
+
+
+def record_fixtures(directory: str, gse_ids: list, session=None):
+    """ loads datasets from GREIN and writes them in the format read by RecordedFixtures
+        :param directory: The directory the datasets are written to
+        :param gse_ids: The GSE ids of the datasets to record
+        :param session: The grein_loader.GreinSession used to load the datasets, defaults to a new session
+    """
+    import grein_loader
+    if session is None:
+        with grein_loader.GreinSession() as session:
+            return record_fixtures(directory, gse_ids, session)
+    rows = []
+    for gse_id in gse_ids:
+        description, metadata, raw = session.load_dataset(gse_id, "RAW")
+        normalized = session.load_dataset(gse_id, "NORMALIZED", parts=["counts"])[2]
+        link = f"<a href=\"{description['Study link']}\" target=\"_blank\">{gse_id}</a>"
+        rows.append([link, len(metadata), description["Species"], description["Title"], description["Summary"]])
+        labels = list(next(iter(metadata.values())).keys()) if metadata else METADATA_LABELS
+        geo_summary = {"draw": 1, "recordsTotal": 5, "recordsFiltered": 5,
+                       "data": [["Study link", link], ["Samples", len(metadata)], ["Species", description["Species"]],
+                                ["Title", description["Title"]], ["Summary", description["Summary"]]]}
+        _save_dataset(os.path.join(directory, gse_id), geo_summary, labels,
+                      [[sample.get(label, "") for label in labels] for sample in metadata.values()],
+                      _to_csv(raw), _to_csv(normalized))
+    with open(os.path.join(directory, "overview.json"), "w") as f:
+        json.dump(rows, f)
+
+
+def _to_csv(count_matrix) -> bytes:
+    # GREIN names the gene column ""
+    return count_matrix.rename(columns={"gene": ""}).to_csv(index=False, quoting=csv.QUOTE_NONNUMERIC).encode()
+
+
+class _ShinySession:
+    def __init__(self):
+        self.session_id = uuid.uuid4().hex
+        self.frames = []
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.opened = False
+        self.gse_id = None
+        self.normalized = False
+        self.metadata_visible = False
+        self._pending_ack = None
+        self._ack_timer = None
+
+    def acknowledge(self, msg_id: str, delay: float = 0.02):
+        """Acknowledgements are cumulative, messages sent in quick succession share one ACK frame."""
+        with self.condition:
+            self._pending_ack = msg_id
+            if self._ack_timer is None:
+                self._ack_timer = threading.Timer(delay, self._flush_ack)
+                self._ack_timer.daemon = True
+                self._ack_timer.start()
+
+    def _flush_ack(self):
+        with self.condition:
+            msg_id, self._pending_ack, self._ack_timer = self._pending_ack, None, None
+        self.push(f"ACK {msg_id}")
+
+    def push(self, message: str):
+        with self.condition:
+            self.frames.append("a" + json.dumps([message]) + "\n")
+            self.condition.notify_all()
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing their connection early is expected, e.g. when a load is cancelled
+        pass
+
+
+class GreinServer:
+    def __init__(self, fixtures: GreinFixtures = None, latency: float = 0.0, gzip_counts: bool = False,
+                 error_rate: float = 0.0, count_errors: dict = None, host: str = "127.0.0.1", port: int = 0):
+        """Stand-in GREIN server running in a background thread.
+
+        :param fixtures: The datasets to serve, defaults to GreinFixtures()
+        :param latency: Seconds to wait before answering each request, defaults to 0
+        :param gzip_counts: Send the count matrix with Content-Encoding gzip if the client accepts it
+        :param error_rate: Fraction of xhr_send and endpoint requests answered with 503, like an overloaded GREIN
+        :param count_errors: Status code the downloadcounts request of a GSE id is answered with, e.g. {"GSE1": 503}
+        """
+        self.fixtures = fixtures or GreinFixtures()
+        self.latency = latency
+        self.gzip_counts = gzip_counts
+        self.error_rate = error_rate
+        self.count_errors = dict(count_errors or {})
+        self.error_count = 0
+        self._random = random.Random(0)
+        self.sessions = {}
+        self.shiny_sessions = {}
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.httpd = _QuietHTTPServer((host, port), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/apps/grein/"
+
+    def start(self) -> "GreinServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for session in list(self.sessions.values()):
+            with session.condition:
+                session.condition.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def expire_sessions(self):
+        """ drops all sessions, as if they timed out or the server restarted """
+        with self._lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+            self.shiny_sessions.clear()
+        for session in sessions:
+            with session.condition:
+                session.generation += 1
+                session.condition.notify_all()
+
+    def sockjs_session(self, key: str, create: bool = True) -> _ShinySession:
+        with self._lock:
+            if key not in self.sessions:
+                if not create:
+                    return None
+                session = _ShinySession()
+                self.sessions[key] = session
+                self.shiny_sessions[session.session_id] = session
+            return self.sessions[key]
+
+    def handle_message(self, session: _ShinySession, message: str):
+        msg_id, _, rest = message.partition("#")
+        if rest.endswith("|o|"):
+            session.push("0#0|m|" + json.dumps({"config": {"workerId": "", "sessionId": session.session_id,
+                                                           "user": None}}))
+            session.acknowledge(msg_id)
+            return
+        payload = json.loads(rest.split("|m|", 1)[1])
+        data = payload.get("data", {})
+        if payload.get("method") == "init":
+            match = re.search(r"gse=(GSE[0-9]+)", data.get(".clientdata_url_search", ""))
+            session.gse_id = match.group(1) if match else None
+            # the initial render of the app exceeds the streaming response limit
+            session.push("1#0|m|" + json.dumps({"values": {"padding": "x" * STREAM_RESPONSE_LIMIT}}))
+        render_metadata = False
+        if "geo_acc" in data:
+            session.gse_id = data["geo_acc"]
+            session.push("1#0|m|" + json.dumps({"values": {"geo_acc_ui": session.gse_id}}))
+            render_metadata = session.metadata_visible
+        if data.get("counts_choice") is not None:
+            session.normalized = data["counts_choice"] == "Normalized"
+        if "tab2" in data:
+            render_metadata = data["tab2"] == "metadata" and not session.metadata_visible
+            session.metadata_visible = data["tab2"] == "metadata"
+        # like shiny, outputs are sent when they become visible or their inputs change
+        if render_metadata and self.fixtures.has_dataset(session.gse_id):
+            header = "".join(f"<th>{label}</th>" for label in self.fixtures.metadata_labels(session.gse_id))
+            table = f"<table class=\"display\"><thead><tr>{header}</tr></thead></table>"
+            session.push("1#0|m|" + json.dumps({"values": {"metadata_full": {"x": {"container": table}}}}))
+        session.acknowledge(msg_id)
+
+
+def _make_handler(server: GreinServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _send(self, status: int, body: bytes, content_type: str = "application/json", headers: dict = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            self._count()
+            if urlparse(self.path).path.rstrip("/").endswith("/apps/grein"):
+                self._send(200, b"<html><body>GREIN</body></html>", "text/html")
+            else:
+                self._send(404, b"")
+
+        def do_POST(self):
+            self._count()
+            path = urlparse(self.path).path
+            body = self._body()
+            if self._inject_error(path):
+                return self._send(503, b"", "text/plain")
+            if "/__sockjs__/" in path:
+                key = path.rsplit("/", 1)[0]
+                if path.endswith("/xhr_streaming"):
+                    return self._xhr_streaming(server.sockjs_session(key))
+                if path.endswith("/xhr_send"):
+                    session = server.sockjs_session(key, create=False)
+                    if session is None:
+                        return self._send(404, b"", "text/plain")
+                    for message in json.loads(body.decode()):
+                        server.handle_message(session, message)
+                    return self._send(204, b"", "text/plain")
+            match = re.search(r"/session/([0-9a-f]+)/(dataobj|download)/(\w+)", path)
+            if match is None or match.group(1) not in server.shiny_sessions:
+                return self._send(404, b"")
+            session = server.shiny_sessions[match.group(1)]
+            form = {k: v[0] for k, v in parse_qs(body.decode(), keep_blank_values=True).items()}
+            self._endpoint(session, match.group(3), form)
+
+        def _inject_error(self, path: str) -> bool:
+            if not server.error_rate or path.endswith("/xhr_streaming"):
+                return False
+            with server._lock:
+                if server._random.random() >= server.error_rate:
+                    return False
+                server.error_count += 1
+            return True
+
+        def _count(self):
+            with server._lock:
+                server.request_count += 1
+            if server.latency:
+                time.sleep(server.latency)
+
+        def _endpoint(self, session: _ShinySession, name: str, form: dict):
+            fixtures = server.fixtures
+            start = int(form.get("start", 0))
+            length = int(form.get("length", -1))
+            if name == "datatable":
+                rows = [fixtures.overview_row(gse_id) for gse_id in fixtures.gse_ids]
+                page = rows[start:] if length < 0 else rows[start:start + length]
+                return self._send(200, json.dumps({"draw": int(form.get("draw", 1)), "recordsTotal": len(rows),
+                                                   "recordsFiltered": len(rows), "data": page}).encode())
+            if session.gse_id is None or not fixtures.has_dataset(session.gse_id):
+                return self._send(500, b"")
+            if name == "geo_summary":
+                return self._send(200, json.dumps(fixtures.description(session.gse_id)).encode())
+            if name == "metadata_full":
+                rows = fixtures.metadata_rows(session.gse_id)
+                page = rows[start:] if length < 0 else rows[start:start + length]
+                return self._send(200, json.dumps({"draw": 1, "recordsTotal": len(rows),
+                                                   "recordsFiltered": len(rows), "data": page}).encode())
+            if name == "downloadcounts":
+                if session.gse_id in server.count_errors:
+                    return self._send(server.count_errors[session.gse_id], b"Service Unavailable", "text/plain")
+                body = fixtures.count_matrix_csv(session.gse_id, session.normalized)
+                headers = {"Content-Disposition": f"attachment; filename=\"{session.gse_id}.csv\""}
+                if server.gzip_counts and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    headers["Content-Encoding"] = "gzip"
+                return self._send(200, body, "text/csv", headers)
+            self._send(404, b"")
+
+        def _xhr_streaming(self, session: _ShinySession):
+            with session.condition:
+                session.generation += 1
+                generation = session.generation
+                session.condition.notify_all()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/javascript; charset=UTF-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            # the connection is closed after the response, clients must not reuse it
+            self.send_header("Connection", "close")
+            self.end_headers()
+            sent = 0
+            try:
+                self._write_chunk(b"h" * 2048 + b"\n")
+                if not session.opened:
+                    session.opened = True
+                    self._write_chunk(b"o\n")
+                while sent < STREAM_RESPONSE_LIMIT and not server._stopped.is_set():
+                    with session.condition:
+                        while not session.frames and session.generation == generation \
+                                and not server._stopped.is_set():
+                            session.condition.wait(0.5)
+                        if session.generation != generation or server._stopped.is_set():
+                            break
+                        frames, session.frames = session.frames, []
+                    data = "".join(frames).encode()
+                    self._write_chunk(data)
+                    sent += len(data)
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+
+    return Handler
+
+
+if __name__ == "__main__":
+    # records datasets from GREIN, e.g. python tests/grein_server.py tests/fixtures/grein GSE112749
+    import sys
+    record_fixtures(sys.argv[1], sys.argv[2:])
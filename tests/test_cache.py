@@ -0,0 +1,66 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import pandas
+from grein_loader import DatasetCache
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataset = (
+            {"Title": "Test dataset", "Species": "Homo sapiens"},
+            {"GSM1": {"geo_accession": "GSM1", "tissue": "liver"}},
+            pandas.DataFrame({"gene": ["ENSG1", "ENSG2"], "GSM1": [10, 0]})
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        cache = DatasetCache(self.directory)
+        self.assertIsNone(cache.get("GSE1", "RAW"))
+        cache.put("GSE1", "RAW", self.dataset)
+        description, metadata, count_matrix = cache.get("GSE1", "RAW")
+        self.assertEqual(self.dataset[0], description)
+        self.assertEqual(self.dataset[1], metadata)
+        pandas.testing.assert_frame_equal(self.dataset[2], count_matrix)
+        self.assertIsNone(cache.get("GSE1", "NORMALIZED"))
+
+    def test_ttl(self):
+        cache = DatasetCache(self.directory, ttl=0.05)
+        cache.put("GSE1", "RAW", self.dataset)
+        self.assertIsNotNone(cache.get("GSE1", "RAW"))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("GSE1", "RAW"))
+
+    def test_lru_eviction(self):
+        cache = DatasetCache(self.directory)
+        cache.put("GSE1", "RAW", self.dataset)
+        entry_size = sum(os.path.getsize(os.path.join(self.directory, "GSE1-RAW", f))
+                         for f in os.listdir(os.path.join(self.directory, "GSE1-RAW")))
+        # entries differ by a few bytes, two entries fit but not three
+        cache.max_size = int(2.5 * entry_size)
+        cache.put("GSE2", "RAW", self.dataset)
+        os.utime(os.path.join(self.directory, "GSE1-RAW"), (time.time() - 10, time.time() - 10))
+        os.utime(os.path.join(self.directory, "GSE2-RAW"), (time.time() - 5, time.time() - 5))
+        # GSE2 was used more recently than GSE1
+        cache.put("GSE3", "RAW", self.dataset)
+        self.assertIsNone(cache.get("GSE1", "RAW"))
+        self.assertIsNotNone(cache.get("GSE2", "RAW"))
+        self.assertIsNotNone(cache.get("GSE3", "RAW"))
+
+    def test_clear(self):
+        cache = DatasetCache(self.directory)
+        cache.put("GSE1", "RAW", self.dataset)
+        # a directory which another writer is filling is kept, one left behind by a crashed writer is removed
+        writing = os.path.join(self.directory, ".tmp-writing")
+        crashed = os.path.join(self.directory, ".tmp-crashed")
+        os.makedirs(writing)
+        os.makedirs(crashed)
+        os.utime(crashed, (time.time() - 7200, time.time() - 7200))
+        cache.clear()
+        self.assertIsNone(cache.get("GSE1", "RAW"))
+        self.assertEqual([".tmp-writing"], os.listdir(self.directory))
@@ -0,0 +1,58 @@
+import unittest
+from grein_loader import DatasetCatalog
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            {"geo_accession": "GSE1", "no_samples": 12, "species": "Homo sapiens",
+             "title": "Breast cancer cell lines", "study_summary": "RNA-seq of breast cancer cell lines"},
+            {"geo_accession": "GSE2", "no_samples": 4, "species": "Mus musculus",
+             "title": "Mouse liver", "study_summary": "Liver tissue after fasting"},
+            {"geo_accession": "GSE3", "no_samples": 30, "species": "Homo sapiens",
+             "title": "Lung tissue", "study_summary": "Lung cancer and matched normal tissue"}
+        ]
+        self.catalog = DatasetCatalog(":memory:")
+
+    def tearDown(self):
+        self.catalog.close()
+
+    def test_update(self):
+        self.assertEqual(3, self.catalog.update(self.records))
+        self.assertEqual(0, self.catalog.update(self.records))
+        changed = dict(self.records[1], no_samples="8")
+        self.assertEqual(1, self.catalog.update([changed]))
+        self.assertEqual(3, len(self.catalog))
+        self.assertEqual(8, self.catalog.get("GSE2")["no_samples"])
+        self.assertIsNone(self.catalog.get("GSE4"))
+
+    def test_search(self):
+        self.catalog.update(self.records)
+        self.assertEqual(["GSE1", "GSE3"], sorted(r["geo_accession"] for r in self.catalog.search("cancer")))
+        self.assertEqual(["GSE3"], [r["geo_accession"] for r in self.catalog.search("cancer", min_samples=20)])
+        self.assertEqual(["GSE2"], [r["geo_accession"] for r in self.catalog.search(species="Mus musculus")])
+        self.assertEqual(["GSE1"], [r["geo_accession"] for r in
+                                    self.catalog.search(species="Homo sapiens", max_samples=20)])
+        self.assertEqual(self.records[0], self.catalog.search("breast")[0])
+        self.assertEqual({"Homo sapiens": 2, "Mus musculus": 1}, self.catalog.species())
+
+    def test_search_syntax(self):
+        # characters of the FTS5 query syntax are searched as text
+        self.catalog.update(self.records + [
+            {"geo_accession": "GSE4", "no_samples": 6, "species": "Homo sapiens", "title": "T-cell activation",
+             "study_summary": "Series GSE4: activated T-cell \"CD4\" samples"}])
+        for text in ("T-cell", "GSE4:", "\"CD4\"", "activation T-cell", "cd4 t-cell"):
+            self.assertEqual(["GSE4"], [r["geo_accession"] for r in self.catalog.search(text)], text)
+        self.assertEqual([], self.catalog.search("cell-T"))
+        self.assertEqual(["GSE2", "GSE3"], sorted(r["geo_accession"] for r in self.catalog.search("lung OR liver")))
+        self.assertEqual(4, len(self.catalog.search("  ")))
+
+    def test_search_after_update(self):
+        self.catalog.update(self.records)
+        self.catalog.update([dict(self.records[1], title="Mouse kidney", study_summary="Kidney tissue")])
+        self.assertEqual([], self.catalog.search("liver"))
+        self.assertEqual(["GSE2"], [r["geo_accession"] for r in self.catalog.search("kidney")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+import contextlib
+from unittest import mock
+import pandas
+import grein_loader
+from grein_loader import cli
+from grein_server import GreinServer, GreinFixtures
+
+
+class TestCli(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fixtures = GreinFixtures(n_datasets=6, n_genes=30, n_samples=4)
+        cls.server = GreinServer(cls.fixtures).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_cli(self, *args, stdin: str = None):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), mock.patch("sys.stdin", io.StringIO(stdin or "")):
+            exit_code = cli.main(["--grein-url", self.server.url] + list(args))
+        return exit_code, [line for line in stdout.getvalue().splitlines()]
+
+    def expected_count_matrix(self, gse_id, normalized=False):
+        count_matrix = pandas.read_csv(io.BytesIO(self.fixtures.count_matrix_csv(gse_id, normalized)), index_col=0)
+        count_matrix.index.name = None
+        return count_matrix
+
+    def test_lazy_import(self):
+        # pandas, numpy and requests are not imported before a command needs them
+        path = os.path.dirname(os.path.dirname(os.path.abspath(grein_loader.__file__)))
+        code = "import sys, json, grein_loader, grein_loader.cli; grein_loader.cli._parser(); " \
+               "print(json.dumps(sorted(m for m in ('pandas', 'numpy', 'requests') if m in sys.modules)))"
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([path, os.environ.get("PYTHONPATH", "")]))
+        output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, check=True)
+        self.assertEqual([], json.loads(output.stdout))
+
+    def test_overview(self):
+        exit_code, lines = self.run_cli("overview", "--ids-only", "--limit", "3", "--page-size", "2")
+        self.assertEqual(0, exit_code)
+        self.assertEqual(self.fixtures.gse_ids[:3], lines)
+        species = self.fixtures.overview_row(self.fixtures.gse_ids[0])[2]
+        _, lines = self.run_cli("overview", "--species", species)
+        self.assertTrue(lines)
+        self.assertTrue(all(json.loads(line)["species"] == species for line in lines))
+
+    def test_fetch_jsonl(self):
+        gse_ids = self.fixtures.gse_ids[:2]
+        exit_code, lines = self.run_cli("fetch", *gse_ids, "--workers", "2")
+        self.assertEqual(0, exit_code)
+        records = {record["gse_id"]: record for record in map(json.loads, lines)}
+        self.assertEqual(set(gse_ids), set(records))
+        for gse_id in gse_ids:
+            self.assertEqual(self.fixtures.sample_ids(gse_id), list(records[gse_id]["metadata"]))
+            count_matrix = pandas.read_json(io.StringIO(json.dumps(records[gse_id]["count_matrix"])), orient="split")
+            pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+
+        _, lines = self.run_cli("fetch", gse_ids[0], "--download-type", "BOTH", "--parts", "counts")
+        record = json.loads(lines[0])
+        self.assertEqual({"gse_id", "count_matrix"}, set(record))
+        self.assertEqual({"raw", "normalized"}, set(record["count_matrix"]))
+
+    def test_batch_files(self):
+        gse_ids = self.fixtures.gse_ids[2:5]
+        exit_code, lines = self.run_cli("batch", "--format", "csv", "--output-dir", self.directory,
+                                        stdin=f"# datasets\n{gse_ids[0]}, {gse_ids[1]}\n{gse_ids[2]}\nGSE999999\n")
+        # the unknown dataset is reported and does not stop the others
+        self.assertEqual(1, exit_code)
+        records = {record["gse_id"]: record for record in map(json.loads, lines)}
+        self.assertIn("error", records["GSE999999"])
+        for gse_id in gse_ids:
+            path = os.path.join(self.directory, f"{gse_id}.csv")
+            self.assertEqual([path], records[gse_id]["files"])
+            with open(path, "rb") as f:
+                self.assertEqual(self.fixtures.count_matrix_csv(gse_id), f.read())
+
+        exit_code, lines = self.run_cli("fetch", gse_ids[0], "--download-type", "BOTH", "--format", "csv", "--gzip",
+                                        "--output-dir", self.directory)
+        self.assertEqual(0, exit_code)
+        raw_path, normalized_path = json.loads(lines[0])["files"]
+        self.assertTrue(raw_path.endswith("_raw.csv.gz"))
+        count_matrix = pandas.read_csv(normalized_path, index_col=0)
+        count_matrix.index.name = None
+        pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id=gse_ids[0], normalized=True), count_matrix)
+
+    def test_invalid_arguments(self):
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            cli.main(["fetch", "GSE1", "--format", "csv"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import io
+import unittest
+import pandas
+from grein_loader.load_dataset import _read_count_matrix, _compact_count_matrix
+from grein_loader.formatting import _select_count_chunks, _align_count_matrices
+
+COUNT_MATRIX_CSV = b'"","GSM1","GSM2","GSM3"\n"ENSG1",0,12,0\n"ENSG2",5,0,0\n"ENSG3",0,0,7\n'
+
+
+class _Response:
+    """ minimal stand-in for a streamed requests.Response """
+    def __init__(self, content: bytes):
+        self.raw = io.BytesIO(content)
+
+
+class TestCountMatrix(unittest.TestCase):
+    def test_read_count_matrix(self):
+        count_matrix = _read_count_matrix(_Response(COUNT_MATRIX_CSV))
+        self.assertEqual(["gene", "GSM1", "GSM2", "GSM3"], list(count_matrix.columns))
+        self.assertEqual(["ENSG1", "ENSG2", "ENSG3"], list(count_matrix["gene"]))
+        self.assertEqual(12, count_matrix["GSM2"][0])
+
+    def test_dtype(self):
+        count_matrix = _read_count_matrix(_Response(COUNT_MATRIX_CSV), dtype="uint32")
+        self.assertTrue(all(t == "uint32" for t in count_matrix.dtypes.iloc[1:]))
+        count_matrix = _read_count_matrix(_Response(COUNT_MATRIX_CSV), dtype="float32")
+        self.assertTrue(all(t == "float32" for t in count_matrix.dtypes.iloc[1:]))
+        # the gene ids keep their leading zeros
+        count_matrix = _read_count_matrix(_Response(b'"","GSM1"\n"007",1\n"010",2\n'), dtype="uint32")
+        self.assertEqual(["007", "010"], list(count_matrix["gene"]))
+        self.assertEqual("uint32", count_matrix.dtypes.iloc[1])
+
+    def test_sparse(self):
+        count_matrix = _read_count_matrix(_Response(COUNT_MATRIX_CSV), dtype="int32", sparse=True)
+        self.assertEqual("gene", count_matrix.index.name)
+        self.assertEqual(["GSM1", "GSM2", "GSM3"], list(count_matrix.columns))
+        self.assertEqual(pandas.SparseDtype("int32", 0), count_matrix.dtypes.iloc[0])
+        self.assertAlmostEqual(3 / 9, count_matrix.sparse.density)
+        dense = _compact_count_matrix(count_matrix)
+        pandas.testing.assert_frame_equal(_read_count_matrix(_Response(COUNT_MATRIX_CSV), dtype="int32"), dense)
+
+    def test_select(self):
+        # the samples keep the order of the count matrix, unknown genes and samples are ignored
+        count_matrix = _read_count_matrix(_Response(COUNT_MATRIX_CSV), dtype="int32", genes=["ENSG3", "ENSG1", "X"],
+                                          samples=["GSM3", "GSM1", "GSM9"])
+        expected = pandas.DataFrame({"gene": ["ENSG1", "ENSG3"], "GSM1": [0, 0], "GSM3": [0, 7]})
+        pandas.testing.assert_frame_equal(expected.astype({"GSM1": "int32", "GSM3": "int32"}), count_matrix)
+
+        count_matrix = _read_count_matrix(_Response(COUNT_MATRIX_CSV), sparse=True, samples=["GSM2"])
+        self.assertEqual(["ENSG1", "ENSG2", "ENSG3"], list(count_matrix.index))
+        self.assertEqual(["GSM2"], list(count_matrix.columns))
+        self.assertEqual(12, count_matrix["GSM2"]["ENSG1"])
+
+        # chunks without a selected gene are empty
+        _, chunks = _select_count_chunks(io.BytesIO(COUNT_MATRIX_CSV), genes=["ENSG2"], chunksize=1)
+        self.assertEqual([0, 1, 0], [len(chunk) for chunk in chunks])
+        self.assertEqual(["gene"], list(_read_count_matrix(_Response(COUNT_MATRIX_CSV), samples=[]).columns))
+
+    def test_align(self):
+        raw = _read_count_matrix(_Response(COUNT_MATRIX_CSV))
+        self.assertIs(raw, _align_count_matrices(raw, raw.copy())[0])
+        normalized = raw.iloc[[2, 0]].reset_index(drop=True) * 1
+        normalized["gene"] = ["ENSG3", "ENSG1"]
+        normalized.loc[2] = ["ENSG4", 1, 1, 1]
+        raw, normalized = _align_count_matrices(raw, normalized)
+        self.assertEqual(["ENSG1", "ENSG2", "ENSG3", "ENSG4"], list(raw["gene"]))
+        self.assertEqual(list(raw["gene"]), list(normalized["gene"]))
+        self.assertEqual([0, None, 0, 1], [None if pandas.isna(v) else v for v in normalized["GSM1"]])
+
@@ -0,0 +1,50 @@
+import os
+import io
+import shutil
+import tempfile
+import unittest
+import numpy
+import pandas
+from grein_loader import CountMatrixStore, write_count_store
+from grein_loader.count_store import _store_count_matrix
+from test_count_matrix import COUNT_MATRIX_CSV, _Response
+
+
+class TestCountStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.count_matrix = pandas.read_csv(io.BytesIO(COUNT_MATRIX_CSV))
+        self.count_matrix.rename(columns={self.count_matrix.columns[0]: "gene"}, inplace=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_store(self):
+        path = os.path.join(self.directory, "GSE1")
+        store = write_count_store(self.count_matrix, path, dtype="int32")
+        self.assertEqual((3, 3), store.shape)
+        self.assertEqual(numpy.dtype("int32"), store.dtype)
+        self.assertIsInstance(CountMatrixStore(path).values, numpy.memmap)
+        pandas.testing.assert_frame_equal(self.count_matrix.astype({"GSM1": "int32", "GSM2": "int32", "GSM3": "int32"}),
+                                          store.to_dataframe())
+
+    def test_select(self):
+        store = write_count_store(self.count_matrix, os.path.join(self.directory, "GSE1"))
+        selection = store.select(genes=["ENSG3", "ENSG1"], samples=["GSM3", "GSM2"])
+        self.assertEqual(["ENSG3", "ENSG1"], list(selection.index))
+        self.assertEqual([[7, 0], [0, 12]], selection.values.tolist())
+        self.assertEqual([0, 5, 0], store.select(samples=["GSM1"])["GSM1"].tolist())
+        with self.assertRaises(KeyError):
+            store.select(genes=["ENSG4"])
+
+    def test_store_streamed_count_matrix(self):
+        path = os.path.join(self.directory, "GSE1")
+        store = _store_count_matrix(_Response(COUNT_MATRIX_CSV), path, dtype="float32")
+        self.assertEqual(["ENSG1", "ENSG2", "ENSG3"], list(store.genes))
+        self.assertEqual(["GSM1", "GSM2", "GSM3"], list(store.samples))
+        self.assertEqual(12.0, store.values[0, 1])
+        self.assertEqual(["GSE1"], os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
 import unittest
+import asyncio
 import logging
+import itertools
 import requests
 import grein_loader as loader
+from grein_loader import async_loader
 
 LOGGER = logging.getLogger(__name__)
 
@@ -43,7 +46,45 @@ class TestDataset(unittest.TestCase):
         self.assertIsNotNone(description)
         self.assertIsNotNone(count_matrix)
 
+    def test_dataset_parts(self):
+        LOGGER.info(f"Test GREIN metadata without counts with GeoId: {self.geo_accession}")
+        description, metadata, count_matrix = loader.load_dataset(self.geo_accession, parts=["metadata"])
+        self.assertIsNone(description)
+        self.assertIsNotNone(metadata)
+        self.assertIsNone(count_matrix)
+
+    def test_session(self):
+        LOGGER.info("Test loading several GREIN datasets in one session")
+        with loader.GreinSession() as session:
+            description, metadata, count_matrix = session.load_dataset(self.geo_accession)
+            description_2, metadata_2, count_matrix_2 = session.load_dataset(self.geo_accession_2)
+        self.assertNotEqual(description, description_2)
+        self.assertNotEqual(list(metadata), list(metadata_2))
+        self.assertIsNotNone(count_matrix_2)
+
+    def test_load_datasets(self):
+        LOGGER.info("Test parallel loading of GREIN datasets")
+        results = list(loader.load_datasets([self.geo_accession, self.geo_accession_2, "GSE0"], max_workers=2))
+        self.assertEqual(3, len(results))
+        loaded = {result.gse_id: result for result in results}
+        self.assertIsNone(loaded[self.geo_accession].error)
+        self.assertIsNotNone(loaded[self.geo_accession].dataset)
+        self.assertIsNotNone(loaded["GSE0"].error)
+
+    @unittest.skipIf(async_loader.aiohttp is None, "aiohttp not installed")
+    def test_async_dataset_request(self):
+        LOGGER.info(f"Test asyncio GREIN dataset with GeoId: {self.geo_accession}")
+        description, metadata, count_matrix = asyncio.run(async_loader.load_dataset(self.geo_accession))
+        self.assertIsNotNone(description)
+        self.assertIsNotNone(metadata)
+        self.assertIsNotNone(count_matrix)
+
     def test_overview(self):
         LOGGER.info("Test overview of GREIN datasets")
         overview = loader.load_overview(10)
         self.assertEqual(10, len(overview))
+
+    def test_iter_overview(self):
+        LOGGER.info("Test paginated overview of GREIN datasets")
+        overview = list(itertools.islice(loader.iter_overview(page_size=5, prefetch=True), 12))
+        self.assertEqual(loader.load_overview(12), overview)
@@ -0,0 +1,72 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import pandas
+import grein_loader as loader
+from grein_server import GreinServer, GreinFixtures
+
+
+class TestMerge(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fixtures = GreinFixtures(n_datasets=3, n_genes=40, n_samples=4)
+        cls.server = GreinServer(cls.fixtures).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expected_count_matrix(self, gse_id):
+        count_matrix = pandas.read_csv(io.BytesIO(self.fixtures.count_matrix_csv(gse_id)))
+        return count_matrix.rename(columns={count_matrix.columns[0]: "gene"}).set_index("gene")
+
+    def test_merge_series(self):
+        path = os.path.join(self.directory, "merged")
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            # the memory budget is smaller than one series, so every series is copied in several blocks
+            store = loader.merge_datasets(self.fixtures.gse_ids, path, dtype="int32", fill_value=0,
+                                          memory_budget=512, session=session)
+        expected = pandas.concat([self.expected_count_matrix(gse_id) for gse_id in self.fixtures.gse_ids], axis=1)
+        self.assertEqual((40, 12), store.shape)
+        pandas.testing.assert_frame_equal(expected.astype("int32"), store.select(), check_names=False)
+
+        provenance = loader.open_count_store(path).provenance
+        self.assertEqual(list(store.samples), list(provenance.index))
+        gse_id = self.fixtures.gse_ids[1]
+        sample = self.fixtures.sample_ids(gse_id)[2]
+        self.assertEqual(gse_id, provenance.loc[sample, "gse_id"])
+        self.assertEqual(dict(zip(self.fixtures.metadata_labels(gse_id), self.fixtures.metadata_rows(gse_id)[2]))[
+            "tissue"], provenance.loc[sample, "tissue"])
+
+    def test_merge_cached(self):
+        cache = loader.DatasetCache(os.path.join(self.directory, "cache"))
+        first = pandas.DataFrame({"gene": ["ENSG1", "ENSG2"], "GSM1": [1, 2], "GSM2": [3, 4]})
+        second = pandas.DataFrame({"gene": ["ENSG3", "ENSG1"], "GSM2": [3, 4], "GSM3": [5, 6]})
+        cache.put("GSE1", "RAW", ({}, {"GSM1": {"geo_accession": "GSM1", "tissue": "liver"}}, first))
+        cache.put("GSE2", "RAW", ({}, {}, second))
+
+        # the datasets are read from the cache, GREIN is not contacted
+        store = loader.merge_datasets(["GSE1", "GSE2"], os.path.join(self.directory, "merged"), cache=cache,
+                                      session=loader.GreinSession(grein_url="http://127.0.0.1:9/"))
+        self.assertEqual(["ENSG1", "ENSG2", "ENSG3"], list(store.genes))
+        # GSM2 is part of both series and is stored once
+        self.assertEqual(["GSM1", "GSM2", "GSM3"], list(store.samples))
+        numpy.testing.assert_array_equal([[1, 3, 6], [2, 4, numpy.nan], [numpy.nan, numpy.nan, 5]], store.values)
+        self.assertEqual(["GSE1", "GSE1", "GSE2"], list(store.provenance["gse_id"]))
+        self.assertEqual("liver", store.provenance.loc["GSM1", "tissue"])
+
+        with self.assertRaises(ValueError):
+            loader.merge_datasets(["GSE1"], os.path.join(self.directory, "int"), dtype="int32", cache=cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
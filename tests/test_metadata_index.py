@@ -0,0 +1,63 @@
+import unittest
+import grein_loader as loader
+from grein_server import GreinServer, GreinFixtures
+
+
+class TestMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = loader.MetadataIndex(":memory:")
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_query(self):
+        self.index.add("GSE1", {"GSM1": {"": "1", "geo_accession": "GSM1", "tissue": "Liver", "treatment": "dmso"},
+                                "GSM2": {"": "2", "geo_accession": "GSM2", "tissue": "lung", "treatment": ""}})
+        self.index.add("GSE2", {"GSM4": {"tissue": "liver"}, "GSM3": {"tissue": "liver", "treatment": "drug"}})
+        self.assertEqual([("GSE1", ["GSM1"]), ("GSE2", ["GSM4", "GSM3"])], self.index.query(tissue="liver"))
+        self.assertEqual([("GSE1", ["GSM1"]), ("GSE2", ["GSM3"])], self.index.query(tissue="liver", treatment=True))
+        self.assertEqual([("GSE1", ["GSM2"]), ("GSE2", ["GSM4"])], self.index.query(treatment=False))
+        self.assertEqual([("GSE2", ["GSM3"])], self.index.query({"treatment": ["drug", "none"]}))
+        self.assertEqual([], self.index.query(tissue="kidney"))
+        self.assertEqual(4, sum(len(selection.samples) for selection in self.index.query()))
+        self.assertEqual({"tissue": 4, "treatment": 2}, self.index.labels())
+        self.assertEqual({"liver": 3, "lung": 1}, {value.lower(): n for value, n in self.index.values("tissue").items()})
+
+        # indexing a series again replaces its metadata
+        self.index.add("GSE2", {"GSM3": {"tissue": "kidney"}})
+        self.assertEqual([("GSE2", ["GSM3"])], self.index.query(tissue="kidney"))
+        self.assertEqual({"GSM3": {"tissue": "kidney"}}, self.index.get("GSE2"))
+        self.assertIsNone(self.index.get("GSE3"))
+
+    def test_harvest(self):
+        fixtures = GreinFixtures(n_datasets=6, n_genes=20, n_samples=4)
+        with GreinServer(fixtures) as server:
+            result = self.index.harvest(fixtures.gse_ids, max_workers=3, grein_url=server.url)
+            self.assertEqual(sorted(fixtures.gse_ids), sorted(result.fetched))
+            self.assertEqual({}, result.failed)
+
+            result = self.index.harvest(fixtures.gse_ids[:2] + ["GSE999999"], grein_url=server.url)
+            self.assertEqual(2, result.unchanged)
+            self.assertEqual(["GSE999999"], list(result.failed))
+
+        self.assertEqual(sorted(fixtures.gse_ids), self.index.series())
+        expected = {}
+        for gse_id in fixtures.gse_ids:
+            for row in fixtures.metadata_rows(gse_id):
+                values = dict(zip(fixtures.metadata_labels(gse_id), row))
+                if values["tissue"] == "liver" and values["condition"] == "disease":
+                    expected.setdefault(gse_id, []).append(values["geo_accession"])
+        self.assertEqual(sorted(expected.items()),
+                         [tuple(selection) for selection in self.index.query(tissue="liver", condition="disease")])
+
+    def test_harvest_scheduler_sessions(self):
+        # the scheduler allows fewer sessions than workers
+        fixtures = GreinFixtures(n_datasets=5, n_genes=20, n_samples=4)
+        scheduler = loader.RequestScheduler(max_sessions=2, rate=100, max_rate=200)
+        with GreinServer(fixtures) as server:
+            result = self.index.harvest(fixtures.gse_ids, max_workers=4, grein_url=server.url, scheduler=scheduler)
+        self.assertEqual(sorted(fixtures.gse_ids), sorted(result.fetched))
+
+
+if __name__ == '__main__':
+    unittest.main()
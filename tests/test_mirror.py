@@ -0,0 +1,118 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+import grein_loader as loader
+from grein_server import GreinServer, GreinFixtures
+
+
+class UpdatedFixtures(GreinFixtures):
+    """ fixtures whose overview titles can be changed to simulate updated datasets on GREIN """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.updated = set()
+
+    def overview_row(self, gse_id: str) -> list:
+        row = super().overview_row(gse_id)
+        if gse_id in self.updated:
+            row[3] += " (updated)"
+        return row
+
+
+class TestMirror(unittest.TestCase):
+    def setUp(self):
+        self.fixtures = UpdatedFixtures(n_datasets=6, n_genes=30, n_samples=4)
+        self.server = GreinServer(self.fixtures).start()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def open_mirror(self):
+        return loader.GreinMirror(self.directory, grein_url=self.server.url)
+
+    def test_sync(self):
+        with self.open_mirror() as mirror:
+            result = mirror.sync(max_workers=3)
+            self.assertEqual(sorted(self.fixtures.gse_ids), sorted(result.fetched))
+            self.assertEqual((0, {}), (result.unchanged, result.failed))
+            self.assertEqual(sorted(self.fixtures.gse_ids), mirror.datasets())
+
+            gse_id = self.fixtures.gse_ids[2]
+            description, metadata, counts_path = mirror.load(gse_id)
+            self.assertEqual(self.fixtures.overview_row(gse_id)[3], description["Title"])
+            self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+            with gzip.open(counts_path) as f:
+                self.assertEqual(self.fixtures.count_matrix_csv(gse_id), f.read())
+
+        # the journal is read again, an unchanged corpus only requests the overview
+        with self.open_mirror() as mirror:
+            requests = self.server.request_count
+            result = mirror.sync()
+            self.assertEqual(([], 6), (result.fetched, result.unchanged))
+            self.assertLess(self.server.request_count - requests, 10)
+
+    def test_sync_scheduler_sessions(self):
+        # the scheduler allows fewer sessions than workers
+        scheduler = loader.RequestScheduler(max_sessions=2, rate=100, max_rate=200)
+        with loader.GreinMirror(self.directory, grein_url=self.server.url, scheduler=scheduler) as mirror:
+            result = mirror.sync(max_workers=4)
+        self.assertEqual(sorted(self.fixtures.gse_ids), sorted(result.fetched))
+
+    def test_sync_count_errors(self):
+        failing = {self.fixtures.gse_ids[1]: 500, self.fixtures.gse_ids[3]: 503}
+        with GreinServer(self.fixtures, count_errors=failing) as server:
+            with loader.GreinMirror(self.directory, grein_url=server.url) as mirror:
+                result = mirror.sync()
+                self.assertEqual(sorted(failing), sorted(result.failed))
+                self.assertEqual(sorted(set(self.fixtures.gse_ids) - set(failing)), mirror.datasets())
+            server.count_errors.clear()
+            # the failed datasets are requested again by the next sync
+            with loader.GreinMirror(self.directory, grein_url=server.url) as mirror:
+                result = mirror.sync()
+                self.assertEqual(sorted(failing), sorted(result.fetched))
+                for gse_id in failing:
+                    with gzip.open(mirror.load(gse_id)[2]) as f:
+                        self.assertEqual(self.fixtures.count_matrix_csv(gse_id), f.read())
+
+    def test_sync_changed(self):
+        with self.open_mirror() as mirror:
+            mirror.sync(gse_ids=self.fixtures.gse_ids[:4])
+            self.fixtures.updated.add(self.fixtures.gse_ids[1])
+            result = mirror.sync()
+        self.assertEqual(sorted([self.fixtures.gse_ids[1]] + self.fixtures.gse_ids[4:]), sorted(result.fetched))
+        self.assertEqual(3, result.unchanged)
+        with open(os.path.join(self.directory, self.fixtures.gse_ids[1], "overview.json")) as f:
+            self.assertTrue(json.load(f)["title"].endswith("(updated)"))
+
+    def test_resume(self):
+        with self.open_mirror() as mirror:
+            mirror.sync()
+        # the process was killed after the first datasets and while writing the journal
+        journal_path = os.path.join(self.directory, "journal.jsonl")
+        with open(journal_path) as f:
+            lines = f.readlines()
+        with open(journal_path, "w") as f:
+            f.writelines(lines[:2])
+            f.write(lines[2][:20])
+        finished = [json.loads(line)["gse_id"] for line in lines[:2]]
+
+        with self.open_mirror() as mirror:
+            self.assertEqual(sorted(finished), mirror.datasets())
+            result = mirror.sync()
+            self.assertEqual(sorted(set(self.fixtures.gse_ids) - set(finished)), sorted(result.fetched))
+            self.assertEqual(2, result.unchanged)
+        with self.open_mirror() as mirror:
+            self.assertEqual(sorted(self.fixtures.gse_ids), mirror.datasets())
+
+    def test_download_type(self):
+        self.open_mirror().close()
+        with self.assertRaises(ValueError):
+            loader.GreinMirror(self.directory, download_type="NORMALIZED")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import io
+import numpy
+import pandas
+import unittest
+from grein_loader import normalize_counts, tmm_factors
+from grein_server import GreinFixtures
+
+
+def read_count_matrix(body: bytes) -> pandas.DataFrame:
+    count_matrix = pandas.read_csv(io.BytesIO(body))
+    return count_matrix.rename(columns={count_matrix.columns[0]: "gene"})
+
+
+class TestNormalization(unittest.TestCase):
+    def setUp(self):
+        self.fixtures = GreinFixtures(n_datasets=3, n_genes=500, n_samples=6)
+
+    def test_stand_in_normalized(self):
+        # the stand-in calculates its NORMALIZED count matrix as counts per million
+        for gse_id in self.fixtures.gse_ids:
+            raw = read_count_matrix(self.fixtures.count_matrix_csv(gse_id))
+            expected = read_count_matrix(self.fixtures.count_matrix_csv(gse_id, normalized=True))
+            normalized = normalize_counts(raw)
+            self.assertEqual(list(expected.columns), list(normalized.columns))
+            self.assertEqual(list(expected["gene"]), list(normalized["gene"]))
+            numpy.testing.assert_allclose(expected.iloc[:, 1:].to_numpy(), normalized.iloc[:, 1:].to_numpy(),
+                                          rtol=1e-5)
+
+    def test_sparse(self):
+        raw = read_count_matrix(self.fixtures.count_matrix_csv(self.fixtures.gse_ids[0])).set_index("gene")
+        sparse = raw.astype(pandas.SparseDtype("uint32", 0))
+        normalized = normalize_counts(sparse)
+        self.assertTrue(all(isinstance(dtype, pandas.SparseDtype) for dtype in normalized.dtypes))
+        pandas.testing.assert_frame_equal(normalize_counts(raw), normalized.sparse.to_dense(), check_dtype=False)
+        numpy.testing.assert_allclose(1e6, normalized.sum(axis=0).to_numpy())
+
+    def test_log(self):
+        counts = pandas.DataFrame({"a": [0, 10, 90], "b": [0, 20, 180]}, index=["g1", "g2", "g3"])
+        normalized = normalize_counts(counts, log=True, prior_count=2)
+        # the prior count is scaled by the library size
+        expected_a = numpy.log2((numpy.array([0, 10, 90]) + 2 * 100 / 150) / (100 + 4 * 100 / 150) * 1e6)
+        numpy.testing.assert_allclose(expected_a, normalized["a"].to_numpy())
+        numpy.testing.assert_allclose(normalized["a"].to_numpy(), normalized["b"].to_numpy())
+
+    def test_tmm(self):
+        rng = numpy.random.default_rng(0)
+        base = rng.poisson(rng.gamma(2, 50, size=2000)).astype(float)
+        self.assertTrue(numpy.allclose(1, tmm_factors(pandas.DataFrame({"a": base, "b": base * 3}))))
+
+        # a few strongly expressed genes take up half of the library of sample b
+        composition = base.copy()
+        composition[:100] += base.sum() / 100
+        factors = tmm_factors(pandas.DataFrame({"a": base, "b": composition}))
+        self.assertAlmostEqual(1, factors.prod())
+        self.assertAlmostEqual(2, factors[0] / factors[1], delta=0.1)
+
+        # with TMM the unchanged genes get the same normalized values in both samples
+        normalized = normalize_counts(pandas.DataFrame({"a": base, "b": composition}), method="tmm")
+        ratio = normalized["b"][100:].sum() / normalized["a"][100:].sum()
+        self.assertAlmostEqual(1, ratio, delta=0.05)
+
+    def test_invalid_method(self):
+        with self.assertRaises(ValueError):
+            normalize_counts(pandas.DataFrame({"a": [1]}), method="rpkm")
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+import io
+import os
+import gzip
+import shutil
+import asyncio
+import tempfile
+import unittest
+import pandas
+import grein_loader as loader
+from grein_loader import async_loader
+from grein_loader.exceptions import GreinLoaderException
+from grein_server import GreinServer, GreinFixtures, RecordedFixtures
+
+
+class TestOffline(unittest.TestCase):
+    """ loads datasets from the local GREIN stand-in in grein_server.py """
+    @classmethod
+    def setUpClass(cls):
+        cls.fixtures = GreinFixtures(n_datasets=5, n_genes=50, n_samples=4)
+        cls.server = GreinServer(cls.fixtures).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def expected_count_matrix(self, gse_id, normalized=False):
+        count_matrix = pandas.read_csv(io.BytesIO(self.fixtures.count_matrix_csv(gse_id, normalized)))
+        return count_matrix.rename(columns={count_matrix.columns[0]: "gene"})
+
+    def test_dataset(self):
+        gse_id = self.fixtures.gse_ids[0]
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            description, metadata, count_matrix = session.load_dataset(gse_id)
+        self.assertEqual(self.fixtures.overview_row(gse_id)[3], description["Title"])
+        self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+        for row in self.fixtures.metadata_rows(gse_id):
+            self.assertEqual(dict(zip(self.fixtures.metadata_labels(gse_id), row)), metadata[row[1]])
+        pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+
+    def test_metadata_dataframe(self):
+        gse_id = self.fixtures.gse_ids[0]
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            _, metadata, _ = session.load_dataset(gse_id, parts=["metadata"])
+            _, metadata_frame, _ = session.load_dataset(gse_id, parts=["metadata"], metadata_format="dataframe")
+        self.assertEqual(self.fixtures.metadata_labels(gse_id), list(metadata_frame.columns))
+        self.assertEqual(list(metadata), list(metadata_frame.index))
+        self.assertEqual("category", metadata_frame["condition"].dtype.name)
+        self.assertNotEqual("category", metadata_frame["title"].dtype.name)
+        self.assertEqual(metadata, {sample: {label: str(value) for label, value in row.items()}
+                                    for sample, row in metadata_frame.to_dict(orient="index").items()})
+
+    def test_session_switches_datasets(self):
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            for gse_id in self.fixtures.gse_ids[:3]:
+                for download_type in ("RAW", "NORMALIZED"):
+                    description, metadata, count_matrix = session.load_dataset(gse_id, download_type)
+                    self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+                    pandas.testing.assert_frame_equal(
+                        self.expected_count_matrix(gse_id, download_type == "NORMALIZED"), count_matrix)
+
+    def test_dataset_parts(self):
+        gse_id = self.fixtures.gse_ids[1]
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            description, metadata, count_matrix = session.load_dataset(gse_id, parts=["counts"])
+        self.assertIsNone(description)
+        self.assertIsNone(metadata)
+        pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+
+    def test_download_counts_to(self):
+        gse_id = self.fixtures.gse_ids[1]
+        directory = tempfile.mkdtemp()
+        try:
+            with GreinServer(self.fixtures, gzip_counts=True) as server, \
+                    loader.GreinSession(grein_url=server.url) as session:
+                for name in ("counts.csv", "counts.csv.gz"):
+                    path = os.path.join(directory, name)
+                    description, metadata, count_matrix = session.load_dataset(gse_id, download_counts_to=path)
+                    self.assertEqual(path, count_matrix)
+                    self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+                    with (gzip.open(path) if name.endswith(".gz") else open(path, "rb")) as f:
+                        self.assertEqual(self.fixtures.count_matrix_csv(gse_id), f.read())
+            self.assertEqual(["counts.csv", "counts.csv.gz"], sorted(os.listdir(directory)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_store_counts_to(self):
+        gse_id = self.fixtures.gse_ids[2]
+        directory = tempfile.mkdtemp()
+        try:
+            with loader.GreinSession(grein_url=self.server.url) as session:
+                description, metadata, store = session.load_dataset(gse_id, dtype="int32",
+                                                                    store_counts_to=os.path.join(directory, gse_id))
+            self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+            pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id).astype(
+                {sample: "int32" for sample in self.fixtures.sample_ids(gse_id)}),
+                loader.open_count_store(os.path.join(directory, gse_id)).to_dataframe())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_select_genes_and_samples(self):
+        gse_id = self.fixtures.gse_ids[3]
+        genes = self.fixtures.genes()[10:20]
+        samples = self.fixtures.sample_ids(gse_id)[1:3]
+        expected = self.expected_count_matrix(gse_id)
+        expected = expected[expected["gene"].isin(genes)][["gene"] + samples].reset_index(drop=True)
+        directory = tempfile.mkdtemp()
+        try:
+            cache = loader.DatasetCache(os.path.join(directory, "cache"))
+            with loader.GreinSession(grein_url=self.server.url) as session:
+                _, _, count_matrix = session.load_dataset(gse_id, cache=cache, genes=genes, samples=samples)
+                pandas.testing.assert_frame_equal(expected, count_matrix)
+                # a selection is not cached, but it is taken from a cached dataset
+                self.assertIsNone(cache.get(gse_id, "RAW"))
+                session.load_dataset(gse_id, cache=cache)
+                _, _, count_matrix = session.load_dataset(gse_id, cache=cache, genes=genes, samples=samples)
+                pandas.testing.assert_frame_equal(expected, count_matrix)
+
+                store = session.load_dataset(gse_id, parts=["counts"], dtype="int32", genes=genes, samples=samples,
+                                             store_counts_to=os.path.join(directory, "store"))[2]
+                pandas.testing.assert_frame_equal(expected.astype({sample: "int32" for sample in samples}),
+                                                  store.to_dataframe())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_download_type_both(self):
+        gse_id = self.fixtures.gse_ids[4]
+        with GreinServer(self.fixtures) as server:
+            with loader.GreinSession(grein_url=server.url) as session:
+                description, metadata, count_matrices = session.load_dataset(gse_id, "BOTH")
+            requests_both = server.request_count
+            for download_type in ("RAW", "NORMALIZED"):
+                with loader.GreinSession(grein_url=server.url) as session:
+                    session.load_dataset(gse_id, download_type)
+            # the handshake, description and metadata are only requested once
+            self.assertLess(requests_both, (server.request_count - requests_both) * 0.75)
+        self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+        pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrices.raw)
+        pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id, True), count_matrices.normalized)
+
+        directory = tempfile.mkdtemp()
+        try:
+            cache = loader.DatasetCache(directory)
+            with loader.GreinSession(grein_url=self.server.url) as session:
+                session.load_dataset(gse_id, "BOTH", cache=cache)
+                pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id, True),
+                                                  cache.get(gse_id, "NORMALIZED")[2])
+                # both count matrices are read from the cache
+                _, _, cached = session.load_dataset(gse_id, "BOTH", cache=cache, sparse=True)
+            self.assertEqual(list(cached.raw.index), list(cached.normalized.index))
+            pandas.testing.assert_frame_equal(count_matrices.normalized, cached.normalized.sparse.to_dense().reset_index())
+        finally:
+            shutil.rmtree(directory)
+        with self.assertRaises(ValueError):
+            loader.load_dataset(gse_id, "BOTH", dtype="int32")
+
+    def test_cache_keeps_parsed_count_matrix(self):
+        gse_id = self.fixtures.gse_ids[0]
+        directory = tempfile.mkdtemp()
+        try:
+            cache = loader.DatasetCache(directory)
+            with loader.GreinSession(grein_url=self.server.url) as session:
+                _, _, compact = session.load_dataset(gse_id, "NORMALIZED", cache=cache, dtype="float16")
+                self.assertTrue(all(dtype == "float16" for dtype in compact.dtypes[1:]))
+                # the dtype of the first load is not applied to the later loads
+                _, _, count_matrix = session.load_dataset(gse_id, "NORMALIZED", cache=cache)
+                pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id, True), count_matrix)
+
+                _, _, sparse = session.load_dataset(gse_id, cache=cache, sparse=True)
+                self.assertTrue(all(isinstance(dtype, pandas.SparseDtype) for dtype in sparse.dtypes))
+                _, _, count_matrix = session.load_dataset(gse_id, cache=cache)
+                pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_datasets(self):
+        gse_ids = self.fixtures.gse_ids[:4] + ["GSE1"]
+        pulled = []
+
+        def iter_gse_ids():
+            for gse_id in gse_ids:
+                pulled.append(gse_id)
+                yield gse_id
+
+        results = loader.load_datasets(iter_gse_ids(), max_workers=2, grein_url=self.server.url)
+        first = next(results)
+        # only max_workers datasets are submitted ahead of the returned results
+        self.assertLessEqual(len(pulled), 3)
+        loaded = {result.gse_id: result for result in [first] + list(results)}
+        self.assertEqual(set(gse_ids), set(loaded))
+        # the unknown dataset is returned with its error instead of raising it
+        self.assertIsNone(loaded["GSE1"].dataset)
+        self.assertIsInstance(loaded["GSE1"].error, GreinLoaderException)
+        for gse_id in gse_ids[:4]:
+            self.assertIsNone(loaded[gse_id].error)
+            description, metadata, count_matrix = loaded[gse_id].dataset
+            self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+            pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+
+    def test_unknown_dataset(self):
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            with self.assertRaises(GreinLoaderException):
+                session.load_dataset("GSE1")
+
+    def test_overview(self):
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            overview = session.load_overview()
+            self.assertEqual(self.fixtures.gse_ids, [dataset["geo_accession"] for dataset in overview])
+            self.assertEqual(overview[:3], session.load_overview(3))
+            self.assertEqual(overview, list(session.iter_overview(page_size=2, prefetch=True)))
+        self.assertEqual(overview, loader.load_overview(grein_url=self.server.url))
+        self.assertEqual(overview, list(loader.iter_overview(page_size=2, grein_url=self.server.url)))
+
+    def test_session_expired(self):
+        gse_id = self.fixtures.gse_ids[2]
+        with loader.GreinSession(grein_url=self.server.url) as session:
+            session.load_dataset(gse_id)
+            self.server.expire_sessions()
+            description, metadata, count_matrix = session.load_dataset(gse_id, "NORMALIZED")
+        pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id, True), count_matrix)
+
+    def test_scheduler_retries(self):
+        scheduler = loader.RequestScheduler(max_sessions=2, rate=50, max_rate=200, retries=8, backoff=0.01)
+        with GreinServer(self.fixtures, error_rate=0.3) as server:
+            with loader.GreinSession(grein_url=server.url, scheduler=scheduler) as session:
+                for gse_id in self.fixtures.gse_ids[:3]:
+                    description, metadata, count_matrix = session.load_dataset(gse_id)
+                    self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+                    pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+            self.assertGreater(server.error_count, 0)
+        self.assertGreater(scheduler.failures, 0)
+
+    @unittest.skipIf(async_loader.aiohttp is None, "aiohttp is not installed")
+    def test_async_dataset(self):
+        gse_id = self.fixtures.gse_ids[3]
+        description, metadata, count_matrix = asyncio.run(async_loader.load_dataset(gse_id,
+                                                                                    grein_url=self.server.url))
+        self.assertEqual(self.fixtures.overview_row(gse_id)[3], description["Title"])
+        self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+        pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+        overview = asyncio.run(async_loader.load_overview(grein_url=self.server.url))
+        self.assertEqual(self.fixtures.gse_ids, [dataset["geo_accession"] for dataset in overview])
+
+    @unittest.skipIf(async_loader.aiohttp is None, "aiohttp is not installed")
+    def test_async_timeout(self):
+        async def wait_for_lost_message():
+            connection = async_loader._AsyncGreinConnection(None, self.server.url, timeout=0.05)
+            await connection.wait_for(lambda message: True)
+
+        # a message which never arrives, e.g. a lost ACK, does not block forever
+        with self.assertRaises(GreinLoaderException):
+            asyncio.run(wait_for_lost_message())
+        with GreinServer(self.fixtures, latency=1.0) as server:
+            with self.assertRaises(GreinLoaderException):
+                asyncio.run(async_loader.load_dataset(self.fixtures.gse_ids[0], grein_url=server.url, timeout=0.2))
+
+    def test_recorded_fixtures(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.fixtures.save(directory)
+            recorded = RecordedFixtures(directory)
+            self.assertEqual(self.fixtures.gse_ids, recorded.gse_ids)
+            gse_id = self.fixtures.gse_ids[4]
+            with GreinServer(recorded) as server, loader.GreinSession(grein_url=server.url) as session:
+                description, metadata, count_matrix = session.load_dataset(gse_id)
+            self.assertEqual(self.fixtures.sample_ids(gse_id), list(metadata))
+            pandas.testing.assert_frame_equal(self.expected_count_matrix(gse_id), count_matrix)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import time
+import unittest
+from grein_loader import RequestScheduler
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+class TestScheduler(unittest.TestCase):
+    def test_rate_limit(self):
+        scheduler = RequestScheduler(rate=20, max_rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(6):
+            scheduler.acquire()
+        # the first request uses the burst, the other five wait for a token each
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_adaptive_rate(self):
+        scheduler = RequestScheduler(rate=8, min_rate=1, max_rate=10, backoff=0)
+        scheduler.failure()
+        self.assertEqual(4, scheduler.rate)
+        for _ in range(3):
+            scheduler.failure()
+        self.assertEqual(1, scheduler.rate)
+        for _ in range(100):
+            scheduler.success()
+        self.assertEqual(10, scheduler.rate)
+
+    def test_retry(self):
+        scheduler = RequestScheduler(rate=100, max_rate=100, retries=2, backoff=0.001)
+        responses = [_Response(503), _Response(500), _Response(200)]
+        self.assertEqual(200, scheduler.call(lambda: responses.pop(0)).status_code)
+        self.assertEqual(2, scheduler.failures)
+        responses = [_Response(503)] * 3
+        self.assertEqual(503, scheduler.call(lambda: responses.pop(0)).status_code)
+
+    def test_retry_not_idempotent(self):
+        scheduler = RequestScheduler(rate=100, max_rate=100, retries=2, backoff=0.001)
+        # a request which must not be sent twice is only retried if it was rejected before it was processed
+        responses = [_Response(500), _Response(200)]
+        self.assertEqual(500, scheduler.call(lambda: responses.pop(0), idempotent=False).status_code)
+        self.assertEqual(1, len(responses))
+        responses = [_Response(429), _Response(200)]
+        self.assertEqual(200, scheduler.call(lambda: responses.pop(0), idempotent=False).status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
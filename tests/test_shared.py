@@ -0,0 +1,83 @@
+import os
+import sys
+import pickle
+import tempfile
+import unittest
+import subprocess
+import multiprocessing
+import numpy
+import pandas
+import grein_loader as loader
+
+
+def column_sums(shared):
+    # the worker receives the name of the block and attaches to it
+    with shared:
+        return shared.count_matrix.sum(axis=0).to_dict(), shared.metadata["GSM2"]["tissue"]
+
+
+class TestShared(unittest.TestCase):
+    def setUp(self):
+        self.count_matrix = pandas.DataFrame({"gene": ["ENSG1", "ENSG2", "ENSG3"], "GSM1": [1, 2, 3],
+                                              "GSM2": [4, 5, 6]})
+        self.metadata = {"GSM1": {"tissue": "liver"}, "GSM2": {"tissue": "lung"}}
+
+    def test_attach(self):
+        with loader.share_dataset(({"Title": "Liver"}, self.metadata, self.count_matrix)) as shared:
+            attached = loader.attach_dataset(shared.name)
+            count_matrix = attached.count_matrix
+            # the values are a read-only view of the shared memory
+            self.assertTrue(numpy.shares_memory(count_matrix.to_numpy(), attached.values))
+            with self.assertRaises(ValueError):
+                attached.values[0, 0] = 10
+            pandas.testing.assert_frame_equal(self.count_matrix.set_index("gene"), count_matrix, check_names=False)
+            pandas.testing.assert_frame_equal(self.count_matrix, attached.to_dataframe())
+            self.assertEqual({"Title": "Liver"}, attached.description)
+            self.assertEqual(self.metadata, attached.metadata)
+            # only the name is pickled
+            self.assertLess(len(pickle.dumps(attached)), 200)
+            del count_matrix
+            attached.close()
+        with self.assertRaises(FileNotFoundError):
+            loader.attach_dataset(shared.name)
+
+    def test_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = loader.write_count_store(self.count_matrix, os.path.join(directory, "store"), dtype="int32")
+            metadata = loader.formatting._metadata_dict_to_frame(
+                {sample: {"geo_accession": sample, **values} for sample, values in self.metadata.items()})
+            with loader.share_dataset((None, self.metadata, store)) as shared, \
+                    multiprocessing.get_context("spawn").Pool(2) as pool:
+                results = pool.map(column_sums, [shared] * 2)
+            self.assertEqual([({"GSM1": 6, "GSM2": 15}, "lung")] * 2, results)
+
+            with loader.share_dataset((None, metadata, self.count_matrix)) as shared:
+                pandas.testing.assert_frame_equal(metadata, shared.metadata)
+
+    def test_nullable_dtypes(self):
+        with loader.share_dataset(self.count_matrix.astype({"GSM1": "Int64", "GSM2": "Int64"})) as shared:
+            self.assertEqual(numpy.dtype("int64"), shared.dtype)
+            pandas.testing.assert_frame_equal(self.count_matrix, shared.to_dataframe())
+        # missing values are stored as NaN
+        missing = self.count_matrix.astype({"GSM1": "Int64"})
+        missing.loc[1, "GSM1"] = pandas.NA
+        with loader.share_dataset(missing) as shared:
+            self.assertEqual(numpy.dtype("float64"), shared.dtype)
+            numpy.testing.assert_array_equal([[1, 4], [numpy.nan, 5], [3, 6]], shared.values)
+
+    def test_attach_from_other_process(self):
+        # a process which attached to the block and exited does not unlink it
+        path = os.path.dirname(os.path.dirname(os.path.abspath(loader.__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([path, os.environ.get("PYTHONPATH", "")]))
+        with loader.share_dataset(self.count_matrix) as shared:
+            code = f"import grein_loader; print(int(grein_loader.attach_dataset({shared.name!r}).values.sum()))"
+            for _ in range(2):
+                output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, check=True)
+                self.assertEqual(b"21", output.stdout.strip())
+                self.assertNotIn(b"leaked", output.stderr)
+            attached = loader.attach_dataset(shared.name)
+            pandas.testing.assert_frame_equal(self.count_matrix, attached.to_dataframe())
+            attached.close()
+
+if __name__ == '__main__':
+    unittest.main()
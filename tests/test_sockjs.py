@@ -0,0 +1,49 @@
+import json
+import unittest
+from grein_loader import sockjs
+from grein_loader.formatting import _metadata_labels
+
+
+def frame(*messages) -> bytes:
+    return b"a" + json.dumps(list(messages)).encode() + b"\n"
+
+
+class TestFrameDecoder(unittest.TestCase):
+    def test_frames(self):
+        config = json.dumps({"config": {"workerId": "", "sessionId": "abc", "user": None}})
+        data = b"h" * 2048 + b"\no\n" + frame("0#0|m|" + config, "ACK 1A") + b"h\n" + b'c[3000,"Go away!"]\n'
+        messages = sockjs.FrameDecoder().feed(data)
+        self.assertEqual([sockjs.HEARTBEAT, sockjs.OPEN, sockjs.CONFIG, sockjs.ACK, sockjs.HEARTBEAT, sockjs.CLOSE],
+                         [message.kind for message in messages])
+        self.assertEqual("abc", messages[2].data["config"]["sessionId"])
+        self.assertEqual(0, messages[2].message_id)
+        self.assertEqual(0x1A, messages[3].message_id)
+        self.assertEqual([3000, "Go away!"], messages[5].data)
+
+    def test_split_frames(self):
+        table = '<table class="display"><thead><tr><th>""</th><th>geo_accession</th></tr></thead></table>'
+        values = json.dumps({"values": {"metadata_full": {"x": {"container": table}}}})
+        data = frame("1#0|m|" + values) + frame("ACK B")
+        decoder = sockjs.FrameDecoder()
+        messages = []
+        # frames are split at every possible position over the chunks
+        for start in range(0, len(data), 7):
+            messages += decoder.feed(data[start:start + 7])
+        self.assertEqual([sockjs.VALUES, sockjs.ACK], [message.kind for message in messages])
+        self.assertEqual(1, messages[0].message_id)
+        self.assertEqual(['""', "geo_accession"], _metadata_labels(messages))
+
+    def test_ack_in_values(self):
+        # an ACK inside an output is not an acknowledgement
+        messages = sockjs.FrameDecoder().feed(frame('1#0|m|{"values": {"text": "ACK 99"}}'))
+        self.assertEqual([sockjs.VALUES], [message.kind for message in messages])
+
+    def test_messages(self):
+        self.assertEqual(sockjs.MESSAGE, sockjs.decode_message('2#0|m|{"progress": {"type": "binding"}}').kind)
+        self.assertEqual(sockjs.VALUES, sockjs.decode_message('{"values": {}}').kind)
+        self.assertIsNone(sockjs.decode_message("ACK").message_id)
+        self.assertEqual([], _metadata_labels([sockjs.decode_message('{"values": {"geo_acc_ui": "GSE1"}}')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
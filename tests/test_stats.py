@@ -0,0 +1,42 @@
+import io
+import time
+import unittest
+import pandas
+from grein_loader import LoadStats
+
+
+class TestStats(unittest.TestCase):
+    def test_nested_phases(self):
+        stats = LoadStats()
+        with stats.phase("outer"):
+            stats.add(requests=1, bytes_sent=10)
+            time.sleep(0.02)
+            with stats.phase("inner"):
+                stats.add(requests=2, bytes_received=100)
+                time.sleep(0.05)
+        with stats.phase("inner"):
+            pass
+        self.assertEqual(["outer", "inner"], list(stats.phases))
+        self.assertEqual(1, stats.phases["outer"].requests)
+        self.assertEqual(2, stats.phases["inner"].requests)
+        self.assertEqual(2, stats.phases["inner"].calls)
+        self.assertEqual(100, stats.bytes_received)
+        self.assertEqual(10, stats.bytes_sent)
+        # the time of the inner phase is not counted for the outer phase
+        self.assertLess(stats.phases["outer"].seconds, 0.045)
+        self.assertGreaterEqual(stats.phases["inner"].seconds, 0.05)
+        self.assertEqual({"seconds", "bytes_received", "bytes_sent", "requests", "calls"},
+                         set(stats.as_dict()["inner"]))
+
+    def test_reader(self):
+        content = b"gene,GSM1\nENSG1,10\nENSG2,0\n"
+        stats = LoadStats()
+        with stats.phase("parse"):
+            count_matrix = pandas.read_csv(stats.reader(io.BytesIO(content), "download"))
+        self.assertEqual([10, 0], list(count_matrix["GSM1"]))
+        self.assertEqual(len(content), stats.phases["download"].bytes_received)
+        self.assertEqual(0, stats.phases["parse"].bytes_received)
+
+
+if __name__ == '__main__':
+    unittest.main()